@@ -0,0 +1,155 @@
+"""
+Contrôle d'admission par classe de route : chaque classe (heavy pour les calculs de
+compatibilité, write pour les mutations, read pour les lectures simples) a sa limite de
+requêtes simultanées et une file d'attente bornée. Au-delà de la file, ou après
+`queue_timeout` secondes d'attente, la requête est refusée tout de suite (503 par
+défaut, ou 429) avec `Retry-After` plutôt que de s'empiler devant Neo4j ; une rafale de
+top-K ne prive donc plus les lectures simples du réplica.
+"""
+import asyncio
+import math
+import os
+import re
+import time
+from collections import deque
+
+from . import metrics
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+ADMISSION_REJECT_STATUS = int(os.getenv("ADMISSION_REJECT_STATUS", "503"))
+
+# Classe -> (requêtes simultanées, places en file, attente max en secondes)
+DEFAULT_LIMITS = {
+    "heavy": (8, 16, 2.0),
+    "write": (32, 64, 5.0),
+    "read": (64, 256, 2.0),
+}
+
+# Calculs de compatibilité : top-K, paire, lot et orientation
+HEAVY_PATHS = re.compile(r"^/(users/[^/]+/compatibility/top|compatibility/)")
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Sondes et observabilité ne sont jamais limitées
+EXEMPT_PREFIXES = ("/health/", "/metrics", "/debug/")
+
+
+def route_class(method: str, path: str):
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    if HEAVY_PATHS.match(path):
+        return "heavy"
+    if method in WRITE_METHODS:
+        return "write"
+    return "read"
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Limiter:
+    """Sémaphore FIFO à file bornée ; une place libérée est transmise au premier en attente."""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    async def acquire(self):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise Rejected("queue_full", self.retry_after)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # Client parti pendant l'attente : rendre la place si elle avait été transmise
+            self._abandon(waiter)
+            raise
+        if metrics.METRICS_ENABLED:
+            ADMISSION_QUEUE_TIME.observe(time.perf_counter() - started, self.name)
+        if not waiter.done():
+            self._abandon(waiter)
+            raise Rejected("deadline", self.retry_after)
+
+    def _abandon(self, waiter):
+        if waiter.done() and not waiter.cancelled():
+            self.release()
+            return
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionController:
+    def __init__(self, limits=None):
+        self.limiters = {}
+        for name, (concurrency, queue_size, queue_timeout) in (limits or _limits_from_env()).items():
+            # Concurrence 0 : classe non limitée
+            if concurrency > 0:
+                self.limiters[name] = Limiter(name, concurrency, queue_size, queue_timeout)
+
+    def limiter(self, method: str, path: str):
+        name = route_class(method, path)
+        return self.limiters.get(name) if name else None
+
+    def usage(self, attribute: str):
+        return {(name,): getattr(limiter, attribute) for name, limiter in self.limiters.items()}
+
+
+def _limits_from_env():
+    limits = {}
+    for name, (concurrency, queue_size, queue_timeout) in DEFAULT_LIMITS.items():
+        prefix = f"ADMISSION_{name.upper()}_"
+        limits[name] = (
+            int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+            int(os.getenv(prefix + "QUEUE", str(queue_size))),
+            float(os.getenv(prefix + "QUEUE_TIMEOUT", str(queue_timeout))),
+        )
+    return limits
+
+
+ADMISSION_QUEUE_TIME = metrics.registry.register(metrics.Histogram(
+    "admission_queue_seconds", "Attente en file d'admission par classe de route.", ("route_class",)
+))
+ADMISSION_REJECTIONS = metrics.registry.register(metrics.Counter(
+    "admission_rejections_total", "Requêtes refusées par le contrôle d'admission.", ("route_class", "reason")
+))
+ADMISSION_QUEUE_DEPTH = metrics.registry.register(metrics.Gauge(
+    "admission_queue_depth", "Requêtes en file d'admission par classe de route.", ("route_class",)
+))
+ADMISSION_IN_FLIGHT = metrics.registry.register(metrics.Gauge(
+    "admission_in_flight", "Requêtes admises en cours par classe de route.", ("route_class",)
+))
+
+# Singleton utilisé par le middleware de app.main
+controller = AdmissionController()
+ADMISSION_QUEUE_DEPTH.set_function(lambda: controller.usage("queued"))
+ADMISSION_IN_FLIGHT.set_function(lambda: controller.usage("active"))
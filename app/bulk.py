@@ -0,0 +1,108 @@
+import os
+
+from .counters import TARGET_COUNTERS
+from .database import async_db
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Clé d'unicité par label
+ENTITY_KEYS = {
+    "Song": "id",
+    "Artist": "id",
+    "Playlist": "id",
+    "Genre": "name",
+}
+
+# Type de relation -> (label source, clé source, label cible, clé cible)
+RELATIONSHIPS = {
+    "LIKED": ("User", "id", "Song", "id"),
+    "OWNS": ("User", "id", "Playlist", "id"),
+    "CONTAINS": ("Playlist", "id", "Song", "id"),
+    "HAS_GENRE": ("Song", "id", "Genre", "name"),
+    "LIKES_GENRE": ("User", "id", "Genre", "name"),
+    "FOLLOWS": ("User", "id", "Artist", "id"),
+}
+
+# Le marqueur temporaire distingue les noeuds/relations créés par ce MERGE
+_ENTITY_QUERY = """
+UNWIND $items AS item
+MERGE (n:{label} {{{key}: item.props.{key}}})
+ON CREATE SET n += item.props, n._bulk_created = true
+WITH item, n, n._bulk_created IS NOT NULL AS created
+REMOVE n._bulk_created
+RETURN item.index AS index, created
+"""
+
+USER_BULK_QUERY = """
+UNWIND $items AS item
+MERGE (u:User {id: item.props.id})
+ON CREATE SET u += item.props, u._bulk_created = true
+WITH item, u, u._bulk_created IS NOT NULL AS created
+REMOVE u._bulk_created
+FOREACH (_ IN CASE WHEN created THEN [1] ELSE [] END |
+    MERGE (o:Orientation {name: item.orientation})
+    MERGE (u)-[:HAS_ORIENTATION]->(o)
+)
+RETURN item.index AS index, created
+"""
+
+_RELATIONSHIP_QUERY = """
+UNWIND $items AS item
+MATCH (a:{source_label} {{{source_key}: item.source}}), (b:{target_label} {{{target_key}: item.target}})
+MERGE (a)-[r:{rel_type}]->(b)
+ON CREATE SET r._bulk_created = true{counter}
+WITH item, r, r._bulk_created IS NOT NULL AS created
+REMOVE r._bulk_created
+RETURN item.index AS index, created
+"""
+
+
+def entity_query(label: str) -> str:
+    return _ENTITY_QUERY.format(label=label, key=ENTITY_KEYS[label])
+
+
+def relationship_query(rel_type: str) -> str:
+    source_label, source_key, target_label, target_key = RELATIONSHIPS[rel_type]
+    counter = TARGET_COUNTERS.get(rel_type)
+    return _RELATIONSHIP_QUERY.format(
+        rel_type=rel_type,
+        counter=f", b.{counter} = coalesce(b.{counter}, 0) + 1" if counter else "",
+        source_label=source_label,
+        source_key=source_key,
+        target_label=target_label,
+        target_key=target_key,
+    )
+
+
+async def run_bulk(query: str, items: list, key):
+    """
+    Exécute `query` par tranches de BULK_CHUNK_SIZE, une transaction d'écriture par tranche.
+    Chaque item porte son `index` ; un index absent du résultat signifie qu'un noeud
+    référencé n'existe pas. Renvoie un statut par item : created, existing ou missing.
+    Les doublons (même `key(item)`) ne sont envoyés qu'une fois.
+    """
+    first_seen = {}
+    unique = []
+    for index, item in enumerate(items):
+        if first_seen.setdefault(key(item), index) == index:
+            unique.append({**item, "index": index})
+
+    statuses = ["missing"] * len(items)
+    for start in range(0, len(unique), BULK_CHUNK_SIZE):
+        for record in await async_db.write(query, items=unique[start:start + BULK_CHUNK_SIZE]):
+            statuses[record["index"]] = "created" if record["created"] else "existing"
+
+    for index, item in enumerate(items):
+        first = first_seen[key(item)]
+        if first != index:
+            statuses[index] = "missing" if statuses[first] == "missing" else "existing"
+    return statuses
+
+
+def summarize(statuses):
+    return {
+        "created": statuses.count("created"),
+        "existing": statuses.count("existing"),
+        "missing": statuses.count("missing"),
+        "items": [{"index": index, "status": status} for index, status in enumerate(statuses)],
+    }
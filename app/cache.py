@@ -0,0 +1,164 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .database import async_db
+
+
+# Utilisateurs dont le top-K dépend d'un noeud donné (score partagé avec ce noeud)
+AFFECTED_USERS_QUERIES = {
+    "song": """
+        MATCH (s:Song {id: $key})
+        RETURN [(s)<-[:LIKED]-(x:User) | x.id]
+             + [(s)<-[:CONTAINS]-(:Playlist)<-[:OWNS]-(x:User) | x.id] AS ids
+    """,
+    "genre": """
+        MATCH (g:Genre {name: $key})
+        RETURN [(g)<-[:LIKES_GENRE]-(x:User) | x.id] AS ids
+    """,
+    "playlist": """
+        MATCH (p:Playlist {id: $key})
+        RETURN [(p)<-[:OWNS]-(x:User) | x.id]
+             + [(p)<-[:FOLLOWS]-(x:User) | x.id]
+             + [(p)-[:CONTAINS]->(:Song)<-[:CONTAINS]-(:Playlist)<-[:OWNS]-(x:User) | x.id]
+             + [(p)<-[:OWNS]-(:User)-[:OWNS]->(:Playlist)<-[:OWNS]-(x:User) | x.id] AS ids
+    """,
+}
+
+
+class TopKCache:
+    """
+    Cache LRU/TTL borné des résultats de get_top_compatible_users, indexé par (user_id, limit).
+    En mode stale-while-revalidate, une entrée expirée est servie pendant qu'un seul
+    rafraîchissement tourne en tâche de fond sur la boucle courante.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, stale_while_revalidate: bool = False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._tasks = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            maxsize=int(os.getenv("TOPK_CACHE_SIZE", "0")),
+            ttl=float(os.getenv("TOPK_CACHE_TTL", "60")),
+            stale_while_revalidate=os.getenv("TOPK_CACHE_STALE_WHILE_REVALIDATE", "false").lower() == "true",
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_or_compute(self, user_id: str, limit: int, compute):
+        """`compute` est une fonction sans argument qui renvoie une coroutine."""
+        if not self.enabled:
+            return await compute()
+        key = (user_id, limit)
+        with self._lock:
+            entry = self._entries.get(key)
+            generation = self._generation
+            if entry is not None:
+                value, stored_at = entry
+                self._entries.move_to_end(key)
+                if time.monotonic() - stored_at < self.ttl:
+                    return value
+                if self.stale_while_revalidate:
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        task = asyncio.create_task(self._refresh(key, compute, generation))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                    return value
+        value = await compute()
+        self._store(key, value, generation)
+        return value
+
+    async def _refresh(self, key, compute, generation):
+        try:
+            self._store(key, await compute(), generation)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            # Une invalidation pendant le calcul rend le résultat potentiellement périmé
+            if generation != self._generation:
+                return
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_users(self, user_ids):
+        """Supprime les top-K des utilisateurs donnés et ceux où ils apparaissent."""
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        with self._lock:
+            self._generation += 1
+            for key in list(self._entries):
+                value, _ = self._entries[key]
+                if key[0] in user_ids or any(row["user"].get("id") in user_ids for row in value):
+                    del self._entries[key]
+
+    def invalidate_incomplete(self):
+        """Un nouvel utilisateur (score 0) peut entrer dans les listes incomplètes ou à égalité à 0."""
+        with self._lock:
+            self._generation += 1
+            for key in list(self._entries):
+                value, _ = self._entries[key]
+                if len(value) < key[1] or any(row["compatibility_score"] <= 0 for row in value):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+# Singleton du cache
+topk_cache = TopKCache.from_env()
+
+
+async def invalidate_related(users=(), song=None, genre=None, playlist=None):
+    """
+    Invalide le top-K des utilisateurs touchés par une mutation et renvoie leurs ids (None
+    si le cache est vide). Pour une suppression, appeler avant le DETACH DELETE afin que les
+    relations soient encore visibles, puis invalidate_after_delete.
+    """
+    if not topk_cache.enabled:
+        return None
+    if not len(topk_cache):
+        # Rien à parcourir, mais un calcul en cours ne doit pas stocker l'état d'avant l'écriture
+        topk_cache.clear()
+        return None
+    affected = set(users)
+    for kind, key in (("song", song), ("genre", genre), ("playlist", playlist)):
+        if key is None:
+            continue
+        for record in await async_db.read(AFFECTED_USERS_QUERIES[kind], key=key, query_name="cache.invalidate_related"):
+            affected.update(record["ids"])
+    topk_cache.invalidate_users(affected)
+    return affected
+
+
+def invalidate_after_delete(affected):
+    """Second passage après la suppression : un calcul lancé entre-temps a pu lire l'état d'avant."""
+    if not topk_cache.enabled:
+        return
+    if affected is None:
+        topk_cache.clear()
+    else:
+        topk_cache.invalidate_users(affected)
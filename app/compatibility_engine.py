@@ -0,0 +1,370 @@
+import os
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # moteur optionnel
+    np = None
+    sparse = None
+
+
+GENRE_POINTS = 25
+SONG_WEIGHT, SONG_CAP = 1.75, 20
+PLAYLIST_WEIGHT, PLAYLIST_CAP = 1.5, 10
+PERSONAL_WEIGHT, PERSONAL_CAP = 0.4, 50
+SIMILARITY_WEIGHT = 5
+MAX_SCORE = 100
+
+# Relations de l'API lues par le moteur (FOLLOWS y vise des playlists, l'API des artistes)
+SCORE_RELATIONSHIPS = {"LIKED", "LIKES_GENRE", "OWNS", "CONTAINS"}
+
+
+def cypher_round(value: float, digits: int = 2) -> float:
+    """Arrondi identique au round() de Cypher (HALF_UP sur la représentation décimale)."""
+    quantum = Decimal(1).scaleb(-digits)
+    return float(Decimal(repr(float(value))).quantize(quantum, rounding=ROUND_HALF_UP))
+
+
+def is_available() -> bool:
+    return np is not None and sparse is not None
+
+
+class _Index:
+    def __init__(self):
+        self.positions = {}
+
+    def add(self, key):
+        if key not in self.positions:
+            self.positions[key] = len(self.positions)
+        return self.positions[key]
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class CompatibilityEngine:
+    """
+    Garde en mémoire les incidences utilisateur x (chanson, genre, playlist publique,
+    chanson de playlist possédée) sous forme de matrices creuses et calcule le score
+    de CRUD.get_top_compatible_users pour tous les candidats en un seul produit.
+    """
+
+    def __init__(self, max_age: float = None):
+        if not is_available():
+            raise RuntimeError("numpy and scipy are required for the compatibility engine")
+        self.max_age = max_age if max_age is not None else float(os.getenv("COMPATIBILITY_ENGINE_MAX_AGE", "300"))
+        self.min_reload = float(os.getenv("COMPATIBILITY_ENGINE_MIN_RELOAD", "5"))
+        self.loaded_at = None
+        # Écritures locales signalées, et celles déjà visibles au dernier chargement
+        self._changes = 0
+        self._loaded_changes = 0
+        self._lock = threading.Lock()
+        self._users = []
+        self._user_props = []
+        self._user_index = {}
+        self._orientation_rows = {}
+
+    # --- Construction ---
+    def build(self, users, liked, likes_genre, follows_public, owns, contains, changes=None):
+        """
+        users: liste de dicts de propriétés User (avec 'id', et 'orientation' facultative,
+        retirée des propriétés renvoyées)
+        liked: (user_id, song_id), likes_genre: (user_id, genre_name),
+        follows_public: (user_id, playlist_id) vers des playlists publiques,
+        owns: (user_id, playlist_id), contains: (playlist_id, song_id).
+        Les doublons sont conservés : Cypher compte des chemins, pas des paires.
+        `changes` : valeur de mark_changed() lue avant la lecture des données.
+        """
+        user_index = _Index()
+        props, orientations = [], []
+        for user in users:
+            before = len(user_index)
+            user_index.add(user["id"])
+            if len(user_index) > before:
+                prop = dict(user)
+                orientations.append(prop.pop("orientation", None))
+                props.append(prop)
+        # Masque des lignes par orientation, pour le top-K filtré sans parcourir les identifiants
+        orientations = np.array(orientations, dtype=object)
+        orientation_rows = {o: orientations == o for o in set(orientations.tolist()) if o is not None}
+
+        songs, genres, public_playlists, playlists = _Index(), _Index(), _Index(), _Index()
+
+        def incidence(pairs, columns):
+            rows, cols = [], []
+            for user_id, key in pairs:
+                row = user_index.positions.get(user_id)
+                if row is None:
+                    continue
+                rows.append(row)
+                cols.append(columns.add(key))
+            return rows, cols
+
+        liked_rows, liked_cols = incidence(liked, songs)
+        genre_rows, genre_cols = incidence(likes_genre, genres)
+        follow_rows, follow_cols = incidence(follows_public, public_playlists)
+        owns_rows, owns_cols = incidence(owns, playlists)
+
+        n_users = len(user_index)
+
+        def matrix(rows, cols, width):
+            data = np.ones(len(rows), dtype=np.float64)
+            return sparse.csr_matrix((data, (rows, cols)), shape=(n_users, max(width, 1)))
+
+        # Taille de chaque playlist possédée (nombre de relations CONTAINS)
+        playlist_sizes = np.zeros(max(len(playlists), 1), dtype=np.float64)
+        contains_rows, contains_cols = [], []
+        playlist_songs = _Index()
+        for playlist_id, song_id in contains:
+            position = playlists.positions.get(playlist_id)
+            if position is None:
+                continue
+            playlist_sizes[position] += 1
+            contains_rows.append(position)
+            contains_cols.append(playlist_songs.add(song_id))
+
+        owns_matrix = matrix(owns_rows, owns_cols, len(playlists))
+        contains_matrix = sparse.csr_matrix(
+            (np.ones(len(contains_rows)), (contains_rows, contains_cols)),
+            shape=(max(len(playlists), 1), max(len(playlist_songs), 1)),
+        )
+        # Chemins OWNS/CONTAINS par (utilisateur, chanson) : le count des relations CURATES
+        paths = (owns_matrix @ contains_matrix).tocsr()
+        # Chansons distinctes présentes dans les playlists possédées par chaque utilisateur
+        curated = paths.astype(bool).astype(np.float64).tocsr()
+        # Comme Cypher, qui n'emprunte pas deux fois la même relation CONTAINS, une chanson
+        # que les deux utilisateurs n'atteignent que par la même playlist co-possédée ne
+        # compte pas : une colonne par relation (playlist, chanson), remplie quand c'est
+        # l'unique chemin de l'utilisateur vers la chanson. Le produit de ce bloc est
+        # retranché des chansons communes.
+        entries = list(dict.fromkeys(zip(contains_rows, contains_cols)))
+        entry_playlists = sparse.csr_matrix(
+            (np.ones(len(entries)), ([p for p, _ in entries], range(len(entries)))),
+            shape=(max(len(playlists), 1), max(len(entries), 1)),
+        )
+        entry_songs = sparse.csr_matrix(
+            (np.ones(len(entries)), ([s for _, s in entries], range(len(entries)))),
+            shape=(max(len(playlist_songs), 1), max(len(entries), 1)),
+        )
+        single = paths.copy()
+        single.data = (single.data == 1).astype(np.float64)
+        single.eliminate_zeros()
+        owns_bool = owns_matrix.astype(bool).astype(np.float64).tocsr()
+        exclusive = (owns_bool @ entry_playlists).multiply(single @ entry_songs).astype(bool).astype(np.float64).tocsr()
+
+        liked_matrix = matrix(liked_rows, liked_cols, len(songs))
+        genre_matrix = matrix(genre_rows, genre_cols, len(genres)).astype(bool).astype(np.float64).tocsr()
+        follow_matrix = matrix(follow_rows, follow_cols, len(public_playlists))
+
+        blocks = [liked_matrix, genre_matrix, follow_matrix, curated, exclusive, owns_bool]
+        offsets = np.cumsum([0] + [block.shape[1] for block in blocks])
+
+        with self._lock:
+            self._users = list(user_index.positions)
+            self._user_props = props
+            self._user_index = user_index.positions
+            self._orientation_rows = orientation_rows
+            # Toutes les incidences côte à côte : un seul produit creux par requête
+            self._features = sparse.hstack(blocks, format="csr")
+            self._offsets = offsets
+            self._owns = owns_matrix
+            self._playlist_sizes = playlist_sizes
+            self._owned_paths = np.asarray(owns_matrix @ playlist_sizes).ravel()
+            self.loaded_at = time.monotonic()
+            self._loaded_changes = self._changes if changes is None else changes
+        return self
+
+    def load(self, session):
+        """Charge les incidences depuis Neo4j (une requête par type de relation)."""
+        changes = self._changes
+        users = [r["u"] for r in session.run(
+            "MATCH (u:User) WHERE u.id IS NOT NULL "
+            "RETURN u {.id, .name, .gender, .age, orientation: head([(u)-[:HAS_ORIENTATION]->(o) | o.name])} AS u")]
+        liked = [(r["u"], r["s"]) for r in session.run(
+            "MATCH (u:User)-[:LIKED]->(s:Song) RETURN u.id AS u, elementId(s) AS s")]
+        likes_genre = [(r["u"], r["g"]) for r in session.run(
+            "MATCH (u:User)-[:LIKES_GENRE]->(g:Genre) RETURN u.id AS u, elementId(g) AS g")]
+        follows = [(r["u"], r["p"]) for r in session.run(
+            "MATCH (u:User)-[:FOLLOWS]->(p:Playlist {public: true}) RETURN u.id AS u, elementId(p) AS p")]
+        owns = [(r["u"], r["p"]) for r in session.run(
+            "MATCH (u:User)-[:OWNS]->(p:Playlist) RETURN u.id AS u, elementId(p) AS p")]
+        contains = [(r["p"], r["s"]) for r in session.run(
+            "MATCH (:User)-[:OWNS]->(p:Playlist) WITH DISTINCT p "
+            "MATCH (p)-[:CONTAINS]->(s) RETURN elementId(p) AS p, elementId(s) AS s")]
+        return self.build(users, liked, likes_genre, follows, owns, contains, changes)
+
+    def __getstate__(self):
+        # Envoyé aux processus du calcul de toutes les paires : le verrou ne se sérialise pas
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def user_ids(self) -> list:
+        """Identifiants dans l'ordre des lignes des matrices."""
+        return list(self._users)
+
+    @property
+    def dirty(self) -> bool:
+        """Une écriture locale validée depuis le chargement n'est pas dans les matrices."""
+        return self._changes != self._loaded_changes
+
+    def mark_changed(self):
+        self._changes += 1
+
+    def is_stale(self) -> bool:
+        # Après une écriture, rechargement au plus toutes les `min_reload` secondes
+        if self.loaded_at is None:
+            return True
+        age = time.monotonic() - self.loaded_at
+        return age > self.max_age or (self.dirty and age >= self.min_reload)
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    # --- Scoring ---
+    def top_compatible_users(self, user_id: str, limit: int = 5, candidates=None, orientations=None, exclude=()):
+        """
+        `candidates` (identifiants) restreint les lignes évaluées, ex. issues de l'index LSH ;
+        `orientations` les limite aux orientations lues au chargement, `exclude` en retire.
+        """
+        with self._lock:
+            target = self._user_index.get(user_id)
+            if target is None or limit <= 0:
+                return []
+            features, offsets = self._features, self._offsets
+            owns, sizes, owned_paths = self._owns, self._playlist_sizes, self._owned_paths
+            users, props = self._users, self._user_props
+            if candidates is None:
+                rows = np.arange(len(users))
+            else:
+                rows = np.array(sorted(
+                    {self._user_index[c] for c in candidates if c in self._user_index} - {target}
+                ), dtype=np.int64)
+            if orientations is not None:
+                allowed = np.zeros(len(users), dtype=bool)
+                for orientation in orientations:
+                    mask = self._orientation_rows.get(orientation)
+                    if mask is not None:
+                        allowed |= mask
+                rows = rows[allowed[rows]]
+            if exclude:
+                excluded = [self._user_index[e] for e in exclude if e in self._user_index]
+                rows = rows[~np.isin(rows, excluded)]
+
+        # Matrice cible (colonnes x termes) : chaque terme ne voit que son bloc.
+        # Pour le terme de similarité, la ligne cible est pondérée par la taille des playlists.
+        row = features[target].tocoo()
+        terms = np.searchsorted(offsets, row.col, side="right") - 1
+        values = row.data.copy()
+        owned = terms == len(offsets) - 2
+        owned_cols = row.col[owned] - offsets[-2]
+        values[owned] = np.asarray(owns[target, owned_cols].todense()).ravel() * sizes[owned_cols]
+        target_matrix = sparse.csr_matrix(
+            (values, (row.col, terms)), shape=(features.shape[1], len(offsets) - 1)
+        )
+        products = (features[rows] @ target_matrix).toarray()
+        shared_songs, shared_genres, shared_playlists, curated, exclusive, common_paths = products.T
+        personal = curated - exclusive
+
+        total_paths = owned_paths[target] + owned_paths[rows]
+        union = total_paths - common_paths
+        similarity = np.divide(common_paths, union, out=np.zeros_like(union), where=total_paths > 0)
+
+        raw = (
+            (shared_genres > 0) * GENRE_POINTS
+            + np.minimum(shared_songs, SONG_CAP) * SONG_WEIGHT
+            + np.minimum(shared_playlists, PLAYLIST_CAP) * PLAYLIST_WEIGHT
+            + np.minimum(personal, PERSONAL_CAP) * PERSONAL_WEIGHT
+            + similarity * SIMILARITY_WEIGHT
+        )
+        scores = np.minimum(raw, MAX_SCORE)
+        scores[rows == target] = -np.inf
+
+        available = len(rows) - int(np.count_nonzero(rows == target))
+        k = min(limit, available)
+        if k <= 0:
+            return []
+        # Sélection partielle puis tri des k meilleurs seulement
+        if k < available:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.flatnonzero(np.isfinite(scores))
+        best = sorted(best, key=lambda i: (-scores[i], users[rows[i]]))
+
+        return [
+            {
+                "user": props[rows[i]],
+                "shared_genres": int(shared_genres[i]),
+                "shared_songs": int(shared_songs[i]),
+                "shared_playlists": int(shared_playlists[i]),
+                "personal_playlist_matches": int(personal[i]),
+                "compatibility_score": cypher_round(scores[i]),
+            }
+            for i in best
+        ]
+
+    def pair_scores(self, rows, cols):
+        """
+        Scores de toutes les paires (ligne, colonne) entre deux blocs de positions, chaque
+        ligne jouant le rôle de la cible de top_compatible_users. Renvoie des matrices
+        denses len(rows) x len(cols) : shared_songs, shared_genres, shared_playlists,
+        personal, scores (non arrondis).
+        """
+        features, offsets = self._features, self._offsets
+        left, right = features[rows], features[cols]
+        terms = []
+        for t in range(len(offsets) - 2):
+            start, end = offsets[t], offsets[t + 1]
+            terms.append((left[:, start:end] @ right[:, start:end].T).toarray())
+        shared_songs, shared_genres, shared_playlists, curated, exclusive = terms
+        personal = curated - exclusive
+        # Similarité : playlists possédées de la ligne pondérées par leur taille
+        owns = self._owns[rows].multiply(self._playlist_sizes).tocsr()
+        owned_bool = right[:, offsets[-2]:offsets[-1]]
+        common_paths = (owns @ owned_bool.T).toarray()
+
+        total_paths = self._owned_paths[rows][:, None] + self._owned_paths[cols][None, :]
+        union = total_paths - common_paths
+        similarity = np.divide(common_paths, union, out=np.zeros_like(union), where=total_paths > 0)
+        raw = (
+            (shared_genres > 0) * GENRE_POINTS
+            + np.minimum(shared_songs, SONG_CAP) * SONG_WEIGHT
+            + np.minimum(shared_playlists, PLAYLIST_CAP) * PLAYLIST_WEIGHT
+            + np.minimum(personal, PERSONAL_CAP) * PERSONAL_WEIGHT
+            + similarity * SIMILARITY_WEIGHT
+        )
+        return shared_songs, shared_genres, shared_playlists, personal, np.minimum(raw, MAX_SCORE)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def engine_enabled() -> bool:
+    return os.getenv("COMPATIBILITY_ENGINE", "cypher").lower() == "sparse" and is_available()
+
+
+def mark_engine_changed():
+    """À appeler après une écriture validée qui touche le score (dépôts Neo4j)."""
+    if _engine is not None:
+        _engine.mark_changed()
+
+
+def get_engine(session_factory):
+    """Retourne le moteur partagé, rechargé depuis Neo4j s'il est périmé."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = CompatibilityEngine()
+        if _engine.is_stale():
+            with session_factory() as session:
+                _engine.load(session)
+        return _engine
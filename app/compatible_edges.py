@@ -0,0 +1,253 @@
+"""
+Calcul hors ligne de la compatibilité de toutes les paires d'utilisateurs, matérialisée
+en relations `(:User)-[:COMPATIBLE {score, computed_at, ...}]->(:User)`.
+
+Les utilisateurs, triés par id, sont découpés en blocs ; chaque bloc de lignes est
+confronté aux blocs suivants (triangle supérieur) par un pool de processus, avec le
+score du moteur creux (même formule que CRUD.get_user_compatibility). Seules les paires
+d'un score supérieur ou égal au seuil sont écrites, une relation par paire (de l'id le
+plus petit vers le plus grand, le score étant symétrique), par transactions UNWIND.
+
+Un noeud `BatchCheckpoint` enregistre les blocs terminés : relancé avec les mêmes
+paramètres sur les mêmes utilisateurs et des données inchangées (versions
+`ResourceVersion` des labels du score), le job reprend où il s'était arrêté. Chaque calcul
+écrit ses propres relations (clé `computed_at`) ; la lecture ne voit que celles du dernier
+calcul terminé (`published_at` du checkpoint), puis les précédentes sont supprimées.
+
+    python -m app.compatible_edges --threshold 25 --block-size 2000 --workers 4
+    python -m app.compatible_edges --restart   # ignore le checkpoint en cours
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from neo4j import READ_ACCESS
+
+from .compatibility_engine import CompatibilityEngine, cypher_round
+from .database import async_db, db
+from .versions import SYNC_QUERY
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "compatible_edges"
+DEFAULT_THRESHOLD = float(os.getenv("COMPATIBLE_EDGES_THRESHOLD", "25"))
+DEFAULT_BLOCK_SIZE = int(os.getenv("COMPATIBLE_EDGES_BLOCK_SIZE", "2000"))
+WRITE_CHUNK_SIZE = int(os.getenv("COMPATIBLE_EDGES_WRITE_CHUNK_SIZE", "5000"))
+
+# Labels dont les mutations (noeuds ou relations) changent les scores
+WATERMARK_LABELS = ("User", "Song", "Genre", "Playlist")
+
+WRITE_EDGES_QUERY = """
+UNWIND $edges AS edge
+MATCH (a:User {id: edge.source}), (b:User {id: edge.target})
+MERGE (a)-[c:COMPATIBLE {computed_at: $computed_at}]->(b)
+SET c.score = edge.score,
+    c.shared_genres = edge.shared_genres,
+    c.shared_songs = edge.shared_songs,
+    c.shared_playlists = edge.shared_playlists,
+    c.personal_playlist_matches = edge.personal_playlist_matches
+"""
+
+DELETE_STALE_QUERY = """
+MATCH ()-[c:COMPATIBLE]->()
+WHERE c.computed_at < $computed_at
+WITH c LIMIT $limit
+DELETE c
+RETURN count(*) AS count
+"""
+
+CHECKPOINT_QUERY = "MATCH (c:BatchCheckpoint {job: $job}) RETURN c {.*} AS checkpoint"
+
+START_CHECKPOINT_QUERY = """
+MERGE (c:BatchCheckpoint {job: $job})
+WITH c, c.published_at AS published_at
+SET c = $props, c.job = $job, c.completed = [], c.status = 'running', c.published_at = published_at
+"""
+
+BLOCK_DONE_QUERY = """
+MATCH (c:BatchCheckpoint {job: $job, run_id: $run_id})
+SET c.completed = c.completed + $block, c.updated_at = $now
+"""
+
+FINISH_CHECKPOINT_QUERY = """
+MATCH (c:BatchCheckpoint {job: $job, run_id: $run_id})
+SET c.status = 'done', c.finished_at = $now, c.edges = $edges, c.published_at = c.computed_at
+"""
+
+
+def fingerprint(user_ids) -> str:
+    """Identifie l'ensemble des utilisateurs : les blocs n'ont de sens que pour le même ensemble."""
+    digest = hashlib.sha1()
+    for user_id in sorted(user_ids):
+        digest.update(user_id.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+async def watermark() -> str:
+    """Versions des labels du score, lues avant le chargement : toute mutation de l'API les incrémente."""
+    versions = {record["label"]: record["version"] for record in await async_db.read(SYNC_QUERY, query_name="compatible_edges.watermark")}
+    return ",".join(f"{label}:{versions.get(label, 0)}" for label in WATERMARK_LABELS)
+
+
+# --- Calcul (processus du pool) ---
+_worker = {}
+
+
+def _init_worker(engine, order, block_size, threshold):
+    _worker.update(engine=engine, order=order, block_size=block_size, threshold=threshold)
+
+
+def score_block(block: int, engine=None, order=None, block_size=None, threshold=None):
+    """
+    Relations d'un bloc de lignes contre lui-même et les blocs suivants. `order` donne
+    les positions des utilisateurs dans les matrices, triées par id.
+    """
+    engine = engine or _worker["engine"]
+    order = order if order is not None else _worker["order"]
+    block_size = block_size or _worker["block_size"]
+    threshold = threshold if threshold is not None else _worker["threshold"]
+    user_ids = engine.user_ids
+
+    start = block * block_size
+    rows = order[start:start + block_size]
+    edges = []
+    for col_start in range(start, len(order), block_size):
+        cols = order[col_start:col_start + block_size]
+        songs, genres, playlists, personal, scores = engine.pair_scores(rows, cols)
+        for i, j in zip(*(scores >= threshold).nonzero()):
+            # Triangle supérieur : chaque paire une seule fois, sans la diagonale
+            if start + i >= col_start + j:
+                continue
+            edges.append({
+                "source": user_ids[rows[i]],
+                "target": user_ids[cols[j]],
+                "score": cypher_round(scores[i, j]),
+                "shared_genres": int(genres[i, j]),
+                "shared_songs": int(songs[i, j]),
+                "shared_playlists": int(playlists[i, j]),
+                "personal_playlist_matches": int(personal[i, j]),
+            })
+    return block, edges
+
+
+# --- Orchestration ---
+def load_engine() -> CompatibilityEngine:
+    with db.get_session(READ_ACCESS) as session:
+        return CompatibilityEngine().load(session)
+
+
+async def write_edges(edges, computed_at, chunk_size=WRITE_CHUNK_SIZE):
+    for start in range(0, len(edges), chunk_size):
+        await async_db.write(WRITE_EDGES_QUERY, edges=edges[start:start + chunk_size], computed_at=computed_at, query_name="compatible_edges.write_edges")
+
+
+async def delete_stale(computed_at, chunk_size=10000):
+    deleted = 0
+    while True:
+        records = await async_db.write(DELETE_STALE_QUERY, computed_at=computed_at, limit=chunk_size, query_name="compatible_edges.delete_stale")
+        deleted += records[0]["count"]
+        if records[0]["count"] == 0:
+            return deleted
+
+
+async def _checkpoint(params, restart):
+    """Checkpoint à reprendre, ou nouveau calcul si les paramètres, les utilisateurs ou les données ont changé."""
+    records = await async_db.read(CHECKPOINT_QUERY, job=JOB_NAME, query_name="compatible_edges._checkpoint")
+    checkpoint = records[0]["checkpoint"] if records else None
+    if (
+        not restart and checkpoint and checkpoint.get("status") == "running"
+        and all(checkpoint.get(k) == v for k, v in params.items())
+    ):
+        logger.info("Resuming run %s: %d blocks done", checkpoint["run_id"], len(checkpoint["completed"]))
+        return checkpoint
+    checkpoint = {
+        **params,
+        "run_id": uuid.uuid4().hex,
+        "computed_at": datetime.now(timezone.utc).isoformat(),
+        "completed": [],
+    }
+    await async_db.write(START_CHECKPOINT_QUERY, job=JOB_NAME, props={k: v for k, v in checkpoint.items() if k != "completed"}, query_name="compatible_edges._checkpoint")
+    return checkpoint
+
+
+async def run(threshold=DEFAULT_THRESHOLD, block_size=DEFAULT_BLOCK_SIZE, workers=None, restart=False):
+    if threshold <= 0:
+        # Sans seuil, toutes les paires (score 0 compris) seraient écrites
+        raise ValueError("threshold must be positive")
+    started = time.perf_counter()
+    data_version = await watermark()
+    engine = await asyncio.to_thread(load_engine)
+    user_ids = engine.user_ids
+    order = sorted(range(len(user_ids)), key=user_ids.__getitem__)
+    blocks = (len(order) + block_size - 1) // block_size
+    params = {
+        "threshold": threshold, "block_size": block_size, "users": len(order),
+        "fingerprint": fingerprint(user_ids), "watermark": data_version,
+    }
+    checkpoint = await _checkpoint(params, restart)
+    done = set(checkpoint["completed"])
+    pending = [block for block in range(blocks) if block not in done]
+
+    loop = asyncio.get_running_loop()
+    workers = workers or os.cpu_count() or 1
+    edges_written = 0
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(engine, order, block_size, threshold)) as pool:
+        # Fenêtre bornée : les résultats ne s'accumulent pas plus vite qu'ils ne sont écrits
+        in_flight = set()
+        while pending or in_flight:
+            while pending and len(in_flight) < workers * 2:
+                in_flight.add(loop.run_in_executor(pool, score_block, pending.pop(0)))
+            finished, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                block, edges = future.result()
+                await write_edges(edges, checkpoint["computed_at"])
+                await async_db.write(
+                    BLOCK_DONE_QUERY, job=JOB_NAME, run_id=checkpoint["run_id"], block=block,
+                    now=datetime.now(timezone.utc).isoformat(), query_name="compatible_edges.run",
+                )
+                edges_written += len(edges)
+                logger.info("Block %d/%d: %d edges", block + 1, blocks, len(edges))
+
+    # Publication avant suppression : les lectures passent d'un calcul complet à l'autre
+    await async_db.write(
+        FINISH_CHECKPOINT_QUERY, job=JOB_NAME, run_id=checkpoint["run_id"],
+        now=datetime.now(timezone.utc).isoformat(), edges=edges_written, query_name="compatible_edges.run",
+    )
+    stale = await delete_stale(checkpoint["computed_at"])
+    summary = {
+        "run_id": checkpoint["run_id"], "users": len(order), "blocks": blocks, "resumed_blocks": len(done),
+        "edges_written": edges_written, "stale_deleted": stale, "seconds": round(time.perf_counter() - started, 1),
+    }
+    logger.info("Compatible edges computed: %s", summary)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="score minimal d'une relation écrite")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="utilisateurs par bloc")
+    parser.add_argument("--workers", type=int, help="processus de calcul (défaut : nombre de coeurs)")
+    parser.add_argument("--restart", action="store_true", help="ignore le checkpoint en cours")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def job():
+        try:
+            return await run(args.threshold, args.block_size, args.workers, args.restart)
+        finally:
+            await async_db.close()
+            db.close()
+
+    for key, value in asyncio.run(job()).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Compteurs dénormalisés, tenus à jour dans la transaction des endpoints qui créent ou
+suppriment les relations correspondantes.
+
+Popularité (degré entrant, voir DEGREE_COUNTERS) : `Song.like_count`,
+`Song.playlist_count`, `Genre.song_count`, `Genre.listener_count`, `Artist.follower_count`.
+
+Similarité de playlists :
+
+- `Playlist.song_count` : nombre de relations CONTAINS de la playlist ;
+- `User.owned_song_count` : somme des `song_count` des playlists possédées ;
+- `(u:User)-[:CURATES {count}]->(s:Song)` : nombre de playlists de `u` contenant `s`.
+
+Les migrations 0004 (similarité) et 0005 (popularité) les initialisent ; `counter_status`
+indique si elles sont enregistrées.
+
+    python -m app.counters           # recalcule et corrige toute dérive
+    python -m app.counters --check   # signale la dérive sans rien modifier (code 1 si dérive)
+"""
+import argparse
+import asyncio
+import logging
+
+from . import profiling
+from .database import async_db
+from .versions import versions
+
+logger = logging.getLogger(__name__)
+
+REPAIR_CHUNK_SIZE = 500
+
+# (label, propriété, motif dont le nombre de correspondances donne la valeur attendue)
+POPULARITY_COUNTERS = [
+    ("Song", "like_count", "(n)<-[:LIKED]-(:User)"),
+    ("Song", "playlist_count", "(n)<-[:CONTAINS]-(:Playlist)"),
+    ("Genre", "song_count", "(n)<-[:HAS_GENRE]-(:Song)"),
+    ("Genre", "listener_count", "(n)<-[:LIKES_GENRE]-(:User)"),
+    ("Artist", "follower_count", "(n)<-[:FOLLOWS]-(:User)"),
+]
+SIMILARITY_COUNTERS = [
+    ("Playlist", "song_count", "(n)-[:CONTAINS]->()"),
+    ("User", "owned_song_count", "(n)-[:OWNS]->(:Playlist)-[:CONTAINS]->()"),
+]
+DEGREE_COUNTERS = POPULARITY_COUNTERS + SIMILARITY_COUNTERS
+
+# Migrations qui initialisent les compteurs (app.migrations)
+COUNTER_MIGRATIONS = ("0004_playlist_counters", "0005_popularity_counters")
+
+COUNTER_MIGRATIONS_QUERY = "MATCH (m:SchemaMigration) WHERE m.id IN $ids RETURN count(m) AS count"
+
+# Type de relation -> compteur incrémenté sur la cible à sa création (imports en masse)
+TARGET_COUNTERS = {
+    "LIKED": "like_count",
+    "CONTAINS": "playlist_count",
+    "HAS_GENRE": "song_count",
+    "LIKES_GENRE": "listener_count",
+    "FOLLOWS": "follower_count",
+}
+
+_DRIFT_QUERY = """
+MATCH (n:{label})
+WITH n, size([{pattern} | 1]) AS actual
+WHERE coalesce(n.{prop}, 0) <> actual
+{action}
+RETURN count(n) AS count
+"""
+
+# Ajout (delta = 1) ou retrait (delta = -1) d'une chanson dans une playlist
+CONTAINS_DELTA_QUERY = """
+MATCH (p:Playlist {id: $playlist_id}), (s:Song {id: $song_id})
+SET p.song_count = coalesce(p.song_count, 0) + $delta
+WITH p, s
+MATCH (u:User)-[:OWNS]->(p)
+SET u.owned_song_count = coalesce(u.owned_song_count, 0) + $delta
+MERGE (u)-[c:CURATES]->(s)
+SET c.count = coalesce(c.count, 0) + $delta
+WITH c WHERE c.count <= 0
+DELETE c
+"""
+
+# Prise (delta = 1) ou perte (delta = -1) de propriété d'une playlist
+OWNS_DELTA_QUERY = """
+MATCH (u:User {id: $user_id}), (p:Playlist {id: $playlist_id})
+SET u.owned_song_count = coalesce(u.owned_song_count, 0) + $delta * coalesce(p.song_count, 0)
+WITH u, p
+MATCH (p)-[:CONTAINS]->(s:Song)
+MERGE (u)-[c:CURATES]->(s)
+SET c.count = coalesce(c.count, 0) + $delta
+WITH c WHERE c.count <= 0
+DELETE c
+"""
+
+# À exécuter avant DETACH DELETE de la playlist
+PLAYLIST_DELETE_QUERY = """
+MATCH (u:User)-[:OWNS]->(p:Playlist {id: $playlist_id})
+SET u.owned_song_count = coalesce(u.owned_song_count, 0) - coalesce(p.song_count, 0)
+WITH u, p
+MATCH (p)-[:CONTAINS]->(s:Song)<-[c:CURATES]-(u)
+SET c.count = c.count - 1
+WITH c WHERE c.count <= 0
+DELETE c
+"""
+
+# À exécuter avant DETACH DELETE de la chanson (ses CURATES disparaissent avec elle)
+SONG_DELETE_QUERY = """
+MATCH (p:Playlist)-[:CONTAINS]->(:Song {id: $song_id})
+SET p.song_count = coalesce(p.song_count, 0) - 1
+WITH p
+MATCH (u:User)-[:OWNS]->(p)
+SET u.owned_song_count = coalesce(u.owned_song_count, 0) - 1
+"""
+
+REPAIR_PLAYLISTS_QUERY = """
+UNWIND $ids AS playlist_id
+MATCH (p:Playlist {id: playlist_id})
+SET p.song_count = size([(p)-[:CONTAINS]->() | 1])
+"""
+
+REPAIR_USERS_QUERY = """
+UNWIND $ids AS user_id
+MATCH (u:User {id: user_id})
+OPTIONAL MATCH (u)-[old:CURATES]->()
+DELETE old
+WITH DISTINCT u
+SET u.owned_song_count = size([(u)-[:OWNS]->(:Playlist)-[:CONTAINS]->() | 1])
+WITH u
+MATCH (u)-[:OWNS]->(:Playlist)-[:CONTAINS]->(s:Song)
+WITH u, s, count(*) AS multiplicity
+CREATE (u)-[:CURATES {count: multiplicity}]->(s)
+"""
+
+OWNERS_QUERY = """
+UNWIND $ids AS playlist_id
+MATCH (u:User)-[:OWNS]->(:Playlist {id: playlist_id})
+RETURN DISTINCT u.id AS id
+"""
+
+
+class CountersPending(RuntimeError):
+    """Écriture refusée : un delta sur un compteur jamais initialisé y laisserait une valeur fausse."""
+
+
+class CounterStatus:
+    """Compteurs initialisés : migrations 0004 et 0005 enregistrées (définitif une fois vrai)."""
+
+    def __init__(self):
+        self.ready = False
+
+    def require(self):
+        if not self.ready:
+            raise CountersPending("counter migrations 0004/0005 not applied yet")
+
+    async def refresh(self, connection) -> bool:
+        if not self.ready:
+            records = await connection.read(COUNTER_MIGRATIONS_QUERY, ids=list(COUNTER_MIGRATIONS), query_name="counters.refresh")
+            self.ready = records[0]["count"] == len(COUNTER_MIGRATIONS)
+        return self.ready
+
+
+async def write_with_counters(query, counter_query, **params):
+    """
+    Exécute `query` puis, dans la même transaction, `counter_query` si la relation
+    a réellement été créée ou supprimée (colonne `changed` du premier enregistrement).
+    """
+    async def work(tx):
+        records = await profiling.run(tx, query, **params)
+        if records and records[0]["changed"]:
+            await profiling.run(tx, counter_query, **params)
+        return records
+    return await async_db.execute_write(work)
+
+
+async def delete_with_counters(counter_query, query, **params):
+    """Décompte puis suppression d'un noeud, dans une seule transaction."""
+    async def work(tx):
+        await profiling.run(tx, counter_query, **params)
+        return await profiling.run(tx, query, **params)
+    return await async_db.execute_write(work)
+
+
+def drift_query(label: str, prop: str, pattern: str, fix: bool = False) -> str:
+    action = f"SET n.{prop} = actual" if fix else ""
+    return _DRIFT_QUERY.format(label=label, prop=prop, pattern=pattern, action=action)
+
+
+async def check():
+    """Nombre de noeuds dont le compteur diffère du graphe, par compteur."""
+    drift = {}
+    for label, prop, pattern in DEGREE_COUNTERS:
+        records = await async_db.read(drift_query(label, prop, pattern), query_name="counters.check")
+        drift[f"{label}.{prop}"] = records[0]["count"]
+    return drift
+
+
+async def _in_chunks(query, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), REPAIR_CHUNK_SIZE):
+        await async_db.write(query, ids=ids[start:start + REPAIR_CHUNK_SIZE], query_name="counters._in_chunks")
+
+
+async def repair_playlists(playlist_ids):
+    """Recalcule les compteurs de playlists données et de leurs propriétaires (ex. après un import en masse)."""
+    playlist_ids = list(playlist_ids)
+    user_ids = [r["id"] for r in await async_db.read(OWNERS_QUERY, ids=playlist_ids, query_name="counters.repair_playlists")]
+    await _in_chunks(REPAIR_PLAYLISTS_QUERY, playlist_ids)
+    await _in_chunks(REPAIR_USERS_QUERY, user_ids)
+
+
+async def _repair_degrees(counters):
+    fixed = {}
+    for label, prop, pattern in counters:
+        records = await async_db.write(drift_query(label, prop, pattern, fix=True), query_name="counters._repair_degrees")
+        fixed[f"{label}.{prop}"] = records[0]["count"]
+    # Les compteurs exposés par les GET ont pu changer
+    await versions.touch(async_db, *{label for label, _, _ in counters})
+    return fixed
+
+
+async def repair_popularity():
+    """Corrige les compteurs de popularité (migration 0005)."""
+    return await _repair_degrees(POPULARITY_COUNTERS)
+
+
+async def repair_similarity():
+    """Corrige les compteurs de playlists et reconstruit les relations CURATES (migration 0004)."""
+    fixed = await _repair_degrees(SIMILARITY_COUNTERS)
+    user_ids = [r["id"] for r in await async_db.read("MATCH (u:User) RETURN u.id AS id", query_name="counters.repair_similarity")]
+    await _in_chunks(REPAIR_USERS_QUERY, user_ids)
+    return fixed
+
+
+async def repair():
+    """Corrige tous les compteurs depuis le graphe ; renvoie le nombre de noeuds corrigés par compteur."""
+    fixed = {**await repair_popularity(), **await repair_similarity()}
+    logger.info("Counters repaired: %s", fixed)
+    return fixed
+
+
+# Singleton partagé par les dépôts, les sondes et les requêtes de compatibilité
+counter_status = CounterStatus()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--check", action="store_true", help="signale la dérive sans rien modifier")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            if args.check:
+                return await check()
+            return await repair()
+        finally:
+            await async_db.close()
+
+    result = asyncio.run(run())
+    for counter, count in result.items():
+        print(f"{'drift' if args.check else 'fixed'} {counter}: {count}")
+    if args.check:
+        raise SystemExit(1 if any(result.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
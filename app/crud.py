@@ -1,12 +1,20 @@
-from .database import db
+import asyncio
+import os
 
+from neo4j import READ_ACCESS
 
-class CRUD:
-    @staticmethod
-    def get_user_compatibility(user1_id: str, user2_id: str):
-        query = """
-        MATCH (u1:User {id: $user1_id}), (u2:User {id: $user2_id})
+from . import profiling
+from .database import db, async_db
+from .compatibility_engine import engine_enabled, get_engine
+from .counters import counter_status
+from .cache import topk_cache
+from .lsh import lsh_enabled, lsh_index, FALLBACK_SAMPLE
+from .orientation import ORIENTATION_MIN_SCORE, orientation_filter_enabled, orientation_index
+from .singleflight import single_flight
 
+
+# Score d'une paire (u1, u2) déjà liée : partagé par la requête unitaire et le batch
+PAIR_COMPATIBILITY_QUERY = """
         // Genres en commun
         OPTIONAL MATCH (u1)-[:LIKES_GENRE]->(g:Genre)<-[:LIKES_GENRE]-(u2)
         WITH u1, u2, COALESCE(collect(DISTINCT g.name), []) AS shared_genres
@@ -19,14 +27,17 @@ class CRUD:
         OPTIONAL MATCH (u1)-[:FOLLOWS]->(p:Playlist {public: true})<-[:FOLLOWS]-(u2)
         WITH u1, u2, shared_genres, shared_songs, COALESCE(count(p), 0) AS shared_playlists
 
-        // Playlists personnelles
-        OPTIONAL MATCH (u1)-[:OWNS]->(pl1:Playlist)-[:CONTAINS]->(ps:Song)<-[:CONTAINS]-(pl2:Playlist)<-[:OWNS]-(u2)
+        // Playlists personnelles (compteurs maintenus par app.counters)
+        OPTIONAL MATCH (u1)-[c1:CURATES]->(ps:Song)<-[c2:CURATES]-(u2)
+        // Comme le motif OWNS/CONTAINS d'origine : pas de chanson atteinte des deux côtés par la seule même playlist
+        WHERE c1.count > 1 OR c2.count > 1
+           OR NOT EXISTS { MATCH (u1)-[:OWNS]->(cp:Playlist)<-[:OWNS]-(u2) WHERE (cp)-[:CONTAINS]->(ps) }
         WITH u1, u2, shared_genres, shared_songs, shared_playlists,
              COALESCE(count(DISTINCT ps), 0) AS personal_common_songs,
              [
-               size([(u1)-[:OWNS]->(p)-[:CONTAINS]->() | p.id]),
-               size([(u2)-[:OWNS]->(p)-[:CONTAINS]->() | p.id]),
-               size([(u1)-[:OWNS]->(p)-[:CONTAINS]->() WHERE (u2)-[:OWNS]->(p)-[:CONTAINS]->() | p.id])
+               COALESCE(u1.owned_song_count, 0),
+               COALESCE(u2.owned_song_count, 0),
+               reduce(n = 0, c IN [(u1)-[:OWNS]->(p:Playlist)<-[:OWNS]-(u2) | p.song_count] | n + COALESCE(c, 0))
              ] AS similarity_data
 
         // Calcul final avec plafonnement
@@ -57,8 +68,8 @@ class CRUD:
              ) AS compatibility_score
 
         RETURN {
-          user1: u1 {.*},
-          user2: u2 {.*},
+          user1: u1 {.*, orientation: {name: head([(u1)-[:HAS_ORIENTATION]->(o) | o.name])}},
+          user2: u2 {.*, orientation: {name: head([(u2)-[:HAS_ORIENTATION]->(o) | o.name])}},
           shared_genres: shared_genres,
           shared_songs: shared_songs,
           shared_playlists: shared_playlists,
@@ -69,14 +80,10 @@ class CRUD:
             2
           )
         } AS result
-        """
-        with db.get_session() as session:
-            result = session.run(query, user1_id=user1_id, user2_id=user2_id)
-            return result.single()["result"]
+"""
 
-    @staticmethod
-    def get_top_compatible_users(user_id: str, limit: int = 5):
-        query = """
+# Top-K : score de la cible contre chaque autre utilisateur
+TOP_COMPATIBLE_QUERY = """
         MATCH (target:User {id: $user_id})
         MATCH (other:User)
         WHERE other.id <> $user_id
@@ -93,17 +100,20 @@ class CRUD:
         OPTIONAL MATCH (target)-[:FOLLOWS]->(p:Playlist {public: true})<-[:FOLLOWS]-(other)
         WITH target, other, shared_genres_count, shared_songs, count(p) AS shared_playlists
 
-        // Playlists personnelles
-        OPTIONAL MATCH (target)-[:OWNS]->(pl:Playlist)-[:CONTAINS]->(ps:Song)<-[:CONTAINS]-(other_pl:Playlist)<-[:OWNS]-(other)
+        // Playlists personnelles (compteurs maintenus par app.counters)
+        OPTIONAL MATCH (target)-[c1:CURATES]->(ps:Song)<-[c2:CURATES]-(other)
+        // Comme le motif OWNS/CONTAINS d'origine : pas de chanson atteinte des deux côtés par la seule même playlist
+        WHERE c1.count > 1 OR c2.count > 1
+           OR NOT EXISTS { MATCH (target)-[:OWNS]->(cp:Playlist)<-[:OWNS]-(other) WHERE (cp)-[:CONTAINS]->(ps) }
         WITH target, other,
              shared_genres_count,
              shared_songs,
              shared_playlists,
              count(DISTINCT ps) AS personal_common_songs,
              [
-               size([(target)-[:OWNS]->(p)-[:CONTAINS]->() WHERE p IS NOT NULL | p]),
-               size([(other)-[:OWNS]->(p)-[:CONTAINS]->() WHERE p IS NOT NULL | p]),
-               size([(target)-[:OWNS]->(p)-[:CONTAINS]->() WHERE (other)-[:OWNS]->(p)-[:CONTAINS]->() AND p IS NOT NULL | p])
+               COALESCE(target.owned_song_count, 0),
+               COALESCE(other.owned_song_count, 0),
+               reduce(n = 0, c IN [(target)-[:OWNS]->(p:Playlist)<-[:OWNS]-(other) | p.song_count] | n + COALESCE(c, 0))
              ] AS similarity_data
 
         // Calcul de compatibilité
@@ -134,7 +144,7 @@ class CRUD:
              ) AS raw_score
 
         RETURN {
-            user: other {.*},
+            user: other {.id, .name, .gender, .age},
             shared_genres: shared_genres_count,
             shared_songs: shared_songs,
             shared_playlists: shared_playlists,
@@ -146,21 +156,278 @@ class CRUD:
         } AS result
         ORDER BY result.compatibility_score DESC
         LIMIT $limit
+"""
+
+# Même score, restreint aux candidats fournis par l'index LSH
+TOP_COMPATIBLE_CANDIDATES_QUERY = TOP_COMPATIBLE_QUERY.replace(
+    """MATCH (other:User)
+        WHERE other.id <> $user_id""",
+    """UNWIND $candidate_ids AS candidate_id
+        MATCH (other:User {id: candidate_id})
+        WHERE other.id <> $user_id""",
+)
+
+# Même score, restreint aux utilisateurs des orientations compatibles avec la cible
+TOP_COMPATIBLE_ORIENTATION_QUERY = TOP_COMPATIBLE_QUERY.replace(
+    """MATCH (other:User)
+        WHERE other.id <> $user_id""",
+    """UNWIND $orientations AS orientation
+        MATCH (:Orientation {name: orientation})<-[:HAS_ORIENTATION]-(other:User)
+        WHERE other.id <> $user_id""",
+)
+
+# Top-K lu dans les relations COMPATIBLE calculées hors ligne (app.compatible_edges) :
+# seules celles du dernier calcul terminé, jamais celles d'un calcul en cours ; seuls
+# les utilisateurs au-dessus de son seuil y figurent
+TOP_COMPATIBLE_MATERIALIZED_QUERY = """
+MATCH (job:BatchCheckpoint {job: 'compatible_edges'})
+WITH job.published_at AS published_at
+WHERE published_at IS NOT NULL
+MATCH (:User {id: $user_id})-[c:COMPATIBLE {computed_at: published_at}]-(other:User)
+WITH other, c
+ORDER BY c.score DESC, other.id
+LIMIT $limit
+RETURN {
+    user: other {.id, .name, .gender, .age},
+    shared_genres: c.shared_genres,
+    shared_songs: c.shared_songs,
+    shared_playlists: c.shared_playlists,
+    personal_playlist_matches: c.personal_playlist_matches,
+    compatibility_score: c.score,
+    computed_at: c.computed_at
+} AS result
+"""
+
+USER_COMPATIBILITY_QUERY = """
+MATCH (u1:User {id: $user1_id}), (u2:User {id: $user2_id})
+""" + PAIR_COMPATIBILITY_QUERY
+
+BATCH_COMPATIBILITY_QUERY = """
+UNWIND $pairs AS pair
+MATCH (u1:User {id: pair.user1_id}), (u2:User {id: pair.user2_id})
+CALL {
+WITH u1, u2
+""" + PAIR_COMPATIBILITY_QUERY + """
+}
+RETURN pair.index AS index, result
+"""
+
+ORIENTATION_COMPATIBILITY_QUERY = """
+MATCH (u1:User {id: $user1_id})-[:HAS_ORIENTATION]->(o1:Orientation),
+      (u2:User {id: $user2_id})-[:HAS_ORIENTATION]->(o2:Orientation),
+      (o1)-[r:COMPATIBLE_WITH]->(o2)
+RETURN r.score AS score
+"""
+
+# Termes personnels par les chemins OWNS/CONTAINS d'origine : tant que la migration 0004
+# n'est pas enregistrée, CURATES et les compteurs de playlists liraient 0
+_COUNTER_TERMS = [
+    (
+        """        OPTIONAL MATCH ({a})-[c1:CURATES]->(ps:Song)<-[c2:CURATES]-({b})
+        // Comme le motif OWNS/CONTAINS d'origine : pas de chanson atteinte des deux côtés par la seule même playlist
+        WHERE c1.count > 1 OR c2.count > 1
+           OR NOT EXISTS {{ MATCH ({a})-[:OWNS]->(cp:Playlist)<-[:OWNS]-({b}) WHERE (cp)-[:CONTAINS]->(ps) }}""",
+        """        OPTIONAL MATCH ({a})-[:OWNS]->(:Playlist)-[:CONTAINS]->(ps:Song)<-[:CONTAINS]-(:Playlist)<-[:OWNS]-({b})""",
+    ),
+    (
+        """               COALESCE({a}.owned_song_count, 0),
+               COALESCE({b}.owned_song_count, 0),
+               reduce(n = 0, c IN [({a})-[:OWNS]->(p:Playlist)<-[:OWNS]-({b}) | p.song_count] | n + COALESCE(c, 0))""",
+        """               size([({a})-[:OWNS]->(p)-[:CONTAINS]->() | p.id]),
+               size([({b})-[:OWNS]->(p)-[:CONTAINS]->() | p.id]),
+               size([({a})-[:OWNS]->(p)-[:CONTAINS]->() WHERE ({b})-[:OWNS]->(p)-[:CONTAINS]->() | p.id])""",
+    ),
+]
+
+
+def _traversal_query(query: str, a: str, b: str) -> str:
+    for counters, traversal in _COUNTER_TERMS:
+        counters = counters.format(a=a, b=b)
+        if counters not in query:
+            raise ValueError("counter terms not found in query")
+        query = query.replace(counters, traversal.format(a=a, b=b))
+    return query
+
+
+TRAVERSAL_QUERIES = {
+    **{query: _traversal_query(query, "u1", "u2") for query in (USER_COMPATIBILITY_QUERY, BATCH_COMPATIBILITY_QUERY)},
+    **{
+        query: _traversal_query(query, "target", "other")
+        for query in (TOP_COMPATIBLE_QUERY, TOP_COMPATIBLE_CANDIDATES_QUERY, TOP_COMPATIBLE_ORIENTATION_QUERY)
+    },
+}
+
+
+def counted(query: str) -> str:
+    """`query` si les compteurs sont initialisés, sinon son équivalent par les chemins."""
+    return query if counter_status.ready else TRAVERSAL_QUERIES[query]
+
+
+BATCH_CHUNK_SIZE = int(os.getenv("COMPATIBILITY_BATCH_CHUNK_SIZE", "200"))
+
+# Upsert idempotent : MERGE sur l'id et remplacement de l'orientation, en une transaction
+UPSERT_USER_QUERY = """
+        MERGE (u:User {id: $id})
+        SET u.name = $name, u.gender = $gender, u.age = $age
+        WITH u
+        OPTIONAL MATCH (u)-[old:HAS_ORIENTATION]->(previous:Orientation)
+        WHERE previous.name <> $orientation_name
+        DELETE old
+        WITH DISTINCT u
+        MERGE (o:Orientation {name: $orientation_name})
+        MERGE (u)-[:HAS_ORIENTATION]->(o)
+        RETURN u.id AS id, u.name AS name, u.gender AS gender, u.age AS age, o.name AS orientation
+"""
+
+
+class CRUD:
+    @staticmethod
+    @single_flight
+    async def get_user_compatibility(user1_id: str, user2_id: str):
+        records = await async_db.read(counted(USER_COMPATIBILITY_QUERY), user1_id=user1_id, user2_id=user2_id, query_name="crud.get_user_compatibility")
+        return records[0]["result"] if records else None
+
+    @staticmethod
+    async def get_users_compatibility_batch(pairs):
+        """
+        Calcule la compatibilité de plusieurs paires (user1_id, user2_id) avec une requête
+        UNWIND par tranche. Renvoie une liste alignée sur `pairs` : None si un des
+        utilisateurs est inconnu.
         """
-        with db.get_session() as session:
-            return [record["result"] for record in session.run(query, user_id=user_id, limit=limit)]
+        async def work(tx):
+            results = [None] * len(pairs)
+            for start in range(0, len(pairs), BATCH_CHUNK_SIZE):
+                chunk = [
+                    {"index": index, "user1_id": user1_id, "user2_id": user2_id}
+                    for index, (user1_id, user2_id) in enumerate(pairs[start:start + BATCH_CHUNK_SIZE], start)
+                ]
+                for record in await profiling.run(tx, counted(BATCH_COMPATIBILITY_QUERY), pairs=chunk):
+                    results[record["index"]] = record["result"]
+            return results
+
+        return await async_db.execute_read(work, query_name="crud.get_users_compatibility_batch")
+
+    @staticmethod
+    @single_flight
+    async def get_top_compatible_users(user_id: str, limit: int = 5):
+        return await topk_cache.get_or_compute(
+            user_id, limit, lambda: CRUD._compute_top_compatible_users(user_id, limit)
+        )
+
+    @staticmethod
+    @single_flight
+    async def get_top_compatible_users_materialized(user_id: str, limit: int = 5):
+        records = await async_db.read(TOP_COMPATIBLE_MATERIALIZED_QUERY, user_id=user_id, limit=limit, query_name="crud.get_top_compatible_users_materialized")
+        return [record["result"] for record in records]
+
+    @staticmethod
+    async def _compute_top_compatible_users(user_id: str, limit: int = 5):
+        candidates = CRUD._lsh_candidates(user_id) if lsh_enabled() else None
+        orientations = await CRUD._compatible_orientations(user_id) if orientation_filter_enabled() else None
+        if engine_enabled():
+            # Chargement et produit creux hors de la boucle d'événements
+            engine = await asyncio.to_thread(get_engine, lambda: db.get_session(READ_ACCESS))
+            if not engine.dirty:
+                if orientations is not None:
+                    # Sans candidats LSH, le masque d'orientations du moteur remplace le pool
+                    def rank(pool, rejected):
+                        return asyncio.to_thread(
+                            engine.top_compatible_users, user_id, limit, pool, orientations, rejected
+                        )
+
+                    return await CRUD._top_with_orientations(user_id, orientations, candidates, rank)
+                return await asyncio.to_thread(engine.top_compatible_users, user_id, limit, candidates)
+            # Écriture locale pas encore rechargée : requête Cypher, à jour et donc cacheable
+        if candidates is not None:
+            async def rank(pool, rejected=()):
+                records = await async_db.read(
+                    counted(TOP_COMPATIBLE_CANDIDATES_QUERY), user_id=user_id, limit=limit, candidate_ids=list(pool), query_name="crud._compute_top_compatible_users"
+                )
+                return [record["result"] for record in records]
+
+            if orientations is not None:
+                return await CRUD._top_with_orientations(user_id, orientations, candidates, rank)
+            return await rank(candidates)
+        if orientations is not None:
+            records = await async_db.read(
+                counted(TOP_COMPATIBLE_ORIENTATION_QUERY), user_id=user_id, limit=limit, orientations=orientations, query_name="crud._compute_top_compatible_users"
+            )
+            return [record["result"] for record in records]
+        return await CRUD._get_top_compatible_users_cypher(user_id, limit)
 
     @staticmethod
-    def get_orientation_compatibility(user1_id: str, user2_id: str):
-        query = """
-        MATCH (u1:User {id: $user1_id})-[:HAS_ORIENTATION]->(o1:Orientation),
-              (u2:User {id: $user2_id})-[:HAS_ORIENTATION]->(o2:Orientation),
-              (o1)-[r:COMPATIBLE_WITH]->(o2)
-        RETURN r.score AS score
+    async def _top_with_orientations(user_id: str, orientations, pool, rank):
+        """
+        Top-K de `rank(pool, rejected)` restreint aux orientations autorisées : l'index local
+        élague le pool (None : le moteur applique son masque d'orientations), les orientations
+        du résultat sont relues en base et les rejetés retirés.
         """
-        with db.get_session() as session:
-            result = session.run(query, user1_id=user1_id, user2_id=user2_id)
-            record = result.single()
-            if record:
-                return record["score"]
+        allowed = set(orientations)
+        if pool is not None:
+            pool = orientation_index.filter_candidates(user_id, allowed, pool)
+        rejected = set()
+        while True:
+            results = await rank(pool, rejected)
+            ids = [result["user"]["id"] for result in results]
+            current = await orientation_index.refresh_users(async_db, ids) if ids else {}
+            stale = {i for i in ids if current.get(i) not in allowed}
+            if not stale:
+                return results
+            rejected |= stale
+            if pool is not None:
+                pool -= stale
+
+    @staticmethod
+    async def _compatible_orientations(user_id: str):
+        # Sans index chargé (ou cible inconnue), pas de pré-filtre pour cette requête
+        if orientation_index.is_stale():
+            orientation_index.schedule_reload(async_db)
+        if orientation_index.loaded_at is not None and not orientation_index.current(user_id):
+            await orientation_index.refresh_users(async_db, [user_id])
+        return orientation_index.compatible_orientations(user_id, ORIENTATION_MIN_SCORE)
+
+    @staticmethod
+    def _lsh_candidates(user_id: str):
+        # Approximation : les utilisateurs hors des bandes LSH et de l'échantillon sont ignorés
+        if lsh_index.is_stale():
+            lsh_index.schedule_reload(async_db)
+        if not lsh_index.built:
+            # Premier chargement en cours : top-K exact
             return None
+        return lsh_index.candidates(user_id, FALLBACK_SAMPLE)
+
+    @staticmethod
+    async def _get_top_compatible_users_cypher(user_id: str, limit: int = 5):
+        records = await async_db.read(counted(TOP_COMPATIBLE_QUERY), user_id=user_id, limit=limit, query_name="crud._get_top_compatible_users_cypher")
+        return [record["result"] for record in records]
+
+    @staticmethod
+    async def upsert_user(user):
+        records = await async_db.write(
+            UPSERT_USER_QUERY,
+            id=user.id,
+            name=user.name,
+            gender=user.gender,
+            age=user.age,
+            orientation_name=user.orientation.name, query_name="crud.upsert_user"
+        )
+        return records[0]
+
+    @staticmethod
+    @single_flight
+    async def get_orientation_compatibility(user1_id: str, user2_id: str):
+        if orientation_index.is_stale():
+            orientation_index.schedule_reload(async_db)
+        stale = [u for u in (user1_id, user2_id) if not orientation_index.current(u)]
+        if stale and orientation_index.loaded_at is not None:
+            # Modifié ou supprimé (ici ou sur un autre réplica) depuis sa lecture : relu en base
+            current = await orientation_index.refresh_users(async_db, stale)
+            if any(current.get(u) is None for u in stale):
+                return None
+        known, score = orientation_index.score(user1_id, user2_id)
+        if known:
+            return score
+        records = await async_db.read(ORIENTATION_COMPATIBILITY_QUERY, user1_id=user1_id, user2_id=user2_id, query_name="crud.get_orientation_compatibility")
+        if records:
+            return records[0]["score"]
+        return None
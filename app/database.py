@@ -1,31 +1,195 @@
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, AsyncGraphDatabase, Bookmarks, READ_ACCESS, WRITE_ACCESS
 from dotenv import load_dotenv
+from contextvars import ContextVar
+from . import metrics, profiling
+import asyncio
 import os
+import threading
+import time
+import weakref
 
 load_dotenv()
 
+# Bookmarks reçus/produits par la requête HTTP en cours (voir le middleware de app.main)
+request_bookmarks: ContextVar = ContextVar("request_bookmarks", default=None)
+
+
+def driver_config():
+    """Réglages du pool de connexions, lus dans l'environnement."""
+    config = {
+        "max_connection_pool_size": int(os.getenv("NEO4J_MAX_POOL_SIZE", "100")),
+        "connection_acquisition_timeout": float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", "60")),
+        "max_connection_lifetime": float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600")),
+        "connection_timeout": float(os.getenv("NEO4J_CONNECTION_TIMEOUT", "30")),
+        "max_transaction_retry_time": float(os.getenv("NEO4J_MAX_TRANSACTION_RETRY_TIME", "30")),
+    }
+    database = os.getenv("NEO4J_DATABASE")
+    if database:
+        config["database"] = database
+    return config
+
+
+class _BookmarkTracker:
+    """Derniers bookmarks d'écriture du processus, fusionnés avec ceux de la requête HTTP."""
 
-class Neo4jConnection:
     def __init__(self):
+        self.last = Bookmarks()
+
+    def for_read(self):
+        bookmarks = self.last
+        context = request_bookmarks.get()
+        if context and context.get("incoming"):
+            bookmarks = bookmarks + Bookmarks.from_raw_values(context["incoming"])
+        return bookmarks
+
+    def record_write(self, bookmarks):
+        self.last = bookmarks
+        context = request_bookmarks.get()
+        if context is not None:
+            context["outgoing"] = list(bookmarks.raw_values)
+
+
+async def _timed(mode, call, query_name=None):
+    """
+    Mesure la transaction et expose son nom logique à app.profiling : `query_name` passé
+    par l'appelant, sinon celui du contexte (méthodes des dépôts), sinon "unknown".
+    """
+    label = query_name or metrics.query_name.get() or "unknown"
+    token = metrics.query_name.set(label)
+    started = time.perf_counter()
+    try:
+        return await call()
+    except Exception:
+        if metrics.METRICS_ENABLED:
+            metrics.NEO4J_QUERY_ERRORS.inc(label, mode)
+        raise
+    finally:
+        metrics.query_name.reset(token)
+        if metrics.METRICS_ENABLED:
+            metrics.NEO4J_QUERY_DURATION.observe(time.perf_counter() - started, label, mode)
+
+
+class Neo4jConnection:
+    """
+    Driver synchrone créé au premier usage : importer l'application (tests, outils,
+    démarrage des workers) n'ouvre ni driver ni connexion.
+    `bookmarks` : suivi partagé avec la connexion asynchrone, pour que les lectures
+    synchrones (chargement du moteur) voient les écritures faites par async_db.
+    """
+
+    def __init__(self, bookmarks=None):
         self.uri = os.getenv("NEO4J_URI")
         self.user = os.getenv("NEO4J_USER")
         self.password = os.getenv("NEO4J_PASSWORD")
-        self.driver = None
+        self._driver = None
+        self._lock = threading.Lock()
+        self.bookmarks = bookmarks or _BookmarkTracker()
 
     def connect(self):
-        self.driver = GraphDatabase.driver(
-            self.uri,
-            auth=(self.user, self.password)
-        )
         return self
 
+    @property
+    def driver(self):
+        # Utilisé depuis des threads (asyncio.to_thread) : création unique sous verrou
+        if self._driver is None:
+            with self._lock:
+                if self._driver is None:
+                    self._driver = GraphDatabase.driver(
+                        self.uri,
+                        auth=(self.user, self.password),
+                        **driver_config()
+                    )
+        return self._driver
+
     def close(self):
-        if self.driver:
-            self.driver.close()
+        if self._driver:
+            self._driver.close()
+            self._driver = None
+
+    def get_session(self, access_mode=WRITE_ACCESS):
+        if access_mode == READ_ACCESS:
+            return self.driver.session(default_access_mode=READ_ACCESS, bookmarks=self.bookmarks.for_read())
+        return self.driver.session(default_access_mode=access_mode)
+
+    def execute_read(self, work):
+        with self.get_session(READ_ACCESS) as session:
+            return session.execute_read(work)
+
+    def execute_write(self, work):
+        with self.get_session(WRITE_ACCESS) as session:
+            value = session.execute_write(work)
+            self.bookmarks.record_write(session.last_bookmarks())
+            return value
+
+    def read(self, query, **params):
+        return self.execute_read(lambda tx: list(tx.run(query, **params)))
+
+    def write(self, query, **params):
+        return self.execute_write(lambda tx: list(tx.run(query, **params)))
+
+
+class AsyncNeo4jConnection:
+    """
+    Variante asynchrone : un driver par boucle d'événements, créé au premier usage
+    (les connexions d'un AsyncDriver sont liées à la boucle qui les a ouvertes).
+    Les lectures et écritures passent par des transactions gérées (routage et reprise
+    automatiques) et propagent les bookmarks pour des lectures causalement cohérentes.
+    """
+
+    def __init__(self):
+        self.uri = os.getenv("NEO4J_URI")
+        self.user = os.getenv("NEO4J_USER")
+        self.password = os.getenv("NEO4J_PASSWORD")
+        self._drivers = weakref.WeakKeyDictionary()
+        self.bookmarks = _BookmarkTracker()
+
+    def connect(self):
+        return self
+
+    @property
+    def driver(self):
+        loop = asyncio.get_running_loop()
+        driver = self._drivers.get(loop)
+        if driver is None:
+            driver = AsyncGraphDatabase.driver(
+                self.uri,
+                auth=(self.user, self.password),
+                **driver_config()
+            )
+            self._drivers[loop] = driver
+        return driver
+
+    async def close(self):
+        driver = self._drivers.pop(asyncio.get_running_loop(), None)
+        if driver:
+            await driver.close()
+
+    def get_session(self, access_mode=WRITE_ACCESS):
+        if access_mode == READ_ACCESS:
+            return self.driver.session(default_access_mode=READ_ACCESS, bookmarks=self.bookmarks.for_read())
+        return self.driver.session(default_access_mode=access_mode)
+
+    async def execute_read(self, work, query_name=None):
+        async def call():
+            async with self.get_session(READ_ACCESS) as session:
+                return await session.execute_read(work)
+        return await _timed("read", call, query_name)
+
+    async def execute_write(self, work, query_name=None):
+        async def call():
+            async with self.get_session(WRITE_ACCESS) as session:
+                value = await session.execute_write(work)
+                self.bookmarks.record_write(await session.last_bookmarks())
+                return value
+        return await _timed("write", call, query_name)
+
+    async def read(self, query, *, query_name=None, **params):
+        return await self.execute_read(lambda tx: profiling.run(tx, query, **params), query_name)
 
-    def get_session(self):
-        return self.driver.session()
+    async def write(self, query, *, query_name=None, **params):
+        return await self.execute_write(lambda tx: profiling.run(tx, query, **params), query_name)
 
 
-# Singleton pour la connexion
-db = Neo4jConnection().connect()
+# Singletons pour la connexion : un seul suivi de bookmarks pour les deux drivers
+async_db = AsyncNeo4jConnection().connect()
+db = Neo4jConnection(async_db.bookmarks).connect()
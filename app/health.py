@@ -0,0 +1,151 @@
+"""
+Migrations, préchauffage au démarrage et sondes Kubernetes.
+
+Migrations (schéma et compteurs) puis préchauffage tournent en tâche de fond pendant que
+le serveur accepte déjà les sondes. Les migrations sont réessayées avec un délai croissant ;
+sans migrations au démarrage, l'instance attend qu'un autre processus ait initialisé les
+compteurs. Le préchauffage ouvre `WARMUP_MIN_CONNECTIONS` connexions du pool en parallèle, puis fait planifier
+les requêtes du chemin chaud par `EXPLAIN` (rien n'est exécuté, le plan entre dans le
+cache de requêtes de Neo4j). `/health/ready` répond 503 tant que l'une de ces étapes
+n'est pas terminée, puis vérifie la base ; `/health/live` ne dépend que de la boucle d'événements.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from neo4j import READ_ACCESS, WRITE_ACCESS
+
+from .counters import counter_status
+from .crud import (
+    BATCH_COMPATIBILITY_QUERY, ORIENTATION_COMPATIBILITY_QUERY, TOP_COMPATIBLE_CANDIDATES_QUERY,
+    TOP_COMPATIBLE_ORIENTATION_QUERY, TOP_COMPATIBLE_QUERY, UPSERT_USER_QUERY, USER_COMPATIBILITY_QUERY,
+)
+from .pagination import page_query
+
+logger = logging.getLogger(__name__)
+
+WARMUP_MIN_CONNECTIONS = int(os.getenv("WARMUP_MIN_CONNECTIONS", "4"))
+WARMUP_PLAN_QUERIES = os.getenv("WARMUP_PLAN_QUERIES", "true").lower() == "true"
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "60"))
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "2"))
+MIGRATION_RETRY_MAX_DELAY = float(os.getenv("MIGRATION_RETRY_MAX_DELAY", "60"))
+COUNTERS_POLL_INTERVAL = float(os.getenv("COUNTERS_POLL_INTERVAL", "10"))
+
+PING_QUERY = "RETURN 1 AS ok"
+
+
+def hot_queries(repositories):
+    """
+    (mode, requête, paramètres) du chemin chaud. Les paramètres ont les types de la
+    production : le cache de plans de Neo4j tient compte du texte et des types.
+    """
+    pair = {"user1_id": "", "user2_id": ""}
+    queries = [
+        (READ_ACCESS, TOP_COMPATIBLE_QUERY, {"user_id": "", "limit": 5}),
+        # Variantes restreintes (TOPK_CANDIDATES=lsh, TOPK_ORIENTATION_FILTER)
+        (READ_ACCESS, TOP_COMPATIBLE_CANDIDATES_QUERY, {"user_id": "", "limit": 5, "candidate_ids": [""]}),
+        (READ_ACCESS, TOP_COMPATIBLE_ORIENTATION_QUERY, {"user_id": "", "limit": 5, "orientations": [""]}),
+        (READ_ACCESS, USER_COMPATIBILITY_QUERY, pair),
+        (READ_ACCESS, BATCH_COMPATIBILITY_QUERY, {"pairs": [{"index": 0, **pair}]}),
+        (READ_ACCESS, ORIENTATION_COMPATIBILITY_QUERY, pair),
+        (WRITE_ACCESS, UPSERT_USER_QUERY, {"id": "", "name": "", "gender": "", "age": 0, "orientation_name": ""}),
+    ]
+    for repository in (repositories.genres, repositories.songs, repositories.playlists):
+        for after in (None, ""):
+            query = page_query(repository.label, repository.key, repository.projection, after, 100)
+            queries.append((READ_ACCESS, query, {"after": after, "limit": 100}))
+    return queries
+
+
+class Readiness:
+    def __init__(self):
+        self.warmed_up = False
+        self.migrations_ready = True
+        self.draining = False
+        self.warmup_seconds = None
+
+    async def apply_migrations(self, migrate, retry_delay=1.0, max_delay=MIGRATION_RETRY_MAX_DELAY):
+        """Réessaie `migrate()` jusqu'au succès ; l'instance n'est pas prête d'ici là."""
+        self.migrations_ready = False
+        while True:
+            try:
+                await migrate()
+            except Exception as e:
+                logger.error("Migrations failed, retrying in %.0f s: %s", retry_delay, e)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, max_delay)
+            else:
+                self.migrations_ready = True
+                return
+
+    async def wait_for_counters(self, connection, interval=COUNTERS_POLL_INTERVAL):
+        """Attend l'enregistrement des migrations de compteurs (0004, 0005)."""
+        while True:
+            try:
+                if await counter_status.refresh(connection):
+                    return
+                logger.warning("Counter migrations pending: run `python -m app.migrations`")
+            except Exception as e:
+                logger.error("Counter migrations check failed: %s", e)
+            await asyncio.sleep(interval)
+
+    async def _open_connection(self, connection):
+        async with connection.get_session(READ_ACCESS) as session:
+            result = await session.run(PING_QUERY)
+            await result.consume()
+            # Garde la connexion empruntée le temps que les autres sessions ouvrent la leur
+            await asyncio.sleep(0.05)
+
+    async def _plan(self, connection, mode, query, params):
+        async with connection.get_session(mode) as session:
+            result = await session.run("EXPLAIN " + query, **params)
+            await result.consume()
+
+    async def warm_up(self, connection, repositories, min_connections=WARMUP_MIN_CONNECTIONS, plan_queries=WARMUP_PLAN_QUERIES):
+        """Ne lève jamais : un échec est journalisé et l'instance devient prête quand même."""
+        started = time.perf_counter()
+        try:
+            if repositories.shared:
+                await asyncio.wait_for(self._warm_up(connection, repositories, min_connections, plan_queries), WARMUP_TIMEOUT)
+        except Exception as e:
+            logger.error("Warm-up incomplete: %s", e)
+        self.warmup_seconds = time.perf_counter() - started
+        self.warmed_up = True
+        logger.info("Warm-up finished in %.2f s", self.warmup_seconds)
+
+    async def _warm_up(self, connection, repositories, min_connections, plan_queries):
+        await asyncio.gather(*(self._open_connection(connection) for _ in range(min_connections)))
+        if plan_queries:
+            for mode, query, params in hot_queries(repositories):
+                try:
+                    await self._plan(connection, mode, query, params)
+                except Exception as e:
+                    logger.warning("Query planning skipped: %s", e)
+
+    async def check(self, connection, repositories):
+        """None si l'instance peut recevoir du trafic, sinon la raison."""
+        if self.draining:
+            return "shutting down"
+        if not self.migrations_ready:
+            return "applying migrations"
+        if repositories.shared and not counter_status.ready:
+            return "counter migrations pending"
+        if not self.warmed_up:
+            return "warming up"
+        if not repositories.shared:
+            return None
+        try:
+            await asyncio.wait_for(self._ping(connection), READINESS_TIMEOUT)
+        except Exception as e:
+            return f"database unavailable: {e}"
+        return None
+
+    async def _ping(self, connection):
+        async with connection.get_session(READ_ACCESS) as session:
+            result = await session.run(PING_QUERY)
+            await result.consume()
+
+
+# Singleton partagé par le lifespan et les sondes
+readiness = Readiness()
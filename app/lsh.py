@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # génération de candidats optionnelle
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Relations de l'API qui modifient les jetons des utilisateurs (les FOLLOWS de l'API visent
+# des artistes ; les abonnements aux playlists publiques sont relus au rechargement)
+TOKEN_RELATIONSHIPS = {"LIKED", "OWNS", "CONTAINS", "LIKES_GENRE"}
+
+# Premier de Mersenne 2^31 - 1 : a * x + b tient dans un uint64 sans débordement
+_PRIME = (1 << 31) - 1
+
+# Propriétaires d'une playlist, dont les jetons changent avec son contenu
+OWNERS_QUERY = """
+MATCH (:Playlist {id: $playlist_id})<-[:OWNS]-(u:User)
+RETURN collect(u.id) AS ids
+"""
+
+# Abonnés d'une playlist, dont les jetons F: suivent son drapeau `public`
+FOLLOWERS_QUERY = """
+MATCH (:Playlist {id: $playlist_id})<-[:FOLLOWS]-(u:User)
+RETURN collect(u.id) AS ids
+"""
+
+# Jetons d'un utilisateur : genres aimés, chansons likées, playlists publiques suivies et
+# chansons de ses playlists, typés car seules les correspondances de même type comptent
+TOKENS_QUERY = """
+MATCH (u:User)
+WHERE $user_ids IS NULL OR u.id IN $user_ids
+RETURN u.id AS id,
+       [(u)-[:LIKES_GENRE]->(g:Genre) | 'G:' + g.name]
+       + [(u)-[:LIKED]->(s:Song) | 'L:' + s.id]
+       + [(u)-[:FOLLOWS]->(p:Playlist {public: true}) | 'F:' + p.id]
+       + [(u)-[:OWNS]->(:Playlist)-[:CONTAINS]->(s:Song) | 'C:' + s.id] AS tokens
+"""
+
+
+def is_available() -> bool:
+    return np is not None
+
+
+def _token_hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little") % _PRIME
+
+
+class MinHashLSH:
+    """
+    Signatures MinHash des ensembles de jetons de chaque utilisateur, découpées en
+    `bands` bandes de `rows` lignes. Deux utilisateurs partageant une bande sont
+    candidats ; la probabilité croît avec leur similarité de Jaccard.
+    """
+
+    def __init__(self, bands: int = 64, rows: int = 1, seed: int = 7, max_age: float = None):
+        if not is_available():
+            raise RuntimeError("numpy is required for LSH candidate generation")
+        self.bands = bands
+        self.rows = rows
+        self.num_perm = bands * rows
+        self.max_age = max_age if max_age is not None else float(os.getenv("LSH_MAX_AGE", "3600"))
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, self.num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, self.num_perm, dtype=np.uint64)
+        self._tokens = {}
+        self._signatures = {}
+        self._buckets = [dict() for _ in range(bands)]
+        self._lock = threading.Lock()
+        self.loaded_at = None
+        self.built = False
+        self._reload_task = None
+        # Jetons mis à jour pendant une reconstruction (None : supprimé), rejoués avant la bascule
+        self._pending = None
+
+    def _signature(self, tokens):
+        if not tokens:
+            return None
+        hashes = np.fromiter((_token_hash(t) for t in tokens), dtype=np.uint64, count=len(tokens))
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME
+        return permuted.min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _unindex(self, user_id):
+        signature = self._signatures.pop(user_id, None)
+        if signature is None:
+            return
+        for band, key in enumerate(self._band_keys(signature)):
+            members = self._buckets[band].get(key)
+            if members:
+                members.discard(user_id)
+                if not members:
+                    del self._buckets[band][key]
+
+    def _index(self, user_id, tokens, signature):
+        self._unindex(user_id)
+        self._tokens[user_id] = tokens
+        if signature is None:
+            return
+        self._signatures[user_id] = signature
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, set()).add(user_id)
+
+    @property
+    def building(self) -> bool:
+        return self._pending is not None
+
+    def update(self, user_id, tokens):
+        tokens = set(tokens)
+        signature = self._signature(tokens)
+        with self._lock:
+            if self._pending is not None:
+                self._pending[user_id] = tokens
+            self._index(user_id, tokens, signature)
+
+    def add_token(self, user_id, token):
+        tokens = self._tokens.get(user_id, set())
+        if token not in tokens:
+            self.update(user_id, tokens | {token})
+
+    def remove_token(self, user_id, token):
+        tokens = self._tokens.get(user_id, set())
+        if token in tokens:
+            self.update(user_id, tokens - {token})
+
+    def remove(self, user_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending[user_id] = None
+            self._unindex(user_id)
+            self._tokens.pop(user_id, None)
+
+    def candidates(self, user_id, fallback_sample: int = 0, rng=random):
+        """Utilisateurs partageant au moins une bande, plus un échantillon aléatoire."""
+        with self._lock:
+            found = set()
+            signature = self._signatures.get(user_id)
+            if signature is not None:
+                for band, key in enumerate(self._band_keys(signature)):
+                    found |= self._buckets[band].get(key, set())
+            users = list(self._tokens)
+        found.discard(user_id)
+        if fallback_sample:
+            found.update(rng.sample(users, min(fallback_sample, len(users))))
+            found.discard(user_id)
+        return found
+
+    def build(self, user_tokens):
+        """Reconstruit l'index. user_tokens : itérable de (user_id, tokens)."""
+        tokens_by_user, signatures = {}, {}
+        buckets = [dict() for _ in range(self.bands)]
+        for user_id, tokens in user_tokens:
+            tokens = set(tokens)
+            tokens_by_user[user_id] = tokens
+            signature = self._signature(tokens)
+            if signature is None:
+                continue
+            signatures[user_id] = signature
+            for band, key in enumerate(self._band_keys(signature)):
+                buckets[band].setdefault(key, set()).add(user_id)
+        with self._lock:
+            self._tokens, self._signatures, self._buckets = tokens_by_user, signatures, buckets
+            # Mises à jour postérieures à la lecture de l'instantané (voir load)
+            pending, self._pending = self._pending, None
+            for user_id, tokens in (pending or {}).items():
+                if tokens is None:
+                    self._unindex(user_id)
+                    self._tokens.pop(user_id, None)
+                else:
+                    self._index(user_id, tokens, self._signature(tokens))
+            self.loaded_at = time.monotonic()
+            self.built = True
+        return self
+
+    async def load(self, connection):
+        # Enregistrées dès avant la lecture, pour ne perdre aucune mise à jour pendant la reconstruction
+        with self._lock:
+            self._pending = {}
+        try:
+            records = await connection.read(TOKENS_QUERY, user_ids=None, query_name="lsh.load")
+            # Signatures calculées hors de la boucle d'événements
+            return await asyncio.to_thread(self.build, [(record["id"], record["tokens"]) for record in records])
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def schedule_reload(self, connection):
+        """Reconstruction en tâche de fond ; l'index précédent reste servi."""
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._reload(connection))
+
+    async def _reload(self, connection):
+        try:
+            await self.load(connection)
+        except Exception as e:
+            logger.error("LSH index reload failed: %s", e)
+
+    async def refresh_users(self, connection, user_ids):
+        """Recalcule les jetons des utilisateurs donnés (après une modification de playlist)."""
+        if not user_ids:
+            return
+        records = await connection.read(TOKENS_QUERY, user_ids=list(user_ids), query_name="lsh.refresh_users")
+        for record in records:
+            self.update(record["id"], record["tokens"])
+        # Utilisateurs supprimés : absents du résultat
+        for user_id in set(user_ids) - {record["id"] for record in records}:
+            self.remove(user_id)
+
+    def invalidate(self):
+        # Mutation trop large pour une mise à jour ciblée : rechargement en tâche de fond au prochain usage
+        self.loaded_at = None
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+
+def lsh_enabled() -> bool:
+    return os.getenv("TOPK_CANDIDATES", "all").lower() == "lsh" and is_available()
+
+
+FALLBACK_SAMPLE = int(os.getenv("LSH_FALLBACK_SAMPLE", "100"))
+
+# Singleton de l'index, chargé au premier usage
+lsh_index = MinHashLSH(
+    bands=int(os.getenv("LSH_BANDS", "64")),
+    rows=int(os.getenv("LSH_ROWS", "1")),
+) if is_available() else None
+
+
+async def refresh_related(connection, users=(), playlist=None, followed=None):
+    """
+    Remet à jour les signatures touchées par une mutation (si l'index est actif, chargé ou
+    en construction) : `playlist` pour ses propriétaires, `followed` pour ses abonnés.
+    """
+    if not lsh_enabled() or not (lsh_index.built or lsh_index.building):
+        return
+    user_ids = set(users)
+    if playlist is not None:
+        for record in await connection.read(OWNERS_QUERY, playlist_id=playlist, query_name="lsh.refresh_related"):
+            user_ids.update(record["ids"])
+    if followed is not None:
+        for record in await connection.read(FOLLOWERS_QUERY, playlist_id=followed, query_name="lsh.refresh_related"):
+            user_ids.update(record["ids"])
+    await lsh_index.refresh_users(connection, user_ids)
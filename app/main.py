@@ -1,46 +1,242 @@
-from fastapi import FastAPI, HTTPException
-from typing import List
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+from typing import List, Optional
 from .schemas import (
     CompatibilityRequest,
     CompatibilityResponse,
+    CompatibilityBatchItem,
     Genre,
+    GenreStats,
     Artist,
+    ArtistStats,
     Song,
+    SongStats,
     User,
     UserWithOrientation,
     Playlist,
+    PlaylistStats,
     OrientationCompatibilityResponse,
+    RelationType,
+    BulkRelation,
+    BulkResponse,
 )
-from .crud import CRUD
-from .database import db
+from .database import db, async_db, request_bookmarks
+from .cache import topk_cache, invalidate_after_delete, invalidate_related
+from .lsh import TOKEN_RELATIONSHIPS, lsh_index, refresh_related
+from .pagination import list_page
+from .bulk import RELATIONSHIPS, summarize
+from .migrations import migrate
+from .counters import TARGET_COUNTERS, CountersPending
+from .repositories import AlreadyExists, repositories
+from .stats import STATS_REFRESH_INTERVAL, stats_store
+from .versions import ETAG_SYNC_INTERVAL, normalized_query, not_modified, versions
+from .orientation import orientation_filter_enabled, orientation_index
+from .health import readiness
+from . import admission, metrics, profiling, serialization
 from contextlib import asynccontextmanager
+import asyncio
+import logging
+import os
+import time
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+
+async def prepare():
+    if repositories.shared:
+        if os.getenv("SCHEMA_MIGRATIONS_ON_STARTUP", "true").lower() == "true":
+            # Schéma et compteurs ; jamais prêt sans eux, les échecs sont journalisés et réessayés
+            await readiness.apply_migrations(migrate)
+        await readiness.wait_for_counters(async_db)
+    await readiness.warm_up(async_db, repositories)
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    # Les statistiques sont calculées en tâche de fond, jamais pendant une requête
+    tasks = []
+    if STATS_REFRESH_INTERVAL > 0 and repositories.shared:
+        tasks.append(asyncio.create_task(stats_store.run_periodically(async_db)))
+    elif STATS_REFRESH_INTERVAL > 0:
+        # Backend en mémoire : graphe propre au processus, instantané local
+        tasks.append(asyncio.create_task(stats_store.run_locally(repositories.compute_stats)))
+    if ETAG_SYNC_INTERVAL > 0 and repositories.shared:
+        tasks.append(asyncio.create_task(versions.run_sync(async_db)))
+    # Schéma puis préchauffage en arrière-plan : /health/live répond, /health/ready attend la fin
+    tasks.append(asyncio.create_task(prepare()))
     yield
+    readiness.draining = True
+    for task in tasks:
+        task.cancel()
+    await async_db.close()
     db.close()
 
 
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(CountersPending)
+async def counters_pending(request: Request, exc: CountersPending):
+    # Écritures refusées jusqu'à l'initialisation des compteurs (migrations 0004, 0005)
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "30"})
+
+
+BOOKMARKS_HEADER = "X-Neo4j-Bookmarks"
+
+
+@app.middleware("http")
+async def propagate_bookmarks(request: Request, call_next):
+    """
+    Lecture causale entre réplicas : le client renvoie les bookmarks reçus après une
+    écriture, et les lectures de la requête attendent que la base les ait appliqués.
+    """
+    incoming = request.headers.get(BOOKMARKS_HEADER, "")
+    context = {"incoming": [b for b in incoming.split(",") if b], "outgoing": None}
+    token = request_bookmarks.set(context)
+    try:
+        response = await call_next(request)
+    finally:
+        request_bookmarks.reset(token)
+    if context["outgoing"]:
+        response.headers[BOOKMARKS_HEADER] = ",".join(context["outgoing"])
+    return response
+
+
+@app.middleware("http")
+async def admit(request: Request, call_next):
+    """Limite de concurrence par classe de route ; refus immédiat plutôt qu'une file sans fin."""
+    limiter = admission.controller.limiter(request.method, request.url.path) if admission.ADMISSION_CONTROL else None
+    if limiter is None:
+        return await call_next(request)
+    try:
+        await limiter.acquire()
+    except admission.Rejected as e:
+        if metrics.METRICS_ENABLED:
+            admission.ADMISSION_REJECTIONS.inc(limiter.name, e.reason)
+        return JSONResponse(
+            {"detail": "Server busy, retry later", "reason": e.reason},
+            status_code=admission.ADMISSION_REJECT_STATUS,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    try:
+        response = await call_next(request)
+    except BaseException:
+        limiter.release()
+        raise
+    # Corps produit pendant l'envoi (NDJSON) : la place est rendue une fois le corps terminé
+    response.body_iterator = _release_after(response.body_iterator, limiter)
+    return response
+
+
+async def _release_after(body, limiter):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        limiter.release()
+
+
+def route_template(scope):
+    """Modèle de la route qui traitera la requête, y compris pour un refus d'admission."""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    for route in app.router.routes:
+        if route.matches(scope)[0] == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """Latence par modèle de route (cardinalité bornée), requêtes en cours et erreurs."""
+    if not metrics.METRICS_ENABLED:
+        return await call_next(request)
+    method = request.method
+    metrics.HTTP_REQUESTS_IN_FLIGHT.inc(method)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.HTTP_REQUESTS_IN_FLIGHT.dec(method)
+        template = route_template(request.scope)
+        metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, method, template)
+        if status >= 400:
+            metrics.HTTP_REQUEST_ERRORS.inc(method, template, str(status))
+
+
+@app.get("/health/live", include_in_schema=False)
+async def liveness():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", include_in_schema=False)
+async def readiness_probe():
+    reason = await readiness.check(async_db, repositories)
+    if reason is not None:
+        return JSONResponse({"status": "not ready", "reason": reason}, status_code=503)
+    return {"status": "ready", "warmup_seconds": readiness.warmup_seconds}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/debug/queries", include_in_schema=False)
+async def get_query_profiles():
+    """Plans PROFILE échantillonnés, du plus coûteux en db hits au moins coûteux."""
+    return {
+        "slow_query_threshold_ms": profiling.SLOW_QUERY_THRESHOLD_MS,
+        "profile_sample_percent": profiling.PROFILE_SAMPLE_PERCENT,
+        "plans": profiling.plan_store.hottest(),
+    }
+
+
+@app.delete("/debug/queries", include_in_schema=False)
+async def reset_query_profiles():
+    profiling.plan_store.clear()
+    return {"message": "Query profiles cleared"}
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Music Compatibility API"}
 
 
+async def touch(*resources):
+    """Versions ETag : uniquement avec un stockage partagé entre réplicas."""
+    if repositories.shared:
+        await versions.touch(async_db, *resources)
+
+
 @app.get("/users/{user_id}/compatibility/top")
-async def get_top_compatible_users(user_id: str, limit: int = 5):
+async def get_top_compatible_users(
+    user_id: str,
+    limit: int = 5,
+    source: str = Query("live", pattern="^(live|materialized)$"),
+):
+    """`source=materialized` lit les scores du dernier calcul de toutes les paires (au-dessus du seuil)."""
     try:
-        return CRUD.get_top_compatible_users(user_id, limit)
+        if source == "materialized":
+            result = await repositories.compatibility.top_materialized(user_id, limit)
+        else:
+            result = await repositories.compatibility.top(user_id, limit)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    if serialization.FAST_JSON_RESPONSES:
+        return serialization.fast_response(result)
+    return result
 
 
 @app.post("/compatibility/", response_model=CompatibilityResponse)
 async def calculate_compatibility(pair: CompatibilityRequest):
     try:
-        result = CRUD.get_user_compatibility(pair.user1_id, pair.user2_id)
+        result = await repositories.compatibility.pair(pair.user1_id, pair.user2_id)
         if not result:
             raise HTTPException(status_code=404, detail="Users not found")
         return result
@@ -48,423 +244,383 @@ async def calculate_compatibility(pair: CompatibilityRequest):
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/genres/", response_model=Genre)
-def create_genre(genre: Genre):
-    with db.get_session() as session:
-        result = session.run(
-            "CREATE (g:Genre {name: $name}) RETURN g",
-            name=genre.name
+@app.post("/compatibility/batch", response_model=List[CompatibilityBatchItem])
+async def calculate_compatibility_batch(pairs: List[CompatibilityRequest]):
+    try:
+        results = await repositories.compatibility.batch(
+            [(pair.user1_id, pair.user2_id) for pair in pairs]
         )
-        node = result.single()["g"]
-        return {"name": node["name"]}
-
-
-@app.get("/genres/", response_model=List[Genre])
-def get_genres():
-    with db.get_session() as session:
-        result = session.run("MATCH (g:Genre) RETURN g.name AS name")
-        return [{"name": record["name"]} for record in result]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [
+        {
+            "user1_id": pair.user1_id,
+            "user2_id": pair.user2_id,
+            "result": result,
+            "error": None if result else "Users not found",
+        }
+        for pair, result in zip(pairs, results)
+    ]
 
 
-@app.get("/genres/{genre_name}", response_model=Genre)
-def get_genre(genre_name: str):
-    with db.get_session() as session:
-        result = session.run(
-            "MATCH (g:Genre {name: $name}) RETURN g {.*}",
-            name=genre_name
-        )
-        data = result.single()
-        if not data:
-            raise HTTPException(status_code=404, detail="Genre not found")
-        return data["g"]
+@app.post("/genres/", response_model=Genre)
+async def create_genre(genre: Genre):
+    node = await repositories.genres.create(genre.model_dump())
+    await touch(("Genre", genre.name))
+    return {"name": node["name"]}
+
+
+@app.get("/genres/", response_model=List[GenreStats])
+async def get_genres(
+    request: Request,
+    response: Response,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+):
+    cached = not_modified(request, response, versions.label_etag("Genre", normalized_query(request)))
+    if cached:
+        return cached
+    return await list_page(response, repositories.genres, after, limit, output)
+
+
+@app.get("/genres/{genre_name}", response_model=GenreStats)
+async def get_genre(genre_name: str, request: Request, response: Response):
+    etag = versions.entity_etag("Genre", genre_name)
+    cached = not_modified(request, response, etag, exists=False)
+    if cached:
+        return cached
+    genre = await repositories.genres.get(genre_name)
+    if genre is None:
+        raise HTTPException(status_code=404, detail="Genre not found")
+    return not_modified(request, response, etag) or genre
 
 
 @app.delete("/genres/{genre_name}")
-def delete_genre(genre_name: str):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (g:Genre {name: $name})
-            DETACH DELETE g RETURN count(g) AS count""",
-            name=genre_name
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="Genre not found")
-        return {"message": "Genre deleted successfully"}
+async def delete_genre(genre_name: str):
+    affected = await invalidate_related(genre=genre_name)
+    if not await repositories.genres.delete(genre_name):
+        raise HTTPException(status_code=404, detail="Genre not found")
+    invalidate_after_delete(affected)
+    await touch(("Genre", genre_name))
+    if lsh_index is not None:
+        lsh_index.invalidate()
+    return {"message": "Genre deleted successfully"}
 
 
 @app.put("/genres/{genre_name}", response_model=Genre)
-def update_genre(genre_name: str, genre: Genre):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (g:Genre {name: $name})
-            SET g.name = $new_name RETURN g {.*}""",
-            name=genre_name,
-            new_name=genre.name
-        )
-        data = result.single()
-        if not data:
-            raise HTTPException(status_code=404, detail="Genre not found")
-        return data["g"]
+async def update_genre(genre_name: str, genre: Genre):
+    try:
+        updated = await repositories.genres.update(genre_name, genre.model_dump())
+    except AlreadyExists as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Genre not found")
+    await touch(("Genre", genre_name), ("Genre", genre.name))
+    return updated
 
 
 # --- Endpoints pour Artists ---
 @app.post("/artists/", response_model=Artist)
-def create_artist(artist: Artist):
-    with db.get_session() as session:
-        result = session.run(
-            """CREATE (a:Artist {id: $id, name: $name, followers: $followers})
-            RETURN a {.*}""",
-            **artist.model_dump()
-        )
-        return result.single()["a"]
+async def create_artist(artist: Artist):
+    try:
+        created = await repositories.artists.create(artist.model_dump())
+    except AlreadyExists as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await touch(("Artist", artist.id))
+    return created
 
 
-@app.get("/artists/{artist_id}", response_model=Artist)
-def get_artist(artist_id: str):
-    with db.get_session() as session:
-        result = session.run(
-            "MATCH (a:Artist {id: $id}) RETURN a {.*}",
-            id=artist_id
-        )
-        data = result.single()
-        if not data:
-            raise HTTPException(status_code=404, detail="Artist not found")
-        return data["a"]
+@app.get("/artists/{artist_id}", response_model=ArtistStats)
+async def get_artist(artist_id: str, request: Request, response: Response):
+    etag = versions.entity_etag("Artist", artist_id)
+    cached = not_modified(request, response, etag, exists=False)
+    if cached:
+        return cached
+    artist = await repositories.artists.get(artist_id)
+    if artist is None:
+        raise HTTPException(status_code=404, detail="Artist not found")
+    return not_modified(request, response, etag) or artist
 
 
 @app.put("/artists/{artist_id}", response_model=Artist)
-def update_artist(artist_id: str, artist: Artist):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (a:Artist {id: $id})
-            SET a += {name: $name, followers: $followers}
-            RETURN a {.*}""",
-            id=artist_id,
-            **artist.model_dump(exclude={"id"})
-        )
-        data = result.single()
-        if not data:
-            raise HTTPException(status_code=404, detail="Artist not found")
-        return data["a"]
+async def update_artist(artist_id: str, artist: Artist):
+    updated = await repositories.artists.update(artist_id, artist.model_dump(exclude={"id"}))
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Artist not found")
+    await touch(("Artist", artist_id))
+    return updated
 
 
 @app.delete("/artists/{artist_id}")
-def delete_artist(artist_id: str):
-    with db.get_session() as session:
-        result = session.run(
-            "MATCH (a:Artist {id: $id}) DETACH DELETE a RETURN count(a) AS count",
-            id=artist_id
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="Artist not found")
-        return {"message": "Artist deleted successfully"}
+async def delete_artist(artist_id: str):
+    if not await repositories.artists.delete(artist_id):
+        raise HTTPException(status_code=404, detail="Artist not found")
+    await touch(("Artist", artist_id))
+    return {"message": "Artist deleted successfully"}
 
 
 # --- Endpoints pour Songs ---
 @app.post("/songs/", response_model=Song)
-def create_song(song: Song):
-    with db.get_session() as session:
-        result = session.run(
-            """CREATE (s:Song {id: $id, title: $title,
-                duration: $duration, explicit: $explicit})
-            RETURN s {.*}""",
-            **song.model_dump()
-        )
-        return result.single()["s"]
+async def create_song(song: Song):
+    try:
+        created = await repositories.songs.create(song.model_dump())
+    except AlreadyExists as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await touch(("Song", song.id))
+    return created
 
 
 @app.put("/songs/{song_id}", response_model=Song)
-def update_song(song_id: str, song: Song):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (s:Song {id: $id})
-            SET s += {title: $title, duration: $duration, explicit: $explicit}
-            RETURN s {.*}""",
-            id=song_id,
-            **song.model_dump(exclude={"id"})
-        )
-        data = result.single()
-        if not data:
-            raise HTTPException(status_code=404, detail="Song not found")
-        return data["s"]
-
-
-@app.get("/songs/", response_model=List[Song])
-def get_songs():
-    with db.get_session() as session:
-        result = session.run("MATCH (s:Song) RETURN s {.*}")
-        return [record["s"] for record in result]
+async def update_song(song_id: str, song: Song):
+    updated = await repositories.songs.update(song_id, song.model_dump(exclude={"id"}))
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Song not found")
+    await touch(("Song", song_id))
+    return updated
+
+
+@app.get("/songs/", response_model=List[SongStats])
+async def get_songs(
+    request: Request,
+    response: Response,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+):
+    cached = not_modified(request, response, versions.label_etag("Song", normalized_query(request)))
+    if cached:
+        return cached
+    return await list_page(response, repositories.songs, after, limit, output)
 
 
 @app.delete("/songs/{song_id}")
-def delete_song(song_id: str):
-    with db.get_session() as session:
-        result = session.run(
-            "MATCH (s:Song {id: $id}) DETACH DELETE s RETURN count(s) AS count",
-            id=song_id
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="Song not found")
-        return {"message": "Song deleted successfully"}
+async def delete_song(song_id: str):
+    affected = await invalidate_related(song=song_id)
+    if not await repositories.songs.delete(song_id):
+        raise HTTPException(status_code=404, detail="Song not found")
+    invalidate_after_delete(affected)
+    # Compteurs des genres et playlists de la chanson décrémentés
+    await touch(("Song", song_id), "Genre", "Playlist")
+    if lsh_index is not None:
+        lsh_index.invalidate()
+    return {"message": "Song deleted successfully"}
 
 
 # --- Endpoints pour Users ---
 @app.get("/users/{user_id}", response_model=User)
-def get_user(user_id: str):
-    with db.get_session() as session:
-        result = session.run(
-            "MATCH (u:User {id: $id}) RETURN u {.*}",
-            id=user_id
-        )
-        data = result.single()
-        if not data:
-            raise HTTPException(status_code=404, detail="Artist not found")
-        return data["u"]
+async def get_user(user_id: str, request: Request, response: Response):
+    etag = versions.entity_etag("User", user_id)
+    cached = not_modified(request, response, etag, exists=False)
+    if cached:
+        return cached
+    user = await repositories.users.get(user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="Artist not found")
+    return not_modified(request, response, etag) or user
 
 
 @app.post("/users/", response_model=UserWithOrientation)
-def create_user(user: UserWithOrientation):
-    with db.get_session() as session:
-        result = session.run(
-            """
-            CREATE (u:User {id: $id, name: $name, gender: $gender, age: $age})
-            WITH u
-            MERGE (o:Orientation {name: $orientation_name})
-            MERGE (u)-[:HAS_ORIENTATION]->(o)
-            RETURN u.id AS id, u.name AS name, u.gender AS gender, u.age AS age, o.name AS orientation
-            """,
-            id=user.id,
-            name=user.name,
-            gender=user.gender,
-            age=user.age,
-            orientation_name=user.orientation.name  # Extract the name attribute
-        )
-        record = result.single()
-        return {
-            "id": record["id"],
-            "name": record["name"],
-            "gender": record["gender"],
-            "age": record["age"],
-            "orientation": {"name": record["orientation"]}
-        }
+async def create_user(user: UserWithOrientation):
+    return await _upsert_user(user)
+
+
+@app.put("/users/{user_id}", response_model=UserWithOrientation)
+async def upsert_user(user_id: str, user: UserWithOrientation):
+    """
+    Crée ou remplace un utilisateur (idempotent, rejouable depuis Kafka)
+    """
+    if user.id != user_id:
+        raise HTTPException(status_code=400, detail="User id mismatch")
+    return await _upsert_user(user)
+
+
+async def _upsert_user(user: UserWithOrientation):
+    previous = orientation_index.orientation(user.id)
+    record = await repositories.users.upsert(user)
+    topk_cache.invalidate_users([user.id])
+    topk_cache.invalidate_incomplete()
+    if orientation_filter_enabled() and previous != record["orientation"]:
+        # L'utilisateur peut entrer dans des listes pré-filtrées dont il était exclu
+        topk_cache.clear()
+    await touch(("User", user.id))
+    # Après la version : l'orientation écrite ici est à jour
+    orientation_index.set_user(user.id, record["orientation"])
+    # Nouvel utilisateur : présent dans l'index LSH sans attendre sa reconstruction
+    await refresh_related(async_db, users=[user.id])
+    return {
+        "id": record["id"],
+        "name": record["name"],
+        "gender": record["gender"],
+        "age": record["age"],
+        "orientation": {"name": record["orientation"]}
+    }
 
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: str):
-    with db.get_session() as session:
-        result = session.run(
-            "MATCH (u:User {id: $id}) DETACH DELETE u RETURN count(u) AS count",
-            id=user_id
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="User not found")
-        return {"message": "User deleted"}
+async def delete_user(user_id: str):
+    affected = await invalidate_related(users=[user_id])
+    if not await repositories.users.delete(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    invalidate_after_delete(affected)
+    await touch(("User", user_id), "Song", "Genre", "Artist")
+    orientation_index.remove_user(user_id)
+    await refresh_related(async_db, users=[user_id])
+    return {"message": "User deleted"}
 
 
 # --- Endpoints pour Playlists ---
 @app.post("/playlists/", response_model=Playlist)
-def create_playlist(playlist: Playlist):
-    with db.get_session() as session:
-        result = session.run(
-            """CREATE (p:Playlist {id: $id, name: $name,
-                public: $public, created: $created})
-            RETURN p {.*}""",
-            **playlist.model_dump()
-        )
-        return result.single()["p"]
-
-
-@app.get("/playlists/{playlist_id}", response_model=Playlist)
-def get_playlist(playlist_id: str):
-    with db.get_session() as session:
-        result = session.run(
-            "MATCH (p:Playlist {id: $id}) RETURN p {.*}",
-            id=playlist_id
-        )
-        data = result.single()
-        if not data:
-            raise HTTPException(status_code=404, detail="Playlist not found")
-        return data["p"]
-
-
-@app.get("/playlists/", response_model=List[Playlist])
-def get_playlists():
-    with db.get_session() as session:
-        result = session.run("MATCH (p:Playlist) RETURN p {.*}")
-        return [record["p"] for record in result]
+async def create_playlist(playlist: Playlist):
+    try:
+        created = await repositories.playlists.create(playlist.model_dump())
+    except AlreadyExists as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await touch(("Playlist", playlist.id))
+    return created
+
+
+@app.get("/playlists/{playlist_id}", response_model=PlaylistStats)
+async def get_playlist(playlist_id: str, request: Request, response: Response):
+    etag = versions.entity_etag("Playlist", playlist_id)
+    cached = not_modified(request, response, etag, exists=False)
+    if cached:
+        return cached
+    playlist = await repositories.playlists.get(playlist_id)
+    if playlist is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    return not_modified(request, response, etag) or playlist
+
+
+@app.get("/playlists/", response_model=List[PlaylistStats])
+async def get_playlists(
+    request: Request,
+    response: Response,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+):
+    cached = not_modified(request, response, versions.label_etag("Playlist", normalized_query(request)))
+    if cached:
+        return cached
+    return await list_page(response, repositories.playlists, after, limit, output)
 
 
 @app.put("/playlists/{playlist_id}", response_model=Playlist)
-def update_playlist(playlist_id: str, playlist: Playlist):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (p:Playlist {id: $id})
-            SET p += {name: $name, public: $public, created: $created}
-            RETURN p {.*}""",
-            id=playlist_id,
-            **playlist.model_dump(exclude={"id"})
-        )
-        data = result.single()
-        if not data:
-            raise HTTPException(status_code=404, detail="Playlist not found")
-        return data["p"]
+async def update_playlist(playlist_id: str, playlist: Playlist):
+    updated = await repositories.playlists.update(playlist_id, playlist.model_dump(exclude={"id"}))
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    await invalidate_related(playlist=playlist_id)
+    await touch(("Playlist", playlist_id))
+    # Drapeau `public` : les jetons F: des abonnés en dépendent
+    await refresh_related(async_db, followed=playlist_id)
+    return updated
 
 
 @app.delete("/playlists/{playlist_id}")
-def delete_playlist(playlist_id: str):
-    with db.get_session() as session:
-        result = session.run(
-            "MATCH (p:Playlist {id: $id}) DETACH DELETE p RETURN count(p) AS count",
-            id=playlist_id
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="Playlist not found")
-        return {"message": "Playlist deleted successfully"}
+async def delete_playlist(playlist_id: str):
+    affected = await invalidate_related(playlist=playlist_id)
+    if not await repositories.playlists.delete(playlist_id):
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    invalidate_after_delete(affected)
+    await touch(("Playlist", playlist_id), "Song")
+    if lsh_index is not None:
+        lsh_index.invalidate()
+    return {"message": "Playlist deleted successfully"}
 
 
 @app.post("/songs/{song_id}/genres/{genre_name}", status_code=201)
-def add_genre_to_song(song_id: str, genre_name: str):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (s:Song {id: $song_id}), (g:Genre {name: $genre_name})
-            MERGE (s)-[:HAS_GENRE]->(g)
-            RETURN s.id AS song_id, g.name AS genre_name""",
-            song_id=song_id,
-            genre_name=genre_name
-        )
-        data = result.single()
-        if not data:
-            raise HTTPException(status_code=404, detail="Song or Genre not found")
-        return {
-            "message": "Genre added to song successfully",
-            "song_id": data["song_id"],
-            "genre_name": data["genre_name"]
-        }
+async def add_genre_to_song(song_id: str, genre_name: str):
+    if not await repositories.relationships["HAS_GENRE"].add(song_id, genre_name):
+        raise HTTPException(status_code=404, detail="Song or Genre not found")
+    await touch(("Genre", genre_name))
+    return {
+        "message": "Genre added to song successfully",
+        "song_id": song_id,
+        "genre_name": genre_name
+    }
 
 
 @app.post("/users/{user_id}/liked_songs/{song_id}", status_code=201)
-def like_song(user_id: str, song_id: str):
+async def like_song(user_id: str, song_id: str):
     """
     Ajoute une relation LIKED entre un utilisateur et une chanson
     """
-    with db.get_session() as session:
-        result = session.run(
-            """
-            MATCH (u:User {id: $user_id}), (s:Song {id: $song_id})
-            MERGE (u)-[r:LIKED]->(s)
-            RETURN r
-            """,
-            user_id=user_id,
-            song_id=song_id
-        )
-        if not result.single():
-            raise HTTPException(status_code=404, detail="User or Song not found")
-        return {"message": "Song liked successfully"}
+    if not await repositories.relationships["LIKED"].add(user_id, song_id):
+        raise HTTPException(status_code=404, detail="User or Song not found")
+    await invalidate_related(users=[user_id], song=song_id)
+    await touch(("Song", song_id))
+    await refresh_related(async_db, users=[user_id])
+    return {"message": "Song liked successfully"}
 
 
 @app.delete("/users/{user_id}/liked_songs/{song_id}")
-def unlike_song(user_id: str, song_id: str):
+async def unlike_song(user_id: str, song_id: str):
     """
     Supprime une relation LIKED
     """
-    with db.get_session() as session:
-        result = session.run(
-            """
-            MATCH (u:User {id: $user_id})-[r:LIKED]->(s:Song {id: $song_id})
-            DELETE r
-            RETURN count(r) AS count
-            """,
-            user_id=user_id,
-            song_id=song_id
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="Like relationship not found")
-        return {"message": "Song unliked successfully"}
+    if not await repositories.relationships["LIKED"].remove(user_id, song_id):
+        raise HTTPException(status_code=404, detail="Like relationship not found")
+    await invalidate_related(users=[user_id], song=song_id)
+    await touch(("Song", song_id))
+    await refresh_related(async_db, users=[user_id])
+    return {"message": "Song unliked successfully"}
 
 
 @app.post("/users/{user_id}/owned_playlists/{playlist_id}", status_code=201)
-def assign_playlist_owner(user_id: str, playlist_id: str):
+async def assign_playlist_owner(user_id: str, playlist_id: str):
     """
     Crée une relation OWNS entre un utilisateur et une playlist
     """
-    with db.get_session() as session:
-        result = session.run(
-            """
-            MATCH (u:User {id: $user_id}), (p:Playlist {id: $playlist_id})
-            MERGE (u)-[r:OWNS]->(p)
-            RETURN r
-            """,
-            user_id=user_id,
-            playlist_id=playlist_id
-        )
-        if not result.single():
-            raise HTTPException(status_code=404, detail="User or Playlist not found")
-        return {"message": "Ownership assigned successfully"}
+    if not await repositories.relationships["OWNS"].add(user_id, playlist_id):
+        raise HTTPException(status_code=404, detail="User or Playlist not found")
+    await invalidate_related(users=[user_id], playlist=playlist_id)
+    await refresh_related(async_db, users=[user_id])
+    return {"message": "Ownership assigned successfully"}
 
 
 @app.delete("/users/{user_id}/owned_playlists/{playlist_id}")
-def remove_playlist_owner(user_id: str, playlist_id: str):
+async def remove_playlist_owner(user_id: str, playlist_id: str):
     """
     Supprime une relation OWNS
     """
-    with db.get_session() as session:
-        result = session.run(
-            """
-            MATCH (u:User {id: $user_id})-[r:OWNS]->(p:Playlist {id: $playlist_id})
-            DELETE r
-            RETURN count(r) AS count
-            """,
-            user_id=user_id,
-            playlist_id=playlist_id
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="Ownership not found")
-        return {"message": "Ownership removed successfully"}
+    if not await repositories.relationships["OWNS"].remove(user_id, playlist_id):
+        raise HTTPException(status_code=404, detail="Ownership not found")
+    await invalidate_related(users=[user_id], playlist=playlist_id)
+    await refresh_related(async_db, users=[user_id])
+    return {"message": "Ownership removed successfully"}
 
 
 @app.post("/playlists/{playlist_id}/songs/{song_id}", status_code=201)
-def add_song_to_playlist(playlist_id: str, song_id: str):
+async def add_song_to_playlist(playlist_id: str, song_id: str):
     """
     Ajoute une chanson à une playlist
     """
-    with db.get_session() as session:
-        result = session.run(
-            """
-            MATCH (p:Playlist {id: $playlist_id}), (s:Song {id: $song_id})
-            MERGE (p)-[r:CONTAINS]->(s)
-            RETURN r
-            """,
-            playlist_id=playlist_id,
-            song_id=song_id
-        )
-        if not result.single():
-            raise HTTPException(status_code=404, detail="Playlist or Song not found")
-        return {"message": "Song added to playlist successfully"}
+    if not await repositories.relationships["CONTAINS"].add(playlist_id, song_id):
+        raise HTTPException(status_code=404, detail="Playlist or Song not found")
+    await invalidate_related(playlist=playlist_id, song=song_id)
+    await touch(("Playlist", playlist_id), ("Song", song_id))
+    await refresh_related(async_db, playlist=playlist_id)
+    return {"message": "Song added to playlist successfully"}
 
 
 @app.delete("/playlists/{playlist_id}/songs/{song_id}")
-def remove_song_from_playlist(playlist_id: str, song_id: str):
+async def remove_song_from_playlist(playlist_id: str, song_id: str):
     """
     Supprime une chanson d'une playlist
     """
-    with db.get_session() as session:
-        result = session.run(
-            """
-            MATCH (p:Playlist {id: $playlist_id})-[r:CONTAINS]->(s:Song {id: $song_id})
-            DELETE r
-            RETURN count(r) AS count
-            """,
-            playlist_id=playlist_id,
-            song_id=song_id
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="Song not found in playlist")
-        return {"message": "Song removed from playlist successfully"}
+    if not await repositories.relationships["CONTAINS"].remove(playlist_id, song_id):
+        raise HTTPException(status_code=404, detail="Song not found in playlist")
+    await invalidate_related(playlist=playlist_id, song=song_id)
+    await touch(("Playlist", playlist_id), ("Song", song_id))
+    await refresh_related(async_db, playlist=playlist_id)
+    return {"message": "Song removed from playlist successfully"}
 
 
 @app.get("/compatibility/orientation", response_model=OrientationCompatibilityResponse)
-def check_orientation_compatibility(user1_id: str, user2_id: str):
-    score = CRUD.get_orientation_compatibility(user1_id, user2_id)
+async def check_orientation_compatibility(user1_id: str, user2_id: str):
+    score = await repositories.compatibility.orientation(user1_id, user2_id)
     if score is None:
         raise HTTPException(status_code=404, detail="Compatibility not found")
     return OrientationCompatibilityResponse(
@@ -476,60 +632,142 @@ def check_orientation_compatibility(user1_id: str, user2_id: str):
 
 # --- Endpoints pour Relations ---
 @app.post("/users/{user_id}/likes_genre/{genre_name}", status_code=201)
-def like_genre(user_id: str, genre_name: str):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (u:User {id: $user_id}), (g:Genre {name: $genre_name})
-            MERGE (u)-[:LIKES_GENRE]->(g)
-            RETURN g.name AS genre_name""",
-            user_id=user_id,
-            genre_name=genre_name
-        )
-        if not result.single():
-            raise HTTPException(status_code=404, detail="User or Genre not found")
-        return {"message": "Genre liked successfully"}
+async def like_genre(user_id: str, genre_name: str):
+    if not await repositories.relationships["LIKES_GENRE"].add(user_id, genre_name):
+        raise HTTPException(status_code=404, detail="User or Genre not found")
+    await invalidate_related(users=[user_id], genre=genre_name)
+    await touch(("Genre", genre_name))
+    await refresh_related(async_db, users=[user_id])
+    return {"message": "Genre liked successfully"}
 
 
 @app.delete("/users/{user_id}/likes_genre/{genre_name}")
-def unlike_genre(user_id: str, genre_name: str):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (u:User {id: $user_id})-[r:LIKES_GENRE]->(g:Genre {name: $genre_name})
-            DELETE r
-            RETURN count(r) AS count""",
-            user_id=user_id,
-            genre_name=genre_name
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="Like relationship not found")
-        return {"message": "Genre unliked successfully"}
+async def unlike_genre(user_id: str, genre_name: str):
+    if not await repositories.relationships["LIKES_GENRE"].remove(user_id, genre_name):
+        raise HTTPException(status_code=404, detail="Like relationship not found")
+    await invalidate_related(users=[user_id], genre=genre_name)
+    await touch(("Genre", genre_name))
+    await refresh_related(async_db, users=[user_id])
+    return {"message": "Genre unliked successfully"}
 
 
 @app.post("/users/{user_id}/follows/{artist_id}", status_code=201)
-def follow_artist(user_id: str, artist_id: str):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (u:User {id: $user_id}), (a:Artist {id: $artist_id})
-            MERGE (u)-[:FOLLOWS]->(a)
-            RETURN a.id AS artist_id""",
-            user_id=user_id,
-            artist_id=artist_id
-        )
-        if not result.single():
-            raise HTTPException(status_code=404, detail="User or Artist not found")
-        return {"message": "Artist followed successfully"}
+async def follow_artist(user_id: str, artist_id: str):
+    if not await repositories.relationships["FOLLOWS"].add(user_id, artist_id):
+        raise HTTPException(status_code=404, detail="User or Artist not found")
+    await touch(("Artist", artist_id))
+    return {"message": "Artist followed successfully"}
 
 
 @app.delete("/users/{user_id}/follows/{artist_id}")
-def unfollow_artist(user_id: str, artist_id: str):
-    with db.get_session() as session:
-        result = session.run(
-            """MATCH (u:User {id: $user_id})-[r:FOLLOWS]->(a:Artist {id: $artist_id})
-            DELETE r
-            RETURN count(r) AS count""",
-            user_id=user_id,
-            artist_id=artist_id
-        )
-        if result.single()["count"] == 0:
-            raise HTTPException(status_code=404, detail="Follow relationship not found")
-        return {"message": "Artist unfollowed successfully"}
+async def unfollow_artist(user_id: str, artist_id: str):
+    if not await repositories.relationships["FOLLOWS"].remove(user_id, artist_id):
+        raise HTTPException(status_code=404, detail="Follow relationship not found")
+    await touch(("Artist", artist_id))
+    return {"message": "Artist unfollowed successfully"}
+
+
+# --- Endpoints d'import en masse ---
+async def _bulk_entities(label: str, entities: list):
+    statuses = await repositories.entities(label).bulk_create([e.model_dump() for e in entities])
+    if "created" in statuses:
+        await touch(label)
+    return summarize(statuses)
+
+
+@app.post("/bulk/songs", response_model=BulkResponse)
+async def bulk_create_songs(songs: List[Song]):
+    return await _bulk_entities("Song", songs)
+
+
+@app.post("/bulk/artists", response_model=BulkResponse)
+async def bulk_create_artists(artists: List[Artist]):
+    return await _bulk_entities("Artist", artists)
+
+
+@app.post("/bulk/playlists", response_model=BulkResponse)
+async def bulk_create_playlists(playlists: List[Playlist]):
+    return await _bulk_entities("Playlist", playlists)
+
+
+@app.post("/bulk/genres", response_model=BulkResponse)
+async def bulk_create_genres(genres: List[Genre]):
+    return await _bulk_entities("Genre", genres)
+
+
+@app.post("/bulk/users", response_model=BulkResponse)
+async def bulk_create_users(users: List[UserWithOrientation]):
+    statuses = await repositories.users.bulk_create(users)
+    if "created" in statuses:
+        topk_cache.invalidate_incomplete()
+        await touch("User")
+        for user, status in zip(users, statuses):
+            if status == "created":
+                orientation_index.set_user(user.id, user.orientation.name)
+        await refresh_related(async_db, users=[u.id for u, status in zip(users, statuses) if status == "created"])
+    return summarize(statuses)
+
+
+@app.post("/bulk/relationships/{rel_type}", response_model=BulkResponse)
+async def bulk_create_relationships(rel_type: RelationType, relations: List[BulkRelation]):
+    statuses = await repositories.relationships[rel_type.value].bulk_create([r.model_dump() for r in relations])
+    if "created" in statuses and rel_type is not RelationType.HAS_GENRE and rel_type is not RelationType.FOLLOWS:
+        # Trop de voisinages touchés pour une invalidation ciblée
+        topk_cache.clear()
+    if "created" in statuses and rel_type.value in TOKEN_RELATIONSHIPS and lsh_index is not None:
+        lsh_index.invalidate()
+    # Labels dont les compteurs exposés ont changé
+    changed = {RELATIONSHIPS[rel_type.value][2]} if rel_type.value in TARGET_COUNTERS else set()
+    if rel_type is RelationType.CONTAINS:
+        changed.add("Playlist")
+    if "created" in statuses and changed:
+        await touch(*changed)
+    return summarize(statuses)
+
+
+# --- Endpoints de statistiques (instantané en mémoire) ---
+def _stats_section(name: str):
+    snapshot = stats_store.snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Statistics not computed yet")
+    return {"version": snapshot["version"], "computed_at": snapshot["computed_at"], name: snapshot[name]}
+
+
+@app.get("/stats/")
+async def get_stats_info():
+    snapshot = stats_store.snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Statistics not computed yet")
+    return {"version": snapshot["version"], "computed_at": snapshot["computed_at"]}
+
+
+@app.get("/stats/genres")
+async def get_genre_stats():
+    return _stats_section("genres")
+
+
+@app.get("/stats/songs/top")
+async def get_top_songs(genre: Optional[str] = None):
+    if genre is None:
+        return _stats_section("top_songs")
+    section = _stats_section("top_songs_by_genre")
+    return {
+        "version": section["version"],
+        "computed_at": section["computed_at"],
+        "top_songs": section["top_songs_by_genre"].get(genre, []),
+    }
+
+
+@app.get("/stats/artists/top")
+async def get_top_artists():
+    return _stats_section("top_artists")
+
+
+@app.get("/stats/playlists/sizes")
+async def get_playlist_sizes():
+    return _stats_section("playlist_sizes")
+
+
+@app.get("/stats/users")
+async def get_user_stats():
+    return _stats_section("users")
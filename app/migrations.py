@@ -0,0 +1,203 @@
+"""
+Migrations de schéma Neo4j : contraintes d'unicité et index des propriétés de recherche.
+
+Appliquées en tâche de fond au démarrage (app.health), données comprises : l'instance
+n'est prête qu'une fois les compteurs initialisés (0004, 0005). Un échec lève une exception.
+
+    python -m app.migrations          # applique toutes les migrations manquantes
+    python -m app.migrations --check  # liste les contraintes/index absents (code 1 si incomplet)
+"""
+import argparse
+import asyncio
+import logging
+
+from .counters import repair_popularity, repair_similarity
+from .database import async_db
+
+logger = logging.getLogger(__name__)
+
+# Relations recopiées sur le noeud conservé lors de la fusion des doublons : (type, sens).
+# CURATES (reconstruite par 0004) et COMPATIBLE (job de calcul) sont dérivées.
+DUPLICATE_RELATIONSHIPS = {
+    "User": [("LIKED", "out"), ("OWNS", "out"), ("LIKES_GENRE", "out"), ("FOLLOWS", "out"), ("HAS_ORIENTATION", "out")],
+    "Song": [("LIKED", "in"), ("CONTAINS", "in"), ("HAS_GENRE", "out")],
+    "Playlist": [("OWNS", "in"), ("FOLLOWS", "in"), ("CONTAINS", "out")],
+    "Artist": [("FOLLOWS", "in")],
+}
+
+
+def dedupe_query(label: str, relationships) -> str:
+    """Fusionne les noeuds de même id : relations déplacées sur le premier, doublons supprimés."""
+    calls = []
+    for rel_type, direction in relationships:
+        if direction == "out":
+            moved, merged = f"(duplicate)-[:{rel_type}]->(x)", f"(keep)-[:{rel_type}]->(x)"
+        else:
+            moved, merged = f"(duplicate)<-[:{rel_type}]-(x)", f"(keep)<-[:{rel_type}]-(x)"
+        # Une seule orientation par utilisateur : celle du noeud conservé
+        condition = " WHERE NOT (keep)-[:HAS_ORIENTATION]->()" if rel_type == "HAS_ORIENTATION" else ""
+        calls.append(f"CALL {{ WITH keep, duplicate MATCH {moved}{condition} MERGE {merged} }}")
+    return "\n".join([
+        f"MATCH (n:{label}) WHERE n.id IS NOT NULL",
+        "WITH n.id AS id, collect(n) AS nodes",
+        "WHERE size(nodes) > 1",
+        "WITH head(nodes) AS keep, tail(nodes) AS duplicates",
+        "UNWIND duplicates AS duplicate",
+        *calls,
+        "DETACH DELETE duplicate",
+    ])
+
+
+# (identifiant, instructions) dans l'ordre d'application ; une instruction est une
+# requête Cypher ou une coroutine de migration de données
+MIGRATIONS = [
+    ("0001_dedupe_genres", [
+        # create_genre utilisait CREATE : fusionne les doublons avant la contrainte d'unicité
+        """
+        MATCH (g:Genre)
+        WITH g.name AS name, collect(g) AS nodes
+        WHERE size(nodes) > 1
+        WITH head(nodes) AS keep, tail(nodes) AS duplicates
+        UNWIND duplicates AS duplicate
+        CALL {
+            WITH keep, duplicate
+            MATCH (s:Song)-[:HAS_GENRE]->(duplicate)
+            MERGE (s)-[:HAS_GENRE]->(keep)
+        }
+        CALL {
+            WITH keep, duplicate
+            MATCH (u:User)-[:LIKES_GENRE]->(duplicate)
+            MERGE (u)-[:LIKES_GENRE]->(keep)
+        }
+        DETACH DELETE duplicate
+        """,
+    ]),
+    # Les CREATE d'origine et les rejeux Kafka ont pu dupliquer les autres entités
+    ("0001b_dedupe_entities", [dedupe_query(label, rels) for label, rels in DUPLICATE_RELATIONSHIPS.items()]),
+    ("0002_uniqueness_constraints", [
+        "CREATE CONSTRAINT user_id_unique IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE",
+        "CREATE CONSTRAINT song_id_unique IF NOT EXISTS FOR (s:Song) REQUIRE s.id IS UNIQUE",
+        "CREATE CONSTRAINT playlist_id_unique IF NOT EXISTS FOR (p:Playlist) REQUIRE p.id IS UNIQUE",
+        "CREATE CONSTRAINT artist_id_unique IF NOT EXISTS FOR (a:Artist) REQUIRE a.id IS UNIQUE",
+        "CREATE CONSTRAINT genre_name_unique IF NOT EXISTS FOR (g:Genre) REQUIRE g.name IS UNIQUE",
+        "CREATE CONSTRAINT orientation_name_unique IF NOT EXISTS FOR (o:Orientation) REQUIRE o.name IS UNIQUE",
+    ]),
+    ("0003_playlist_public_index", [
+        "CREATE INDEX playlist_public IF NOT EXISTS FOR (p:Playlist) ON (p.public)",
+    ]),
+    ("0004_playlist_counters", [
+        # Initialise song_count, owned_song_count et les relations CURATES
+        repair_similarity,
+    ]),
+    ("0005_popularity_counters", [
+        # like_count, playlist_count, listener_count, follower_count...
+        repair_popularity,
+    ]),
+    ("0006_stats_snapshots", [
+        "CREATE CONSTRAINT stats_snapshot_version_unique IF NOT EXISTS FOR (s:StatsSnapshot) REQUIRE s.version IS UNIQUE",
+        "CREATE INDEX song_like_count IF NOT EXISTS FOR (s:Song) ON (s.like_count)",
+        "CREATE INDEX artist_follower_count IF NOT EXISTS FOR (a:Artist) ON (a.follower_count)",
+    ]),
+    ("0007_resource_versions", [
+        "CREATE CONSTRAINT resource_version_label_unique IF NOT EXISTS FOR (v:ResourceVersion) REQUIRE v.label IS UNIQUE",
+    ]),
+    ("0008_compatible_edges", [
+        "CREATE CONSTRAINT batch_checkpoint_job_unique IF NOT EXISTS FOR (c:BatchCheckpoint) REQUIRE c.job IS UNIQUE",
+        # Purge des relations d'un calcul précédent
+        "CREATE INDEX compatible_computed_at IF NOT EXISTS FOR ()-[c:COMPATIBLE]-() ON (c.computed_at)",
+    ]),
+]
+
+EXPECTED_CONSTRAINTS = {
+    "user_id_unique",
+    "song_id_unique",
+    "playlist_id_unique",
+    "artist_id_unique",
+    "genre_name_unique",
+    "orientation_name_unique",
+    "schema_migration_id_unique",
+    "stats_snapshot_version_unique",
+    "resource_version_label_unique",
+    "batch_checkpoint_job_unique",
+}
+
+EXPECTED_INDEXES = {"playlist_public", "song_like_count", "artist_follower_count", "compatible_computed_at"}
+
+
+async def applied_migrations():
+    records = await async_db.read("MATCH (m:SchemaMigration) RETURN m.id AS id", query_name="migrations.applied_migrations")
+    return {record["id"] for record in records}
+
+
+async def migrate():
+    """
+    Applique les migrations non encore enregistrées. Idempotent. Lève à la première
+    migration en échec : les suivantes ne sont pas appliquées.
+    """
+    await async_db.write(
+        "CREATE CONSTRAINT schema_migration_id_unique IF NOT EXISTS "
+        "FOR (m:SchemaMigration) REQUIRE m.id IS UNIQUE",
+        query_name="migrations.migrate",
+    )
+    done = await applied_migrations()
+    applied = []
+    for migration_id, statements in MIGRATIONS:
+        if migration_id in done:
+            continue
+        try:
+            for statement in statements:
+                # Une transaction par instruction : schéma et données ne se mélangent pas
+                if callable(statement):
+                    await statement()
+                else:
+                    await async_db.write(statement, query_name="migrations.migrate")
+        except Exception as e:
+            logger.error("Migration %s failed: %s", migration_id, e)
+            raise
+        await async_db.write(
+            "MERGE (m:SchemaMigration {id: $id}) ON CREATE SET m.applied_at = datetime()",
+            id=migration_id, query_name="migrations.migrate"
+        )
+        applied.append(migration_id)
+        logger.info("Migration %s applied", migration_id)
+    return applied
+
+
+async def check():
+    """Renvoie les contraintes, index et migrations absents."""
+    constraints = {r["name"] for r in await async_db.read("SHOW CONSTRAINTS YIELD name", query_name="migrations.check")}
+    indexes = {r["name"] for r in await async_db.read("SHOW INDEXES YIELD name", query_name="migrations.check")}
+    done = await applied_migrations()
+    return {
+        "constraints": sorted(EXPECTED_CONSTRAINTS - constraints),
+        "indexes": sorted(EXPECTED_INDEXES - indexes),
+        "migrations": [migration_id for migration_id, _ in MIGRATIONS if migration_id not in done],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--check", action="store_true", help="liste ce qui manque sans rien modifier")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            if args.check:
+                return await check()
+            return await migrate()
+        finally:
+            await async_db.close()
+
+    result = asyncio.run(run())
+    if args.check:
+        missing = False
+        for kind, names in result.items():
+            for name in names:
+                print(f"missing {kind[:-1]}: {name}")
+                missing = True
+        raise SystemExit(1 if missing else 0)
+    print(f"applied: {', '.join(result) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Matrice de compatibilité des orientations (relations COMPATIBLE_WITH, quelques noeuds)
+et correspondance utilisateur -> orientation, gardées en mémoire.
+
+Un utilisateur inconnu (créé sur un autre réplica depuis le dernier chargement) renvoie
+None : l'appelant retombe alors sur la requête Neo4j. Chaque orientation garde la
+version `User` (app.versions) de sa lecture : une modification ou suppression ultérieure,
+ici ou sur un autre réplica (ResourceVersion), la rend périmée jusqu'à sa relecture. Le
+pré-filtre du top-K ne fait qu'élaguer les orientations connues ; celles du résultat
+sont relues en base.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from .stats import scan
+from .versions import versions
+
+logger = logging.getLogger(__name__)
+
+ORIENTATION_MATRIX_QUERY = """
+MATCH (o1:Orientation)-[r:COMPATIBLE_WITH]->(o2:Orientation)
+RETURN o1.name AS source, o2.name AS target, r.score AS score
+"""
+
+USER_ORIENTATIONS_BATCH_QUERY = """
+MATCH (u:User)
+WHERE $after IS NULL OR u.id > $after
+WITH u ORDER BY u.id LIMIT $batch_size
+RETURN u.id AS key, head([(u)-[:HAS_ORIENTATION]->(o) | o.name]) AS orientation
+"""
+
+USER_ORIENTATIONS_QUERY = """
+UNWIND $user_ids AS user_id
+MATCH (u:User {id: user_id})
+RETURN u.id AS key, head([(u)-[:HAS_ORIENTATION]->(o) | o.name]) AS orientation
+"""
+
+
+class OrientationIndex:
+    def __init__(self, max_age: float = None):
+        self.max_age = max_age if max_age is not None else float(os.getenv("ORIENTATION_MAX_AGE", "300"))
+        self._matrix = {}
+        self._users = {}
+        # Version `User` lors de la lecture de chaque orientation
+        self._stamps = {}
+        self.loaded_at = None
+        self._reload_task = None
+
+    async def load(self, connection):
+        stamp = versions.label_version("User")
+        matrix = {
+            (r["source"], r["target"]): r["score"]
+            for r in await connection.read(ORIENTATION_MATRIX_QUERY, query_name="orientation.load")
+        }
+        users = {}
+        async for record in scan(connection, USER_ORIENTATIONS_BATCH_QUERY, query_name="orientation.load"):
+            if record["orientation"] is not None:
+                users[record["key"]] = record["orientation"]
+        self._matrix, self._users = matrix, users
+        self._stamps = dict.fromkeys(users, stamp)
+        self.loaded_at = time.monotonic()
+        return self
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def schedule_reload(self, connection):
+        """Rechargement en tâche de fond ; les données précédentes restent servies."""
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._reload(connection))
+
+    async def _reload(self, connection):
+        try:
+            await self.load(connection)
+        except Exception as e:
+            logger.error("Orientation index reload failed: %s", e)
+
+    async def refresh_users(self, connection, user_ids) -> dict:
+        """Orientations actuelles en base de `user_ids` (absents : supprimés), reportées dans l'index."""
+        stamp = versions.label_version("User")
+        current = {}
+        for record in await connection.read(USER_ORIENTATIONS_QUERY, user_ids=list(user_ids), query_name="orientation.refresh_users"):
+            current[record["key"]] = record["orientation"]
+        for user_id in user_ids:
+            if current.get(user_id) is None:
+                self.remove_user(user_id)
+            else:
+                self.set_user(user_id, current[user_id], stamp)
+        return current
+
+    def set_user(self, user_id: str, orientation: str, stamp=None):
+        """Après une écriture locale (déjà versionnée) ou une relecture (`stamp` pris avant)."""
+        self._users[user_id] = orientation
+        self._stamps[user_id] = versions.label_version("User") if stamp is None else stamp
+
+    def remove_user(self, user_id: str):
+        self._users.pop(user_id, None)
+        self._stamps.pop(user_id, None)
+
+    def current(self, user_id: str) -> bool:
+        """Orientation lue après la dernière modification connue de l'utilisateur."""
+        stamp, version = self._stamps.get(user_id), versions.entity_version("User", user_id)
+        return stamp is not None and version is not None and version <= stamp
+
+    def orientation(self, user_id: str):
+        return self._users.get(user_id)
+
+    def score(self, user1_id: str, user2_id: str):
+        """(connu, score) : score None si les orientations ne sont pas compatibles."""
+        o1, o2 = self.orientation(user1_id), self.orientation(user2_id)
+        if self.loaded_at is None or o1 is None or o2 is None:
+            return False, None
+        return True, self._matrix.get((o1, o2))
+
+    def compatible_orientations(self, user_id: str, min_score: float = 0):
+        """Orientations compatibles avec celle de `user_id` (None si elle est inconnue)."""
+        source = self.orientation(user_id)
+        if self.loaded_at is None or source is None:
+            return None
+        return sorted(
+            target for (o1, target), score in self._matrix.items()
+            if o1 == source and score is not None and score > min_score
+        )
+
+    def filter_candidates(self, user_id: str, allowed, candidates):
+        """
+        Candidats sauf ceux d'orientation connue non autorisée : un candidat inconnu
+        (autre réplica) est conservé, à vérifier en base.
+        """
+        allowed = set(allowed)
+        return {c for c in candidates if c != user_id and self._users.get(c) in allowed | {None}}
+
+
+def orientation_filter_enabled() -> bool:
+    return os.getenv("TOPK_ORIENTATION_FILTER", "false").lower() == "true"
+
+
+ORIENTATION_MIN_SCORE = float(os.getenv("ORIENTATION_MIN_SCORE", "0"))
+
+# Singleton partagé par CRUD et les handlers
+orientation_index = OrientationIndex()
@@ -0,0 +1,49 @@
+import json
+from typing import Optional
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from . import serialization
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def page_query(label: str, key: str, projection: str, after: Optional[str], limit: Optional[int]) -> str:
+    """
+    Requête de pagination par clé (keyset) : tri sur la propriété indexée `key`
+    et reprise strictement après le curseur, sans SKIP.
+    """
+    query = f"MATCH (n:{label})"
+    if after is not None:
+        query += f" WHERE n.{key} > $after"
+    query += f" RETURN {projection} AS item ORDER BY n.{key}"
+    if limit is not None:
+        query += " LIMIT $limit"
+    return query
+
+
+async def _ndjson(items):
+    async for item in items:
+        yield json.dumps(item, default=str) + "\n"
+
+
+async def list_page(response: Response, repository, after: Optional[str], limit: Optional[int], output: str = "json"):
+    """
+    Page d'un EntityRepository, en JSON (curseur suivant en en-tête) ou en flux ndjson.
+    Avec FAST_JSON_RESPONSES, la page est encodée sans re-validation par le response_model.
+    """
+    if output == "ndjson":
+        # Réponse renvoyée directement : les en-têtes posés sur `response` n'y sont pas recopiés
+        etag = response.headers.get("etag")
+        return StreamingResponse(
+            _ndjson(repository.stream(after, limit)),
+            media_type="application/x-ndjson",
+            headers={"ETag": etag} if etag else None
+        )
+    items = await repository.list(after, limit)
+    if limit is not None and len(items) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(items[-1][repository.key])
+    if serialization.FAST_JSON_RESPONSES:
+        return serialization.fast_response(items, response)
+    return items
@@ -0,0 +1,130 @@
+"""
+Exécution instrumentée des requêtes Cypher : résumé du driver (`result_available_after`,
+`result_consumed_after`, compteurs), journal des requêtes lentes (paramètres masqués) et
+échantillonnage `PROFILE` dont les plans les plus coûteux en db hits sont gardés en
+mémoire pour `/debug/queries`.
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seuil (ms) du journal des requêtes lentes ; négatif = désactivé
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500"))
+PROFILE_SAMPLE_PERCENT = float(os.getenv("PROFILE_SAMPLE_PERCENT", "0"))
+PROFILE_TOP_PLANS = int(os.getenv("PROFILE_TOP_PLANS", "20"))
+
+# Commandes de schéma et d'administration : PROFILE n'y est pas accepté
+_NOT_PROFILABLE = re.compile(r"^\s*(CREATE\s+(CONSTRAINT|INDEX)|DROP|SHOW|EXPLAIN|PROFILE|CALL\s+db\.)", re.IGNORECASE)
+
+SLOW_QUERIES = metrics.registry.register(metrics.Counter(
+    "neo4j_slow_queries_total", "Requêtes Cypher au-dessus de SLOW_QUERY_THRESHOLD_MS.", ("query",)
+))
+
+
+def redact(params: dict) -> dict:
+    """Types et tailles des paramètres, jamais leurs valeurs."""
+    redacted = {}
+    for name, value in params.items():
+        if isinstance(value, (list, tuple, dict, str)):
+            redacted[name] = f"<{type(value).__name__}[{len(value)}]>"
+        else:
+            redacted[name] = f"<{type(value).__name__}>"
+    return redacted
+
+
+def _compact(query: str) -> str:
+    return " ".join(query.split())
+
+
+def _plan(profile: dict) -> dict:
+    return {
+        "operator": profile.get("operatorType"),
+        "details": profile.get("args", {}).get("Details"),
+        "rows": profile.get("rows", 0),
+        "db_hits": profile.get("dbHits", 0),
+        "children": [_plan(child) for child in profile.get("children", [])],
+    }
+
+
+def db_hits(plan: dict) -> int:
+    return plan["db_hits"] + sum(db_hits(child) for child in plan["children"])
+
+
+class PlanStore:
+    """Plans PROFILE agrégés par requête ; seuls les `size` plus coûteux sont gardés."""
+
+    def __init__(self, size: int = PROFILE_TOP_PLANS):
+        self.size = size
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, query: str, profile: dict, elapsed_ms: float):
+        plan = _plan(profile)
+        hits = db_hits(plan)
+        key = (name, query)
+        with self._lock:
+            entry = self._plans.get(key)
+            if entry is None:
+                entry = self._plans[key] = {
+                    "query_name": name, "query": query, "samples": 0,
+                    "total_db_hits": 0, "max_db_hits": 0, "total_ms": 0.0,
+                }
+            entry["samples"] += 1
+            entry["total_db_hits"] += hits
+            entry["total_ms"] += elapsed_ms
+            if hits >= entry["max_db_hits"]:
+                entry["max_db_hits"] = hits
+                entry["plan"] = plan
+            if len(self._plans) > self.size:
+                coldest = min(self._plans, key=lambda k: self._plans[k]["total_db_hits"])
+                del self._plans[coldest]
+
+    def hottest(self):
+        with self._lock:
+            entries = [dict(entry) for entry in self._plans.values()]
+        return sorted(entries, key=lambda entry: -entry["total_db_hits"])
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+
+plan_store = PlanStore()
+
+
+def _sampled(query: str) -> bool:
+    return PROFILE_SAMPLE_PERCENT > 0 and random.random() * 100 < PROFILE_SAMPLE_PERCENT and not _NOT_PROFILABLE.match(query)
+
+
+def observe_summary(query: str, params: dict, summary, elapsed: float, profiled: bool = False, name: str = None):
+    """Exploite le résumé d'un résultat consommé : journal des requêtes lentes et plans."""
+    name = name or metrics.query_name.get() or "unknown"
+    elapsed_ms = elapsed * 1000
+    if profiled and summary.profile:
+        plan_store.add(name, _compact(query), summary.profile, elapsed_ms)
+    if 0 <= SLOW_QUERY_THRESHOLD_MS <= elapsed_ms:
+        SLOW_QUERIES.inc(name)
+        counters = {k: v for k, v in vars(summary.counters).items() if not k.startswith("_") and v}
+        logger.warning(
+            "Slow query %s: %.1f ms (available after %s ms, consumed after %s ms) counters=%s params=%s query=%s",
+            name, elapsed_ms, summary.result_available_after, summary.result_consumed_after,
+            counters, redact(params), _compact(query),
+        )
+
+
+async def run(tx, query: str, **params):
+    """`tx.run` instrumenté : renvoie la liste des enregistrements."""
+    profiled = _sampled(query)
+    started = time.perf_counter()
+    result = await tx.run("PROFILE " + query if profiled else query, **params)
+    records = [record async for record in result]
+    summary = await result.consume()
+    observe_summary(query, params, summary, time.perf_counter() - started, profiled)
+    return records
@@ -0,0 +1,29 @@
+"""
+Accès aux données par dépôts : `STORAGE_BACKEND=neo4j` (défaut) ou `memory`.
+Les handlers de app.main ne passent que par le singleton `repositories`.
+"""
+import os
+
+from .base import AlreadyExists, CompatibilityRepository, EntityRepository, RelationshipRepository, Repositories, UserRepository
+from .cypher import neo4j_repositories
+from .memory import MemoryGraph, memory_repositories
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "neo4j").lower()
+
+
+def create_repositories(backend: str = STORAGE_BACKEND) -> Repositories:
+    if backend == "memory":
+        return memory_repositories()
+    if backend == "neo4j":
+        return neo4j_repositories()
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+# Singleton utilisé par les handlers
+repositories = create_repositories()
+
+__all__ = [
+    "AlreadyExists", "CompatibilityRepository", "EntityRepository", "MemoryGraph", "RelationshipRepository",
+    "Repositories", "UserRepository", "create_repositories", "memory_repositories",
+    "neo4j_repositories", "repositories",
+]
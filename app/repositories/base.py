@@ -0,0 +1,116 @@
+"""
+Interfaces des dépôts : une par label et par type de relation, plus le calcul de
+compatibilité. Les implémentations renvoient des dicts prêts pour les schémas de
+réponse ; une entité absente donne None (ou False), jamais une exception.
+"""
+
+
+class AlreadyExists(ValueError):
+    """Création d'une entité dont la clé existe déjà (409 pour l'API)."""
+
+
+class EntityRepository:
+    """Noeuds d'un label identifiés par `key` (id, ou name pour Genre)."""
+
+    label = None
+    key = "id"
+
+    async def create(self, props: dict) -> dict:
+        """Lève AlreadyExists si la clé est prise (sauf Genre, idempotent)."""
+        raise NotImplementedError
+
+    async def get(self, key) -> dict:
+        """Propriétés et compteurs de popularité, None si absent."""
+        raise NotImplementedError
+
+    async def update(self, key, props: dict) -> dict:
+        """Lève AlreadyExists si un renommage (Genre) vise une clé prise."""
+        raise NotImplementedError
+
+    async def delete(self, key) -> bool:
+        raise NotImplementedError
+
+    async def list(self, after=None, limit=None) -> list:
+        """Page triée par clé, strictement après `after`."""
+        raise NotImplementedError
+
+    def stream(self, after=None, limit=None):
+        """Même page, en itérateur asynchrone (sortie ndjson)."""
+        raise NotImplementedError
+
+    async def bulk_create(self, items: list) -> list:
+        """Statut par item : created, existing (doublon compris) ou missing."""
+        raise NotImplementedError
+
+
+class UserRepository:
+    async def get(self, user_id: str) -> dict:
+        raise NotImplementedError
+
+    async def upsert(self, user) -> dict:
+        """Crée ou remplace ; renvoie id, name, gender, age, orientation (nom)."""
+        raise NotImplementedError
+
+    async def delete(self, user_id: str) -> bool:
+        raise NotImplementedError
+
+    async def bulk_create(self, users: list) -> list:
+        raise NotImplementedError
+
+
+class RelationshipRepository:
+    """Relations d'un type, de `source` vers `target` (clés des deux labels)."""
+
+    rel_type = None
+
+    async def add(self, source, target) -> bool:
+        """Idempotent ; False si une des extrémités n'existe pas."""
+        raise NotImplementedError
+
+    async def remove(self, source, target) -> bool:
+        """False si la relation n'existait pas."""
+        raise NotImplementedError
+
+    async def bulk_create(self, relations: list) -> list:
+        """`relations` : dicts source/target ; statut par item comme EntityRepository."""
+        raise NotImplementedError
+
+
+class CompatibilityRepository:
+    async def pair(self, user1_id: str, user2_id: str) -> dict:
+        raise NotImplementedError
+
+    async def batch(self, pairs: list) -> list:
+        """Liste alignée sur `pairs`, None pour une paire inconnue."""
+        raise NotImplementedError
+
+    async def top(self, user_id: str, limit: int = 5) -> list:
+        raise NotImplementedError
+
+    async def top_materialized(self, user_id: str, limit: int = 5) -> list:
+        """Top-K lu dans les scores précalculés (relations COMPATIBLE)."""
+        raise NotImplementedError
+
+    async def orientation(self, user1_id: str, user2_id: str):
+        raise NotImplementedError
+
+
+class Repositories:
+    """
+    Ensemble des dépôts d'un backend. `shared` indique un stockage partagé entre
+    réplicas (Neo4j) : versions ETag, instantanés statistiques et index dérivés en dépendent.
+    """
+
+    def __init__(self, genres, artists, songs, users, playlists, relationships, compatibility, shared, compute_stats=None):
+        self.genres = genres
+        self.artists = artists
+        self.songs = songs
+        self.users = users
+        self.playlists = playlists
+        self.relationships = relationships
+        self.compatibility = compatibility
+        self.shared = shared
+        self.compute_stats = compute_stats
+
+    def entities(self, label: str) -> EntityRepository:
+        return {"Genre": self.genres, "Artist": self.artists, "Song": self.songs, "Playlist": self.playlists}[label]
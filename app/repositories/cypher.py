@@ -0,0 +1,360 @@
+"""
+Dépôts adossés à Neo4j : le comportement historique des handlers, requêtes comprises.
+"""
+import functools
+import time
+
+from neo4j import READ_ACCESS
+from neo4j.exceptions import ConstraintError
+
+from .. import metrics, profiling
+from ..compatibility_engine import SCORE_RELATIONSHIPS, mark_engine_changed
+from ..bulk import ENTITY_KEYS, RELATIONSHIPS, USER_BULK_QUERY, entity_query, relationship_query, run_bulk
+from ..counters import (
+    CONTAINS_DELTA_QUERY, OWNS_DELTA_QUERY, PLAYLIST_DELETE_QUERY, SONG_DELETE_QUERY,
+    counter_status, delete_with_counters, repair_playlists, write_with_counters,
+)
+from ..crud import CRUD
+from ..database import async_db
+from ..pagination import page_query
+from .base import AlreadyExists, CompatibilityRepository, EntityRepository, RelationshipRepository, Repositories, UserRepository
+
+
+def _named(method):
+    """Nom logique des requêtes de la méthode dans /metrics et le journal des requêtes lentes."""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        token = metrics.query_name.set(f"{self.metric_prefix}.{method.__name__}")
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            metrics.query_name.reset(token)
+    return wrapper
+
+
+# Projections des listes : propriétés exposées et compteurs (0 si jamais initialisés)
+GENRE_PROJECTION = "{name: n.name, song_count: coalesce(n.song_count, 0), listener_count: coalesce(n.listener_count, 0)}"
+ARTIST_PROJECTION = "n {.id, .name, .followers, follower_count: coalesce(n.follower_count, 0)}"
+SONG_PROJECTION = "n {.id, .title, .duration, .explicit, like_count: coalesce(n.like_count, 0), playlist_count: coalesce(n.playlist_count, 0)}"
+PLAYLIST_PROJECTION = "n {.id, .name, .public, .created, song_count: coalesce(n.song_count, 0)}"
+
+
+class Neo4jEntityRepository(EntityRepository):
+    projection = "n {.*}"
+
+    def __init__(self, label: str, projection: str = None):
+        self.label = label
+        self.key = ENTITY_KEYS[label]
+        self.metric_prefix = label.lower()
+        if projection:
+            self.projection = projection
+        match = f"MATCH (n:{label} {{{self.key}: $key}})"
+        self.create_query = f"CREATE (n:{label} $props) RETURN n {{.*}} AS item"
+        self.get_query = f"{match} RETURN n {{.*}} AS item"
+        self.update_query = f"{match} SET n += $props RETURN n {{.*}} AS item"
+        self.delete_query = f"{match} DETACH DELETE n RETURN count(n) AS count"
+
+    @_named
+    async def create(self, props):
+        try:
+            records = await async_db.write(self.create_query, props=props)
+        except ConstraintError:
+            raise AlreadyExists(f"{self.label} {props[self.key]} already exists")
+        return records[0]["item"]
+
+    @_named
+    async def get(self, key):
+        records = await async_db.read(self.get_query, key=key)
+        return records[0]["item"] if records else None
+
+    @_named
+    async def update(self, key, props):
+        try:
+            records = await async_db.write(self.update_query, key=key, props=props)
+        except ConstraintError:
+            raise AlreadyExists(f"{self.label} {props[self.key]} already exists")
+        return records[0]["item"] if records else None
+
+    @_named
+    async def delete(self, key):
+        records = await async_db.write(self.delete_query, key=key)
+        # Genres : leurs relations LIKES_GENRE disparaissent avec eux
+        mark_engine_changed()
+        return records[0]["count"] > 0
+
+    @_named
+    async def list(self, after=None, limit=None):
+        records = await async_db.read(page_query(self.label, self.key, self.projection, after, limit), after=after, limit=limit)
+        return [record["item"] for record in records]
+
+    def stream(self, after=None, limit=None):
+        # Session ouverte dès l'appel pour capturer les bookmarks de la requête HTTP en cours
+        session = async_db.get_session(READ_ACCESS)
+        query = page_query(self.label, self.key, self.projection, after, limit)
+        return self._stream(session, query, after=after, limit=limit)
+
+    async def _stream(self, session, query, **params):
+        # Les enregistrements sont émis au fil de leur arrivée depuis le driver
+        started = time.perf_counter()
+        async with session:
+            result = await session.run(query, **params)
+            async for record in result:
+                yield record["item"]
+            summary = await result.consume()
+            profiling.observe_summary(query, params, summary, time.perf_counter() - started, name=f"{self.metric_prefix}.stream")
+
+    @_named
+    async def bulk_create(self, items):
+        return await run_bulk(
+            entity_query(self.label),
+            [{"props": props} for props in items],
+            key=lambda item: item["props"][self.key]
+        )
+
+
+class Neo4jGenreRepository(Neo4jEntityRepository):
+    def __init__(self):
+        super().__init__("Genre", GENRE_PROJECTION)
+        self.create_query = "MERGE (n:Genre {name: $props.name}) RETURN n {.name} AS item"
+
+
+class Neo4jSongRepository(Neo4jEntityRepository):
+    def __init__(self):
+        super().__init__("Song", SONG_PROJECTION)
+
+    @_named
+    async def delete(self, key):
+        counter_status.require()
+        records = await delete_with_counters(
+            SONG_DELETE_QUERY,
+            """MATCH (s:Song {id: $song_id})
+            FOREACH (g IN [(s)-[:HAS_GENRE]->(g:Genre) | g] | SET g.song_count = coalesce(g.song_count, 1) - 1)
+            DETACH DELETE s RETURN count(s) AS count""",
+            song_id=key
+        )
+        mark_engine_changed()
+        return records[0]["count"] > 0
+
+
+class Neo4jPlaylistRepository(Neo4jEntityRepository):
+    def __init__(self):
+        super().__init__("Playlist", PLAYLIST_PROJECTION)
+
+    @_named
+    async def delete(self, key):
+        counter_status.require()
+        records = await delete_with_counters(
+            PLAYLIST_DELETE_QUERY,
+            """MATCH (p:Playlist {id: $playlist_id})
+            FOREACH (s IN [(p)-[:CONTAINS]->(s:Song) | s] | SET s.playlist_count = coalesce(s.playlist_count, 1) - 1)
+            DETACH DELETE p RETURN count(p) AS count""",
+            playlist_id=key
+        )
+        mark_engine_changed()
+        return records[0]["count"] > 0
+
+
+class Neo4jUserRepository(UserRepository):
+    metric_prefix = "user"
+
+    @_named
+    async def get(self, user_id):
+        records = await async_db.read("MATCH (u:User {id: $id}) RETURN u {.*}", id=user_id)
+        return records[0]["u"] if records else None
+
+    async def upsert(self, user):
+        record = await CRUD.upsert_user(user)
+        mark_engine_changed()
+        return record
+
+    @_named
+    async def delete(self, user_id):
+        counter_status.require()
+        records = await async_db.write(
+            """MATCH (u:User {id: $id})
+            FOREACH (s IN [(u)-[:LIKED]->(s:Song) | s] | SET s.like_count = coalesce(s.like_count, 1) - 1)
+            FOREACH (g IN [(u)-[:LIKES_GENRE]->(g:Genre) | g] | SET g.listener_count = coalesce(g.listener_count, 1) - 1)
+            FOREACH (a IN [(u)-[:FOLLOWS]->(a:Artist) | a] | SET a.follower_count = coalesce(a.follower_count, 1) - 1)
+            DETACH DELETE u RETURN count(u) AS count""",
+            id=user_id
+        )
+        mark_engine_changed()
+        return records[0]["count"] > 0
+
+    @_named
+    async def bulk_create(self, users):
+        statuses = await run_bulk(
+            USER_BULK_QUERY,
+            [{"props": u.model_dump(exclude={"orientation"}), "orientation": u.orientation.name} for u in users],
+            key=lambda item: item["props"]["id"]
+        )
+        mark_engine_changed()
+        return statuses
+
+
+class Neo4jRelationshipRepository(RelationshipRepository):
+    """
+    Toutes les relations tiennent un compteur : refusées (CountersPending) avant son
+    initialisation. `add_query` renvoie une ligne si les deux extrémités existent (et `changed` avec
+    `counter_query`) ; `remove_query` renvoie `count` (et `changed`). Les paramètres sont
+    nommés d'après les labels : user_id, song_id, genre_name...
+    """
+
+    def __init__(self, rel_type: str, add_query: str, remove_query: str, counter_query: str = None):
+        source_label, source_key, target_label, target_key = RELATIONSHIPS[rel_type]
+        self.rel_type = rel_type
+        self.metric_prefix = rel_type.lower()
+        self.params = (f"{source_label.lower()}_{source_key}", f"{target_label.lower()}_{target_key}")
+        self.add_query = add_query
+        self.remove_query = remove_query
+        self.counter_query = counter_query
+
+    def _changed(self):
+        if self.rel_type in SCORE_RELATIONSHIPS:
+            mark_engine_changed()
+
+    def _params(self, source, target):
+        return dict(zip(self.params, (source, target)))
+
+    @_named
+    async def add(self, source, target):
+        counter_status.require()
+        if self.counter_query:
+            records = await write_with_counters(self.add_query, self.counter_query, **self._params(source, target), delta=1)
+        else:
+            records = await async_db.write(self.add_query, **self._params(source, target))
+        self._changed()
+        return bool(records)
+
+    @_named
+    async def remove(self, source, target):
+        counter_status.require()
+        if self.counter_query:
+            records = await write_with_counters(self.remove_query, self.counter_query, **self._params(source, target), delta=-1)
+        else:
+            records = await async_db.write(self.remove_query, **self._params(source, target))
+        self._changed()
+        return records[0]["count"] > 0
+
+    @_named
+    async def bulk_create(self, relations):
+        counter_status.require()
+        statuses = await run_bulk(
+            relationship_query(self.rel_type),
+            relations,
+            key=lambda item: (item["source"], item["target"])
+        )
+        if self.rel_type in ("OWNS", "CONTAINS"):
+            # Compteurs recalculés pour les playlists touchées plutôt que relation par relation
+            side = "target" if self.rel_type == "OWNS" else "source"
+            touched = {relations[i][side] for i, status in enumerate(statuses) if status == "created"}
+            if touched:
+                await repair_playlists(touched)
+        self._changed()
+        return statuses
+
+
+def _relationships():
+    return {
+        "LIKED": Neo4jRelationshipRepository(
+            "LIKED",
+            """MATCH (u:User {id: $user_id}), (s:Song {id: $song_id})
+            MERGE (u)-[r:LIKED]->(s)
+            ON CREATE SET s.like_count = coalesce(s.like_count, 0) + 1
+            RETURN r""",
+            """MATCH (u:User {id: $user_id})-[r:LIKED]->(s:Song {id: $song_id})
+            DELETE r
+            SET s.like_count = coalesce(s.like_count, 1) - 1
+            RETURN count(r) AS count""",
+        ),
+        "OWNS": Neo4jRelationshipRepository(
+            "OWNS",
+            """MATCH (u:User {id: $user_id}), (p:Playlist {id: $playlist_id})
+            MERGE (u)-[r:OWNS]->(p)
+            ON CREATE SET r._created = true
+            WITH r, r._created IS NOT NULL AS changed
+            REMOVE r._created
+            RETURN changed""",
+            """MATCH (u:User {id: $user_id})-[r:OWNS]->(p:Playlist {id: $playlist_id})
+            DELETE r
+            RETURN count(r) AS count, count(r) > 0 AS changed""",
+            OWNS_DELTA_QUERY,
+        ),
+        "CONTAINS": Neo4jRelationshipRepository(
+            "CONTAINS",
+            """MATCH (p:Playlist {id: $playlist_id}), (s:Song {id: $song_id})
+            MERGE (p)-[r:CONTAINS]->(s)
+            ON CREATE SET r._created = true, s.playlist_count = coalesce(s.playlist_count, 0) + 1
+            WITH r, r._created IS NOT NULL AS changed
+            REMOVE r._created
+            RETURN changed""",
+            """MATCH (p:Playlist {id: $playlist_id})-[r:CONTAINS]->(s:Song {id: $song_id})
+            DELETE r
+            SET s.playlist_count = coalesce(s.playlist_count, 1) - 1
+            RETURN count(r) AS count, count(r) > 0 AS changed""",
+            CONTAINS_DELTA_QUERY,
+        ),
+        "HAS_GENRE": Neo4jRelationshipRepository(
+            "HAS_GENRE",
+            """MATCH (s:Song {id: $song_id}), (g:Genre {name: $genre_name})
+            MERGE (s)-[:HAS_GENRE]->(g)
+            ON CREATE SET g.song_count = coalesce(g.song_count, 0) + 1
+            RETURN s.id AS song_id, g.name AS genre_name""",
+            """MATCH (s:Song {id: $song_id})-[r:HAS_GENRE]->(g:Genre {name: $genre_name})
+            DELETE r
+            SET g.song_count = coalesce(g.song_count, 1) - 1
+            RETURN count(r) AS count""",
+        ),
+        "LIKES_GENRE": Neo4jRelationshipRepository(
+            "LIKES_GENRE",
+            """MATCH (u:User {id: $user_id}), (g:Genre {name: $genre_name})
+            MERGE (u)-[:LIKES_GENRE]->(g)
+            ON CREATE SET g.listener_count = coalesce(g.listener_count, 0) + 1
+            RETURN g.name AS genre_name""",
+            """MATCH (u:User {id: $user_id})-[r:LIKES_GENRE]->(g:Genre {name: $genre_name})
+            DELETE r
+            SET g.listener_count = coalesce(g.listener_count, 1) - 1
+            RETURN count(r) AS count""",
+        ),
+        "FOLLOWS": Neo4jRelationshipRepository(
+            "FOLLOWS",
+            """MATCH (u:User {id: $user_id}), (a:Artist {id: $artist_id})
+            MERGE (u)-[:FOLLOWS]->(a)
+            ON CREATE SET a.follower_count = coalesce(a.follower_count, 0) + 1
+            RETURN a.id AS artist_id""",
+            """MATCH (u:User {id: $user_id})-[r:FOLLOWS]->(a:Artist {id: $artist_id})
+            DELETE r
+            SET a.follower_count = coalesce(a.follower_count, 1) - 1
+            RETURN count(r) AS count""",
+        ),
+    }
+
+
+class Neo4jCompatibilityRepository(CompatibilityRepository):
+    async def pair(self, user1_id, user2_id):
+        return await CRUD.get_user_compatibility(user1_id, user2_id)
+
+    async def batch(self, pairs):
+        return await CRUD.get_users_compatibility_batch(pairs)
+
+    async def top(self, user_id, limit=5):
+        return await CRUD.get_top_compatible_users(user_id, limit)
+
+    async def top_materialized(self, user_id, limit=5):
+        return await CRUD.get_top_compatible_users_materialized(user_id, limit)
+
+    async def orientation(self, user1_id, user2_id):
+        return await CRUD.get_orientation_compatibility(user1_id, user2_id)
+
+
+def neo4j_repositories() -> Repositories:
+    return Repositories(
+        genres=Neo4jGenreRepository(),
+        artists=Neo4jEntityRepository("Artist", ARTIST_PROJECTION),
+        songs=Neo4jSongRepository(),
+        users=Neo4jUserRepository(),
+        playlists=Neo4jPlaylistRepository(),
+        relationships=_relationships(),
+        compatibility=Neo4jCompatibilityRepository(),
+        shared=True,
+    )
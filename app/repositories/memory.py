@@ -0,0 +1,416 @@
+"""
+Backend en mémoire : noeuds par label et index d'adjacence dict/set dans les deux sens,
+sans base de données. Il couvre toute l'API, score de compatibilité compris (même
+formule et même arrondi que la requête Cypher), et sert aux tests, aux benchmarks et
+au développement local (`STORAGE_BACKEND=memory`).
+
+Les compteurs de popularité sont les degrés des index, toujours exacts. Les relations
+FOLLOWS de l'API visent des artistes : comme dans Neo4j, le terme « playlists publiques
+suivies en commun » du score vaut donc 0.
+"""
+import heapq
+from bisect import bisect_right, insort
+from collections import Counter, defaultdict
+
+from ..bulk import ENTITY_KEYS, RELATIONSHIPS
+from ..compatibility_engine import (
+    GENRE_POINTS, MAX_SCORE, PERSONAL_CAP, PERSONAL_WEIGHT, PLAYLIST_CAP, PLAYLIST_WEIGHT,
+    SIMILARITY_WEIGHT, SONG_CAP, SONG_WEIGHT, cypher_round,
+)
+from ..stats import SIZE_LABELS, STATS_TOP_K, age_bucket, size_bucket
+from .base import AlreadyExists, CompatibilityRepository, EntityRepository, RelationshipRepository, Repositories, UserRepository
+
+LABELS = ("User", "Song", "Artist", "Playlist", "Genre")
+
+# Compteurs exposés par label : propriété -> (type de relation, sens du degré)
+DEGREE_PROPERTIES = {
+    "Song": {"like_count": ("LIKED", "in"), "playlist_count": ("CONTAINS", "in")},
+    "Genre": {"song_count": ("HAS_GENRE", "in"), "listener_count": ("LIKES_GENRE", "in")},
+    "Artist": {"follower_count": ("FOLLOWS", "in")},
+    "Playlist": {"song_count": ("CONTAINS", "out")},
+}
+
+
+class MemoryGraph:
+    def __init__(self):
+        self.nodes = {label: {} for label in LABELS}
+        self._sorted = {label: [] for label in LABELS}
+        self.out = {rel_type: defaultdict(set) for rel_type in RELATIONSHIPS}
+        self.inc = {rel_type: defaultdict(set) for rel_type in RELATIONSHIPS}
+        self.orientations = {}
+        # (orientation source, orientation cible) -> score COMPATIBLE_WITH
+        self.orientation_scores = {}
+
+    # --- Noeuds ---
+    def add_node(self, label, key, props):
+        if key not in self.nodes[label]:
+            insort(self._sorted[label], key)
+        self.nodes[label][key] = dict(props)
+
+    def remove_node(self, label, key):
+        if self.nodes[label].pop(key, None) is None:
+            return False
+        keys = self._sorted[label]
+        del keys[bisect_right(keys, key) - 1]
+        for rel_type, (source_label, _, target_label, _) in RELATIONSHIPS.items():
+            if source_label == label:
+                for target in self.out[rel_type].pop(key, set()):
+                    self._discard(self.inc[rel_type], target, key)
+            if target_label == label:
+                for source in self.inc[rel_type].pop(key, set()):
+                    self._discard(self.out[rel_type], source, key)
+        if label == "User":
+            self.orientations.pop(key, None)
+        return True
+
+    def page(self, label, after=None, limit=None):
+        keys = self._sorted[label]
+        start = 0 if after is None else bisect_right(keys, after)
+        end = len(keys) if limit is None else start + limit
+        return [self.view(label, key) for key in keys[start:end]]
+
+    def view(self, label, key):
+        """Propriétés et compteurs de popularité (degrés)."""
+        item = dict(self.nodes[label][key])
+        for prop, (rel_type, side) in DEGREE_PROPERTIES.get(label, {}).items():
+            item[prop] = self.degree(rel_type, key, side)
+        return item
+
+    # --- Relations ---
+    @staticmethod
+    def _discard(index, key, value):
+        values = index.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del index[key]
+
+    def has_nodes(self, rel_type, source, target):
+        source_label, _, target_label, _ = RELATIONSHIPS[rel_type]
+        return source in self.nodes[source_label] and target in self.nodes[target_label]
+
+    def add_edge(self, rel_type, source, target):
+        """True si la relation a été créée."""
+        if target in self.out[rel_type].get(source, ()):
+            return False
+        self.out[rel_type][source].add(target)
+        self.inc[rel_type][target].add(source)
+        return True
+
+    def remove_edge(self, rel_type, source, target):
+        if target not in self.out[rel_type].get(source, ()):
+            return False
+        self._discard(self.out[rel_type], source, target)
+        self._discard(self.inc[rel_type], target, source)
+        return True
+
+    def targets(self, rel_type, source):
+        return self.out[rel_type].get(source, set())
+
+    def sources(self, rel_type, target):
+        return self.inc[rel_type].get(target, set())
+
+    def degree(self, rel_type, key, side="out"):
+        return len((self.out if side == "out" else self.inc)[rel_type].get(key, ()))
+
+    # --- Compatibilité ---
+    def curated_via(self, user_id):
+        """Chanson -> playlists possédées qui la contiennent (relations CURATES de Neo4j)."""
+        via = defaultdict(set)
+        for playlist in self.targets("OWNS", user_id):
+            for song in self.targets("CONTAINS", playlist):
+                via[song].add(playlist)
+        return via
+
+    @staticmethod
+    def distinct_paths(mine, theirs):
+        """Comme Cypher, deux chemins vers une chanson ne partagent pas la même relation CONTAINS."""
+        return len(mine) > 1 or len(theirs) > 1 or mine != theirs
+
+    def personal_matches(self, user1_id, user2_id):
+        via1, via2 = self.curated_via(user1_id), self.curated_via(user2_id)
+        return sum(1 for song in via1.keys() & via2.keys() if self.distinct_paths(via1[song], via2[song]))
+
+    def owned_song_count(self, user_id):
+        return sum(self.degree("CONTAINS", p) for p in self.targets("OWNS", user_id))
+
+    def user_view(self, user_id, orientation=False):
+        user = dict(self.nodes["User"][user_id])
+        if orientation:
+            user["orientation"] = {"name": self.orientations.get(user_id)}
+        return user
+
+    def score(self, genres, songs, playlists, personal, similarity):
+        raw = (
+            (genres > 0) * GENRE_POINTS
+            + min(songs, SONG_CAP) * SONG_WEIGHT
+            + min(playlists, PLAYLIST_CAP) * PLAYLIST_WEIGHT
+            + min(personal, PERSONAL_CAP) * PERSONAL_WEIGHT
+            + similarity * SIMILARITY_WEIGHT
+        )
+        return cypher_round(min(raw, MAX_SCORE))
+
+    def similarity(self, owned1, owned2, common):
+        total = owned1 + owned2
+        return common / (total - common) if total > 0 else 0
+
+    def pair(self, user1_id, user2_id):
+        users = self.nodes["User"]
+        if user1_id not in users or user2_id not in users:
+            return None
+        shared_genres = sorted(self.targets("LIKES_GENRE", user1_id) & self.targets("LIKES_GENRE", user2_id))
+        shared_songs = len(self.targets("LIKED", user1_id) & self.targets("LIKED", user2_id))
+        personal = self.personal_matches(user1_id, user2_id)
+        common = sum(self.degree("CONTAINS", p) for p in self.targets("OWNS", user1_id) & self.targets("OWNS", user2_id))
+        similarity = self.similarity(self.owned_song_count(user1_id), self.owned_song_count(user2_id), common)
+        return {
+            "user1": self.user_view(user1_id, orientation=True),
+            "user2": self.user_view(user2_id, orientation=True),
+            "shared_genres": shared_genres,
+            "shared_songs": shared_songs,
+            "shared_playlists": 0,
+            "personal_playlist_common_songs": personal,
+            "playlist_similarity": cypher_round(similarity, 4),
+            "compatibility_score": self.score(len(shared_genres), shared_songs, 0, personal, similarity),
+        }
+
+    def top(self, user_id, limit):
+        """Scores accumulés par les index inverses ; ex aequo départagés par id."""
+        if user_id not in self.nodes["User"] or limit <= 0:
+            return []
+        genres, songs, personal, common = Counter(), Counter(), Counter(), Counter()
+        for genre in self.targets("LIKES_GENRE", user_id):
+            genres.update(self.sources("LIKES_GENRE", genre))
+        for song in self.targets("LIKED", user_id):
+            songs.update(self.sources("LIKED", song))
+        for song, mine in self.curated_via(user_id).items():
+            theirs = defaultdict(set)
+            for playlist in self.sources("CONTAINS", song):
+                for owner in self.sources("OWNS", playlist):
+                    theirs[owner].add(playlist)
+            personal.update(owner for owner, playlists in theirs.items() if self.distinct_paths(mine, playlists))
+        for playlist in self.targets("OWNS", user_id):
+            for owner in self.sources("OWNS", playlist):
+                common[owner] += self.degree("CONTAINS", playlist)
+
+        owned = self.owned_song_count(user_id)
+        rows = []
+        for other in (set(genres) | set(songs) | set(personal) | set(common)) - {user_id}:
+            similarity = self.similarity(owned, self.owned_song_count(other), common[other]) if common[other] else 0
+            score = self.score(genres[other], songs[other], 0, personal[other], similarity)
+            rows.append((-score, other, genres[other], songs[other], personal[other]))
+        best = heapq.nsmallest(limit, rows)
+        if len(best) < limit:
+            scored = {row[1] for row in rows} | {user_id}
+            filler = heapq.nsmallest(limit - len(best), (u for u in self.nodes["User"] if u not in scored))
+            best += [(0.0, other, 0, 0, 0) for other in filler]
+        return [
+            {
+                "user": {k: self.nodes["User"][other].get(k) for k in ("id", "name", "gender", "age")},
+                "shared_genres": shared_genres,
+                "shared_songs": shared_songs,
+                "shared_playlists": 0,
+                "personal_playlist_matches": matches,
+                "compatibility_score": -score if score else 0.0,
+            }
+            for score, other, shared_genres, shared_songs, matches in best
+        ]
+
+    # --- Statistiques ---
+    def stats(self, top_k=STATS_TOP_K):
+        """Mêmes sections que app.stats.compute."""
+        genres = sorted(
+            (self.view("Genre", name) for name in self.nodes["Genre"]),
+            key=lambda g: (-g["listener_count"], -g["song_count"], g["name"]),
+        )
+
+        def top_songs(keys):
+            ranked = sorted((-self.degree("LIKED", s, "in"), s) for s in keys if self.degree("LIKED", s, "in") > 0)
+            return [{"id": s, "title": self.nodes["Song"][s].get("title"), "like_count": -n} for n, s in ranked[:top_k]]
+
+        artists = sorted((-self.degree("FOLLOWS", a, "in"), a) for a in self.nodes["Artist"] if self.degree("FOLLOWS", a, "in") > 0)
+        sizes = Counter(size_bucket(self.degree("CONTAINS", p)) for p in self.nodes["Playlist"])
+        users = self.nodes["User"].values()
+        return {
+            "genres": [{"name": g["name"], "song_count": g["song_count"], "listener_count": g["listener_count"]} for g in genres],
+            "top_songs": top_songs(self.nodes["Song"]),
+            "top_songs_by_genre": {
+                g["name"]: top_songs(self.sources("HAS_GENRE", g["name"])) for g in genres if g["song_count"] > 0
+            },
+            "top_artists": [{"id": a, "name": self.nodes["Artist"][a].get("name"), "follower_count": -n} for n, a in artists[:top_k]],
+            "playlist_sizes": {label: sizes[label] for label in SIZE_LABELS},
+            "users": {
+                "total": len(self.nodes["User"]),
+                "by_gender": dict(Counter(u.get("gender") or "unknown" for u in users)),
+                "by_age": dict(Counter(age_bucket(u.get("age")) for u in users)),
+                "by_orientation": dict(Counter(self.orientations.get(u) or "unknown" for u in self.nodes["User"])),
+            },
+        }
+
+
+def _statuses(items, key, create):
+    """Statuts de l'import en masse : `create(item)` renvoie created, existing ou missing."""
+    statuses, seen = [], {}
+    for item in items:
+        k = key(item)
+        if k in seen:
+            statuses.append("missing" if seen[k] == "missing" else "existing")
+        else:
+            seen[k] = create(item)
+            statuses.append(seen[k])
+    return statuses
+
+
+class MemoryEntityRepository(EntityRepository):
+    def __init__(self, graph: MemoryGraph, label: str):
+        self.graph = graph
+        self.label = label
+        self.key = ENTITY_KEYS[label]
+
+    async def create(self, props):
+        key = props[self.key]
+        if key in self.graph.nodes[self.label]:
+            if self.label == "Genre":
+                return {"name": key}
+            raise AlreadyExists(f"{self.label} {key} already exists")
+        self.graph.add_node(self.label, key, {k: v for k, v in props.items() if v is not None})
+        return self.graph.nodes[self.label][key] if self.label != "Genre" else {"name": key}
+
+    async def get(self, key):
+        if key not in self.graph.nodes[self.label]:
+            return None
+        return self.graph.view(self.label, key)
+
+    async def update(self, key, props):
+        nodes = self.graph.nodes[self.label]
+        if key not in nodes:
+            return None
+        updated = {k: v for k, v in {**nodes[key], **props}.items() if v is not None}
+        new_key = updated[self.key]
+        if new_key != key and new_key in nodes:
+            raise AlreadyExists(f"{self.label} {new_key} already exists")
+        if new_key != key:
+            # Renommage (Genre) : les relations suivent le noeud
+            edges = {
+                rel_type: (set(self.graph.targets(rel_type, key)), set(self.graph.sources(rel_type, key)))
+                for rel_type in RELATIONSHIPS
+            }
+            self.graph.remove_node(self.label, key)
+            self.graph.add_node(self.label, new_key, updated)
+            for rel_type, (targets, sources) in edges.items():
+                source_label, _, target_label, _ = RELATIONSHIPS[rel_type]
+                for target in targets if source_label == self.label else ():
+                    self.graph.add_edge(rel_type, new_key, target)
+                for source in sources if target_label == self.label else ():
+                    self.graph.add_edge(rel_type, source, new_key)
+        else:
+            nodes[key] = updated
+        return dict(updated)
+
+    async def delete(self, key):
+        return self.graph.remove_node(self.label, key)
+
+    async def list(self, after=None, limit=None):
+        return self.graph.page(self.label, after, limit)
+
+    def stream(self, after=None, limit=None):
+        return self._stream(self.graph.page(self.label, after, limit))
+
+    async def _stream(self, items):
+        for item in items:
+            yield item
+
+    async def bulk_create(self, items):
+        def create(props):
+            if props[self.key] in self.graph.nodes[self.label]:
+                return "existing"
+            self.graph.add_node(self.label, props[self.key], {k: v for k, v in props.items() if v is not None})
+            return "created"
+        return _statuses(items, lambda props: props[self.key], create)
+
+
+class MemoryUserRepository(UserRepository):
+    def __init__(self, graph: MemoryGraph):
+        self.graph = graph
+
+    async def get(self, user_id):
+        if user_id not in self.graph.nodes["User"]:
+            return None
+        return self.graph.user_view(user_id)
+
+    async def upsert(self, user):
+        props = user.model_dump(exclude={"orientation"})
+        self.graph.add_node("User", user.id, {**self.graph.nodes["User"].get(user.id, {}), **props})
+        self.graph.orientations[user.id] = user.orientation.name
+        return {**props, "orientation": user.orientation.name}
+
+    async def delete(self, user_id):
+        return self.graph.remove_node("User", user_id)
+
+    async def bulk_create(self, users):
+        def create(user):
+            if user.id in self.graph.nodes["User"]:
+                return "existing"
+            self.graph.add_node("User", user.id, user.model_dump(exclude={"orientation"}))
+            self.graph.orientations[user.id] = user.orientation.name
+            return "created"
+        return _statuses(users, lambda user: user.id, create)
+
+
+class MemoryRelationshipRepository(RelationshipRepository):
+    def __init__(self, graph: MemoryGraph, rel_type: str):
+        self.graph = graph
+        self.rel_type = rel_type
+
+    async def add(self, source, target):
+        if not self.graph.has_nodes(self.rel_type, source, target):
+            return False
+        self.graph.add_edge(self.rel_type, source, target)
+        return True
+
+    async def remove(self, source, target):
+        return self.graph.remove_edge(self.rel_type, source, target)
+
+    async def bulk_create(self, relations):
+        def create(relation):
+            if not self.graph.has_nodes(self.rel_type, relation["source"], relation["target"]):
+                return "missing"
+            return "created" if self.graph.add_edge(self.rel_type, relation["source"], relation["target"]) else "existing"
+        return _statuses(relations, lambda r: (r["source"], r["target"]), create)
+
+
+class MemoryCompatibilityRepository(CompatibilityRepository):
+    def __init__(self, graph: MemoryGraph):
+        self.graph = graph
+
+    async def pair(self, user1_id, user2_id):
+        return self.graph.pair(user1_id, user2_id)
+
+    async def batch(self, pairs):
+        return [self.graph.pair(user1_id, user2_id) for user1_id, user2_id in pairs]
+
+    async def top(self, user_id, limit=5):
+        return self.graph.top(user_id, limit)
+
+    async def top_materialized(self, user_id, limit=5):
+        # Pas de calcul hors ligne en mémoire : le calcul direct est exact et aussi rapide
+        return self.graph.top(user_id, limit)
+
+    async def orientation(self, user1_id, user2_id):
+        o1, o2 = self.graph.orientations.get(user1_id), self.graph.orientations.get(user2_id)
+        return self.graph.orientation_scores.get((o1, o2))
+
+
+def memory_repositories(graph: MemoryGraph = None) -> Repositories:
+    graph = graph or MemoryGraph()
+    return Repositories(
+        genres=MemoryEntityRepository(graph, "Genre"),
+        artists=MemoryEntityRepository(graph, "Artist"),
+        songs=MemoryEntityRepository(graph, "Song"),
+        users=MemoryUserRepository(graph),
+        playlists=MemoryEntityRepository(graph, "Playlist"),
+        relationships={rel_type: MemoryRelationshipRepository(graph, rel_type) for rel_type in RELATIONSHIPS},
+        compatibility=MemoryCompatibilityRepository(graph),
+        shared=False,
+        compute_stats=graph.stats,
+    )
@@ -1,3 +1,4 @@
+from enum import Enum
 from pydantic import BaseModel
 from typing import List, Optional
 
@@ -39,6 +40,13 @@ class CompatibilityResponse(BaseModel):
     compatibility_score: float
 
 
+class CompatibilityBatchItem(BaseModel):
+    user1_id: str
+    user2_id: str
+    result: Optional[CompatibilityResponse] = None
+    error: Optional[str] = None
+
+
 class OrientationCompatibilityResponse(BaseModel):
     user1_id: str
     user2_id: str
@@ -80,3 +88,48 @@ class Playlist(BaseModel):
 
 class Genre(BaseModel):
     name: str
+
+
+# Réponses de lecture : entités enrichies de leurs compteurs de popularité
+class SongStats(Song):
+    like_count: int = 0
+    playlist_count: int = 0
+
+
+class ArtistStats(Artist):
+    follower_count: int = 0
+
+
+class PlaylistStats(Playlist):
+    song_count: int = 0
+
+
+class GenreStats(Genre):
+    song_count: int = 0
+    listener_count: int = 0
+
+
+class RelationType(str, Enum):
+    LIKED = "LIKED"
+    OWNS = "OWNS"
+    CONTAINS = "CONTAINS"
+    HAS_GENRE = "HAS_GENRE"
+    LIKES_GENRE = "LIKES_GENRE"
+    FOLLOWS = "FOLLOWS"
+
+
+class BulkRelation(BaseModel):
+    source: str
+    target: str
+
+
+class BulkItemStatus(BaseModel):
+    index: int
+    status: str
+
+
+class BulkResponse(BaseModel):
+    created: int
+    existing: int
+    missing: int
+    items: List[BulkItemStatus]
@@ -0,0 +1,45 @@
+"""
+Chemin de sérialisation rapide des grandes réponses (listes paginées, top-K), activé par
+`FAST_JSON_RESPONSES=true`. Les maps renvoyées par les dépôts sont déjà projetées sur les
+schémas de réponse : elles sont encodées telles quelles par orjson, sans re-validation
+pydantic ni passage par jsonable_encoder. Sans orjson, repli sur le module json.
+"""
+import json
+import os
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # encodeur compilé optionnel
+    orjson = None
+
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "false").lower() == "true"
+
+
+def _default(value):
+    # Types temporels du driver (neo4j.time.Date...), sinon représentation texte
+    if hasattr(value, "iso_format"):
+        return value.iso_format()
+    return str(value)
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def fast_response(content, response: Response = None) -> FastJSONResponse:
+    """Réponse encodée directement ; reprend les en-têtes posés sur `response` (ETag, curseur)."""
+    headers = None
+    if response is not None:
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    return FastJSONResponse(content, headers=headers)
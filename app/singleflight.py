@@ -0,0 +1,76 @@
+"""
+Regroupement des appels identiques en cours (single-flight) : les appels concurrents de
+même clé partagent une seule exécution et son résultat (ou son exception). Rien n'est
+conservé une fois l'exécution terminée : ce n'est pas un cache.
+
+La clé contient les bookmarks de lecture en vigueur (dernière écriture du processus et
+bookmarks reçus avec la requête) : un appel qui suit une écriture ne rejoint jamais une
+exécution partie avant elle.
+"""
+import asyncio
+import functools
+import inspect
+import os
+
+from . import metrics
+from .database import async_db
+
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+
+
+def _retrieve(task):
+    # Exception marquée comme lue même si tous les appelants ont été annulés
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key, compute, name: str = "unnamed"):
+        """`compute` est une fonction sans argument qui renvoie une coroutine."""
+        # Les tâches sont liées à leur boucle d'événements
+        key = (asyncio.get_running_loop(), key)
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._flights[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+            task.add_done_callback(_retrieve)
+        elif metrics.METRICS_ENABLED:
+            COALESCED_CALLS.inc(name)
+        # Un appelant annulé (client déconnecté) n'annule pas l'exécution partagée
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+
+
+def single_flight(method):
+    """Décore une coroutine : clé = nom qualifié, arguments normalisés (ordre compris) et bookmarks."""
+    signature = inspect.signature(method)
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if not SINGLE_FLIGHT:
+            return await method(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        bookmarks = frozenset(async_db.bookmarks.for_read().raw_values)
+        key = (name, tuple(bound.arguments.values()), bookmarks)
+        return await flights.do(key, lambda: method(*args, **kwargs), name)
+    return wrapper
+
+
+COALESCED_CALLS = metrics.registry.register(metrics.Counter(
+    "singleflight_coalesced_total", "Appels ayant rejoint une exécution identique déjà en cours.", ("call",)
+))
+
+# Singleton partagé par les méthodes décorées
+flights = SingleFlight()
@@ -0,0 +1,260 @@
+"""
+Agrégats statistiques calculés périodiquement depuis le graphe et servis depuis la mémoire.
+
+Chaque calcul produit un instantané versionné, enregistré dans un noeud `StatsSnapshot`
+(les `STATS_SNAPSHOT_RETENTION` derniers sont conservés) : les autres réplicas le
+rechargent au lieu de recalculer. Les parcours complets (utilisateurs, playlists) se
+font par lots de `STATS_BATCH_SIZE` ; le reste lit les compteurs de app.counters.
+
+    python -m app.stats   # calcule et enregistre un instantané
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timezone
+
+from neo4j.exceptions import ConstraintError
+
+from .counters import counter_status
+from .database import async_db
+
+logger = logging.getLogger(__name__)
+
+STATS_REFRESH_INTERVAL = float(os.getenv("STATS_REFRESH_INTERVAL", "300"))
+STATS_BATCH_SIZE = int(os.getenv("STATS_BATCH_SIZE", "1000"))
+STATS_TOP_K = int(os.getenv("STATS_TOP_K", "10"))
+STATS_SNAPSHOT_RETENTION = int(os.getenv("STATS_SNAPSHOT_RETENTION", "10"))
+
+AGE_BUCKETS = [(0, 17, "<18"), (18, 24, "18-24"), (25, 34, "25-34"), (35, 44, "35-44"), (45, 54, "45-54")]
+SIZE_BUCKETS = [(0, 0, "0"), (1, 10, "1-10"), (11, 25, "11-25"), (26, 50, "26-50"), (51, 100, "51-100")]
+SIZE_LABELS = [label for _, _, label in SIZE_BUCKETS] + ["100+"]
+
+USERS_BATCH_QUERY = """
+MATCH (u:User)
+WHERE $after IS NULL OR u.id > $after
+WITH u ORDER BY u.id LIMIT $batch_size
+RETURN u.id AS key, u.gender AS gender, u.age AS age,
+       head([(u)-[:HAS_ORIENTATION]->(o) | o.name]) AS orientation
+"""
+
+PLAYLISTS_BATCH_QUERY = """
+MATCH (p:Playlist)
+WHERE $after IS NULL OR p.id > $after
+WITH p ORDER BY p.id LIMIT $batch_size
+RETURN p.id AS key, coalesce(p.song_count, 0) AS size
+"""
+
+GENRES_BATCH_QUERY = """
+MATCH (g:Genre)
+WHERE $after IS NULL OR g.name > $after
+WITH g ORDER BY g.name LIMIT $batch_size
+RETURN g.name AS key, coalesce(g.song_count, 0) AS song_count, coalesce(g.listener_count, 0) AS listener_count
+"""
+
+TOP_SONGS_QUERY = """
+MATCH (s:Song)
+WHERE s.like_count > 0
+RETURN s {.id, .title, .like_count} AS item
+ORDER BY s.like_count DESC, s.id
+LIMIT $limit
+"""
+
+TOP_SONGS_BY_GENRE_QUERY = """
+MATCH (:Genre {name: $genre})<-[:HAS_GENRE]-(s:Song)
+WHERE s.like_count > 0
+RETURN s {.id, .title, .like_count} AS item
+ORDER BY s.like_count DESC, s.id
+LIMIT $limit
+"""
+
+TOP_ARTISTS_QUERY = """
+MATCH (a:Artist)
+WHERE a.follower_count > 0
+RETURN a {.id, .name, .follower_count} AS item
+ORDER BY a.follower_count DESC, a.id
+LIMIT $limit
+"""
+
+LATEST_SNAPSHOT_QUERY = """
+MATCH (s:StatsSnapshot)
+RETURN s.version AS version, s.computed_at AS computed_at, s.data AS data
+ORDER BY s.version DESC
+LIMIT 1
+"""
+
+SAVE_SNAPSHOT_QUERY = """
+CREATE (s:StatsSnapshot {version: $version, computed_at: $computed_at, data: $data})
+WITH s
+MATCH (old:StatsSnapshot)
+WHERE old.version <= $version - $retention
+DELETE old
+"""
+
+
+def age_bucket(age) -> str:
+    if age is None:
+        return "unknown"
+    for low, high, label in AGE_BUCKETS:
+        if low <= age <= high:
+            return label
+    return "55+"
+
+
+def size_bucket(size: int) -> str:
+    for low, high, label in SIZE_BUCKETS:
+        if low <= size <= high:
+            return label
+    return SIZE_LABELS[-1]
+
+
+async def scan(connection, query, batch_size=None, query_name="stats.scan"):
+    """Parcours par clé (colonne `key`) en lots bornés : une transaction courte par lot."""
+    batch_size = batch_size or STATS_BATCH_SIZE
+    after = None
+    while True:
+        records = await connection.read(query, after=after, batch_size=batch_size, query_name=query_name)
+        for record in records:
+            yield record
+        if len(records) < batch_size:
+            return
+        after = records[-1]["key"]
+
+
+async def compute(connection, top_k=None):
+    """Calcule toutes les sections d'un instantané (sans version)."""
+    top_k = top_k or STATS_TOP_K
+    genders, ages, orientations = Counter(), Counter(), Counter()
+    async for record in scan(connection, USERS_BATCH_QUERY):
+        genders[record["gender"] or "unknown"] += 1
+        ages[age_bucket(record["age"])] += 1
+        orientations[record["orientation"] or "unknown"] += 1
+
+    sizes = Counter()
+    async for record in scan(connection, PLAYLISTS_BATCH_QUERY):
+        sizes[size_bucket(record["size"])] += 1
+
+    genres = [
+        {"name": r["key"], "song_count": r["song_count"], "listener_count": r["listener_count"]}
+        async for r in scan(connection, GENRES_BATCH_QUERY)
+    ]
+    genres.sort(key=lambda g: (-g["listener_count"], -g["song_count"], g["name"]))
+
+    top_songs_by_genre = {}
+    for genre in genres:
+        if genre["song_count"] > 0:
+            records = await connection.read(TOP_SONGS_BY_GENRE_QUERY, genre=genre["name"], limit=top_k, query_name="stats.compute")
+            top_songs_by_genre[genre["name"]] = [r["item"] for r in records]
+
+    return {
+        "genres": genres,
+        "top_songs": [r["item"] for r in await connection.read(TOP_SONGS_QUERY, limit=top_k, query_name="stats.compute")],
+        "top_songs_by_genre": top_songs_by_genre,
+        "top_artists": [r["item"] for r in await connection.read(TOP_ARTISTS_QUERY, limit=top_k, query_name="stats.compute")],
+        "playlist_sizes": {label: sizes[label] for label in SIZE_LABELS},
+        "users": {
+            "total": sum(genders.values()),
+            "by_gender": dict(genders),
+            "by_age": dict(ages),
+            "by_orientation": dict(orientations),
+        },
+    }
+
+
+def _age(computed_at: str) -> float:
+    return (datetime.now(timezone.utc) - datetime.fromisoformat(computed_at)).total_seconds()
+
+
+class StatsStore:
+    """Dernier instantané en mémoire ; les requêtes HTTP ne lisent que lui."""
+
+    def __init__(self, max_age: float = STATS_REFRESH_INTERVAL):
+        self.max_age = max_age
+        self.snapshot = None
+        self._lock = asyncio.Lock()
+
+    def _set(self, version, computed_at, data):
+        self.snapshot = {"version": version, "computed_at": computed_at, **data}
+
+    async def load_latest(self, connection):
+        records = await connection.read(LATEST_SNAPSHOT_QUERY, query_name="stats.load_latest")
+        if records:
+            record = records[0]
+            self._set(record["version"], record["computed_at"], json.loads(record["data"]))
+        return self.snapshot
+
+    async def refresh(self, connection, force: bool = False):
+        """
+        Recharge l'instantané le plus récent ; n'en calcule un nouveau que s'il est
+        plus vieux que `max_age` (ou si `force`).
+        """
+        async with self._lock:
+            latest = await self.load_latest(connection)
+            if latest is not None and not force and _age(latest["computed_at"]) < self.max_age:
+                return latest
+            if not await counter_status.refresh(connection):
+                # Compteurs de popularité pas encore initialisés : ils liraient 0
+                logger.warning("Stats snapshot skipped: counter migrations pending")
+                return latest
+            data = await compute(connection)
+            version = (latest["version"] if latest else 0) + 1
+            computed_at = datetime.now(timezone.utc).isoformat()
+            try:
+                await connection.write(
+                    SAVE_SNAPSHOT_QUERY, version=version, computed_at=computed_at,
+                    data=json.dumps(data), retention=STATS_SNAPSHOT_RETENTION, query_name="stats.refresh"
+                )
+            except ConstraintError:
+                # Un autre réplica a enregistré cette version entre-temps
+                return await self.load_latest(connection)
+            self._set(version, computed_at, data)
+            logger.info("Stats snapshot %d computed", version)
+            return self.snapshot
+
+    def publish(self, data):
+        """Instantané calculé localement (backend en mémoire), sans persistance."""
+        version = (self.snapshot["version"] if self.snapshot else 0) + 1
+        self._set(version, datetime.now(timezone.utc).isoformat(), data)
+
+    async def run_locally(self, compute):
+        while True:
+            try:
+                self.publish(compute())
+            except Exception as e:
+                logger.error("Stats refresh failed: %s", e)
+            await asyncio.sleep(self.max_age)
+
+    async def run_periodically(self, connection):
+        while True:
+            try:
+                await self.refresh(connection)
+            except Exception as e:
+                logger.error("Stats refresh failed: %s", e)
+            # Réveil à l'expiration de l'instantané partagé, quel que soit le réplica qui l'a produit
+            delay = self.max_age
+            if self.snapshot is not None:
+                delay = max(self.max_age - _age(self.snapshot["computed_at"]), 1.0)
+            await asyncio.sleep(delay)
+
+
+# Singleton servi par les endpoints /stats
+stats_store = StatsStore()
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__).parse_args()
+
+    async def run():
+        try:
+            return await stats_store.refresh(async_db, force=True)
+        finally:
+            await async_db.close()
+
+    snapshot = asyncio.run(run())
+    print(f"snapshot {snapshot['version']} computed at {snapshot['computed_at']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Versions par label et par entité pour les GET conditionnels (ETag / If-None-Match).
+
+La version d'un label est persistée dans un noeud `ResourceVersion` et incrémentée par
+chaque mutation ; chaque réplica relit ces versions toutes les `ETAG_SYNC_INTERVAL`
+secondes, ce qui borne la fenêtre pendant laquelle un autre réplica peut répondre 304
+sur une donnée modifiée ailleurs. La version d'une entité est la version du label lors
+de sa dernière modification locale ; une modification non attribuée (autre réplica,
+suppression en cascade) invalide toutes les entités du label.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+
+logger = logging.getLogger(__name__)
+
+ETAG_SYNC_INTERVAL = float(os.getenv("ETAG_SYNC_INTERVAL", "1"))
+
+BUMP_QUERY = """
+UNWIND $labels AS label
+MERGE (v:ResourceVersion {label: label})
+SET v.version = coalesce(v.version, 0) + 1
+RETURN label, v.version AS version
+"""
+
+SYNC_QUERY = "MATCH (v:ResourceVersion) RETURN v.label AS label, v.version AS version"
+
+
+class VersionRegistry:
+    def __init__(self):
+        self._labels = {}
+        # Version du label lors de la dernière modification non attribuée
+        self._floors = {}
+        self._entities = {}
+        # Sans synchronisation initiale, aucun ETag n'est émis
+        self.synced = False
+
+    def label_version(self, label: str):
+        return self._labels.get(label, 0) if self.synced else None
+
+    def entity_version(self, label: str, key):
+        if not self.synced:
+            return None
+        return self._entities.get((label, key), self._floors.get(label, 0))
+
+    def label_etag(self, label: str, query: str = ""):
+        """`query` : chaîne de requête normalisée d'une liste (page, taille, format)."""
+        version = self.label_version(label)
+        if version is None:
+            return None
+        if not query:
+            return f'"{label}-{version}"'
+        return f'"{label}-{version}-{hashlib.blake2b(query.encode(), digest_size=8).hexdigest()}"'
+
+    def entity_etag(self, label: str, key):
+        version = self.entity_version(label, key)
+        return None if version is None else f'"{label}-{version}"'
+
+    def _invalidate_label(self, label: str, version: int):
+        self._floors[label] = version
+        self._entities = {k: v for k, v in self._entities.items() if k[0] != label}
+
+    def _advance(self, label: str, version: int, attributed: bool):
+        known = self._labels.get(label, 0)
+        if not attributed or version > known + 1:
+            # Des modifications d'autres réplicas se sont intercalées
+            self._invalidate_label(label, version)
+        self._labels[label] = max(known, version)
+
+    def apply_sync(self, versions: dict):
+        for label, version in versions.items():
+            if version > self._labels.get(label, 0):
+                self._invalidate_label(label, version)
+                self._labels[label] = version
+        self.synced = True
+
+    async def sync(self, connection):
+        records = await connection.read(SYNC_QUERY, query_name="versions.sync")
+        self.apply_sync({record["label"]: record["version"] for record in records})
+
+    async def touch(self, connection, *resources):
+        """
+        Après une mutation réussie : `resources` sont des labels ("Song") ou des
+        entités (("Song", id)). Un label seul invalide toutes ses entités.
+        """
+        labels = sorted({r[0] if isinstance(r, tuple) else r for r in resources})
+        try:
+            records = await connection.write(BUMP_QUERY, labels=labels, query_name="versions.touch")
+        except Exception as e:
+            # Version inconnue : plus d'ETag jusqu'à la prochaine synchronisation
+            logger.error("Version bump failed for %s: %s", labels, e)
+            self.synced = False
+            return
+        versions = {record["label"]: record["version"] for record in records}
+        label_only = {r for r in resources if not isinstance(r, tuple)}
+        for label, version in versions.items():
+            self._advance(label, version, attributed=label not in label_only)
+        for resource in resources:
+            if isinstance(resource, tuple):
+                self._entities[resource] = self._labels[resource[0]]
+
+    async def run_sync(self, connection, interval: float = ETAG_SYNC_INTERVAL):
+        while True:
+            try:
+                await self.sync(connection)
+            except Exception as e:
+                logger.error("Version sync failed: %s", e)
+                self.synced = False
+            await asyncio.sleep(interval)
+
+
+def normalized_query(request: Request) -> str:
+    """Paramètres de requête triés : même ETag quel que soit leur ordre dans l'URL."""
+    return urlencode(sorted(request.query_params.multi_items()))
+
+
+def not_modified(request: Request, response: Response, etag, exists: bool = True):
+    """
+    Réponse 304 si le client détient déjà `etag` ; sinon pose l'en-tête ETag.
+    `*` ne vaut que si la ressource existe : sans `exists`, le 404 du handler l'emporte.
+    """
+    if etag is None:
+        return None
+    candidates = {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}
+    if etag in candidates or (exists and "*" in candidates):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
+
+
+# Singleton partagé par les handlers
+versions = VersionRegistry()
@@ -0,0 +1,68 @@
+"""
+Compare le débit du top-K compatible quand la requête bloque la boucle d'événements
+(driver synchrone appelé depuis une coroutine, ancien comportement) et quand elle passe
+par le driver asynchrone.
+
+    python -m benchmarks.concurrency --user-id <id> --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.crud import CRUD, TOP_COMPATIBLE_QUERY
+from app.database import db, async_db
+
+
+async def run_mode(call, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "throughput": requests / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    async def blocking_call():
+        # Ancien chemin : le driver synchrone occupe la boucle pendant toute la requête
+        with db.get_session() as session:
+            list(session.run(TOP_COMPATIBLE_QUERY, user_id=args.user_id, limit=args.limit))
+
+    async def async_call():
+        await CRUD._get_top_compatible_users_cypher(args.user_id, args.limit)
+
+    async def bench():
+        for name, call in (("blocking", blocking_call), ("async", async_call)):
+            stats = await run_mode(call, args.requests, args.concurrency)
+            print(
+                f"{name:>8}: {stats['throughput']:8.1f} req/s  "
+                f"p50 {stats['p50']:7.1f} ms  p95 {stats['p95']:7.1f} ms"
+            )
+        await async_db.close()
+
+    asyncio.run(bench())
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
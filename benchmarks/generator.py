@@ -0,0 +1,265 @@
+"""
+Graphe musical synthétique à popularité en loi de puissance : Users (avec orientation),
+Genres, Artists, Songs, Playlists et toutes les relations de l'API (LIKED, OWNS,
+CONTAINS, HAS_GENRE, LIKES_GENRE, FOLLOWS, HAS_ORIENTATION, COMPATIBLE_WITH).
+
+Les volumes sont proportionnels au nombre d'utilisateurs (10k à 1M) ; les relations sont
+tirées en vectoriel (numpy) et gardées sous forme d'indices, les identifiants n'étant
+matérialisés qu'au chargement. Tous les identifiants commencent par `bench_`.
+
+    python -m benchmarks.generator --users 100000 --load   # charge dans NEO4J_URI
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from app import bulk, counters
+from app.database import async_db
+from app.migrations import migrate
+from app.repositories import MemoryGraph
+
+PREFIX = "bench_"
+
+ORIENTATIONS = ["hetero", "homo", "bi"]
+ORIENTATION_WEIGHTS = [0.85, 0.07, 0.08]
+# (source, cible) -> score de la relation COMPATIBLE_WITH
+ORIENTATION_MATRIX = {
+    ("hetero", "hetero"): 1.0, ("hetero", "bi"): 0.6,
+    ("homo", "homo"): 1.0, ("homo", "bi"): 0.6,
+    ("bi", "bi"): 1.0, ("bi", "hetero"): 0.6, ("bi", "homo"): 0.6,
+}
+
+# Volumes par utilisateur
+SONGS_PER_USER = 2.0
+PLAYLISTS_PER_USER = 0.5
+ARTISTS_PER_USER = 0.05
+GENRES = 60
+
+
+def _zipf_cdf(size, exponent):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return np.cumsum(weights) / weights.sum()
+
+
+def _draw(rng, cdf, count):
+    """Rangs tirés selon la distribution cumulée `cdf` (rang 0 = le plus populaire)."""
+    return np.minimum(np.searchsorted(cdf, rng.random(count)), len(cdf) - 1)
+
+
+def _activity(rng, count, mean, cap):
+    """Nombre de relations par source : Pareto (queue lourde) de moyenne ~`mean`."""
+    return np.minimum(np.floor((rng.pareto(1.5, count) + 1) * mean / 3), cap).astype(np.int64)
+
+
+def _unique_pairs(sources, targets, width):
+    keys = np.unique(sources.astype(np.int64) * width + targets)
+    return keys // width, keys % width
+
+
+class SyntheticGraph:
+    def __init__(self, users, seed=1, likes_per_user=20, community_share=0.6):
+        rng = np.random.default_rng(seed)
+        self.counts = {
+            "User": users,
+            "Song": max(int(users * SONGS_PER_USER), 1),
+            "Playlist": max(int(users * PLAYLISTS_PER_USER), 1),
+            "Artist": max(int(users * ARTISTS_PER_USER), 1),
+            "Genre": GENRES,
+        }
+        songs, playlists = self.counts["Song"], self.counts["Playlist"]
+        genre_cdf = _zipf_cdf(GENRES, 1.0)
+        song_cdf = _zipf_cdf(songs, 1.0)
+
+        # Genre principal de chaque chanson ; les chansons d'un genre forment un bloc de `by_genre`
+        song_genre = _draw(rng, genre_cdf, songs)
+        by_genre = np.argsort(song_genre, kind="stable")
+        block_start = np.searchsorted(song_genre[by_genre], np.arange(GENRES))
+        block_size = np.diff(np.append(block_start, songs))
+
+        def community_songs(genres):
+            # Chanson uniforme dans le bloc du genre (genre sans chanson : tirage global)
+            size = block_size[genres]
+            picks = block_start[genres] + np.floor(rng.random(len(genres)) * np.maximum(size, 1)).astype(np.int64)
+            return np.where(size > 0, by_genre[np.minimum(picks, songs - 1)], _draw(rng, song_cdf, len(genres)))
+
+        def taste_songs(owner_genres):
+            community = rng.random(len(owner_genres)) < community_share
+            return np.where(community, community_songs(owner_genres), _draw(rng, song_cdf, len(owner_genres)))
+
+        self.user_orientation = rng.choice(len(ORIENTATIONS), size=users, p=ORIENTATION_WEIGHTS)
+        self.user_gender = rng.integers(0, 2, users)
+        self.user_age = rng.integers(18, 66, users)
+        favourite = _draw(rng, genre_cdf, users)
+
+        relationships = {}
+        extra = _activity(rng, users, 1.5, 5)
+        sources = np.concatenate([np.arange(users), np.repeat(np.arange(users), extra)])
+        targets = np.concatenate([favourite, _draw(rng, genre_cdf, int(extra.sum()))])
+        relationships["LIKES_GENRE"] = _unique_pairs(sources, targets, GENRES)
+
+        likes = _activity(rng, users, likes_per_user, 2000)
+        sources = np.repeat(np.arange(users), likes)
+        relationships["LIKED"] = _unique_pairs(sources, taste_songs(favourite[sources]), songs)
+
+        follows = _activity(rng, users, 3, 200)
+        sources = np.repeat(np.arange(users), follows)
+        artist_cdf = _zipf_cdf(self.counts["Artist"], 1.1)
+        relationships["FOLLOWS"] = _unique_pairs(sources, _draw(rng, artist_cdf, len(sources)), self.counts["Artist"])
+
+        # Chaque playlist a un propriétaire, choisi en proportion de son activité
+        weights = (likes + 1) / (likes + 1).sum()
+        owners = rng.choice(users, size=playlists, p=weights)
+        relationships["OWNS"] = (owners, np.arange(playlists))
+        sizes = _activity(rng, playlists, 15, 200) + 1
+        sources = np.repeat(np.arange(playlists), sizes)
+        relationships["CONTAINS"] = _unique_pairs(sources, taste_songs(favourite[owners][sources]), songs)
+
+        extra = _activity(rng, songs, 1, 2)
+        sources = np.concatenate([np.arange(songs), np.repeat(np.arange(songs), extra)])
+        targets = np.concatenate([song_genre, _draw(rng, genre_cdf, int(extra.sum()))])
+        relationships["HAS_GENRE"] = _unique_pairs(sources, targets, GENRES)
+
+        self.relationships = relationships
+        self.public = rng.random(playlists) < 0.7
+        self.song_duration = rng.integers(90, 420, songs)
+        self.song_explicit = rng.random(songs) < 0.15
+
+    # --- Identifiants et propriétés ---
+    @staticmethod
+    def key(label: str, index: int) -> str:
+        if label == "Genre":
+            return f"{PREFIX}genre_{index}"
+        return f"{PREFIX}{label[0].lower()}{index}"
+
+    def props(self, label: str, i: int) -> dict:
+        if label == "User":
+            return {"id": self.key("User", i), "name": f"User {i}", "gender": "MF"[self.user_gender[i]], "age": int(self.user_age[i])}
+        if label == "Song":
+            return {"id": self.key("Song", i), "title": f"Song {i}", "duration": int(self.song_duration[i]), "explicit": bool(self.song_explicit[i])}
+        if label == "Playlist":
+            return {"id": self.key("Playlist", i), "name": f"Playlist {i}", "public": bool(self.public[i]), "created": "2024-01-01"}
+        if label == "Artist":
+            return {"id": self.key("Artist", i), "name": f"Artist {i}"}
+        return {"name": self.key("Genre", i)}
+
+    def orientation(self, i: int) -> str:
+        return ORIENTATIONS[self.user_orientation[i]]
+
+    def entities(self, label: str):
+        return (self.props(label, i) for i in range(self.counts[label]))
+
+    def pairs(self, rel_type: str):
+        source_label, _, target_label, _ = bulk.RELATIONSHIPS[rel_type]
+        sources, targets = self.relationships[rel_type]
+        return (
+            (self.key(source_label, s), self.key(target_label, t))
+            for s, t in zip(sources.tolist(), targets.tolist())
+        )
+
+    def size(self) -> dict:
+        return {**self.counts, **{rel: len(pair[0]) for rel, pair in self.relationships.items()}}
+
+    def engine_input(self):
+        """Arguments de CompatibilityEngine.build (sans FOLLOWS de playlists, absent de l'API)."""
+        users = [self.props("User", i) for i in range(self.counts["User"])]
+        return (
+            users, list(self.pairs("LIKED")), list(self.pairs("LIKES_GENRE")), [],
+            list(self.pairs("OWNS")), list(self.pairs("CONTAINS")),
+        )
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def load(graph, chunk_size=5000):
+    """
+    Applique les migrations, charge le graphe par transactions UNWIND (requêtes de
+    l'import en masse) puis recalcule les compteurs.
+    """
+    await migrate()
+    await async_db.write(
+        """UNWIND $items AS item
+        MERGE (a:Orientation {name: item.source}) MERGE (b:Orientation {name: item.target})
+        MERGE (a)-[r:COMPATIBLE_WITH]->(b) SET r.score = item.score""",
+        items=[{"source": s, "target": t, "score": score} for (s, t), score in ORIENTATION_MATRIX.items()],
+        query_name="generator.load",
+    )
+    for label in ("Genre", "Artist", "Song", "Playlist"):
+        for chunk in _chunks(graph.entities(label), chunk_size):
+            await async_db.write(bulk.entity_query(label), items=[{"props": props, "index": 0} for props in chunk], query_name="generator.load")
+    users = ({"props": graph.props("User", i), "orientation": graph.orientation(i), "index": 0} for i in range(graph.counts["User"]))
+    for chunk in _chunks(users, chunk_size):
+        await async_db.write(bulk.USER_BULK_QUERY, items=chunk, query_name="generator.load")
+    for rel_type in bulk.RELATIONSHIPS:
+        query = bulk.relationship_query(rel_type)
+        for chunk in _chunks(graph.pairs(rel_type), chunk_size):
+            await async_db.write(query, items=[{"source": s, "target": t, "index": 0} for s, t in chunk], query_name="generator.load")
+    # Compteurs de similarité (CURATES, song_count...) recalculés depuis le graphe
+    await counters.repair()
+
+
+def to_memory(graph) -> MemoryGraph:
+    """Le même graphe dans le backend en mémoire (STORAGE_BACKEND=memory)."""
+    memory = MemoryGraph()
+    memory.orientation_scores = dict(ORIENTATION_MATRIX)
+    for label in ("Genre", "Artist", "Song", "Playlist", "User"):
+        for props in graph.entities(label):
+            memory.add_node(label, props["name"] if label == "Genre" else props["id"], props)
+    memory.orientations = {graph.key("User", i): graph.orientation(i) for i in range(graph.counts["User"])}
+    for rel_type in bulk.RELATIONSHIPS:
+        for source, target in graph.pairs(rel_type):
+            memory.add_edge(rel_type, source, target)
+    return memory
+
+
+async def clear(chunk_size=10000):
+    while True:
+        records = await async_db.write(
+            "MATCH (n) WHERE n.id STARTS WITH $prefix OR n.name STARTS WITH $prefix "
+            "WITH n LIMIT $limit DETACH DELETE n RETURN count(*) AS count",
+            prefix=PREFIX, limit=chunk_size, query_name="generator.clear",
+        )
+        if records[0]["count"] == 0:
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--load", action="store_true", help="charge le graphe dans NEO4J_URI")
+    parser.add_argument("--clear", action="store_true", help="supprime d'abord les noeuds bench_")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    graph = SyntheticGraph(args.users, args.seed)
+    print(f"generated in {time.perf_counter() - started:.1f} s: {graph.size()}")
+    if not (args.load or args.clear):
+        return
+
+    async def run():
+        try:
+            if args.clear:
+                await clear()
+            if args.load:
+                started = time.perf_counter()
+                await load(graph)
+                print(f"loaded in {time.perf_counter() - started:.1f} s")
+        finally:
+            await async_db.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
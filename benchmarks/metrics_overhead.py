@@ -0,0 +1,58 @@
+"""
+Mesure le surcoût de l'instrumentation (middleware HTTP, histogrammes) : latence d'une
+route sans base de données avec et sans métriques, et coût unitaire d'une observation.
+
+    python -m benchmarks.metrics_overhead --requests 5000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from app import metrics
+from app.main import app
+
+
+async def run_mode(enabled, requests):
+    metrics.METRICS_ENABLED = enabled
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(requests):
+            started = time.perf_counter()
+            await client.get("/")
+            latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies) * 1e6, statistics.mean(latencies) * 1e6
+
+
+def observe_cost(count):
+    histogram = metrics.Histogram("bench_seconds", "Benchmark.", ("route",))
+    started = time.perf_counter()
+    for i in range(count):
+        histogram.observe((i % 1000) / 1000, "/users/{user_id}/compatibility/top")
+    return (time.perf_counter() - started) / count * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--observations", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    # Échauffement, puis alternance pour lisser la dérive de la machine
+    asyncio.run(run_mode(True, 200))
+    results = {True: [], False: []}
+    for _ in range(3):
+        for enabled in (False, True):
+            results[enabled].append(asyncio.run(run_mode(enabled, args.requests)))
+    off = statistics.median(r[0] for r in results[False])
+    on = statistics.median(r[0] for r in results[True])
+    print(f"metrics off  p50 {off:8.1f} us")
+    print(f"metrics on   p50 {on:8.1f} us  (+{on - off:.1f} us, {(on - off) / off * 100:+.1f} %)")
+    print(f"histogram observe  {observe_cost(args.observations):.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
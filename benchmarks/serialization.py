@@ -0,0 +1,66 @@
+"""
+Compare le chemin de sérialisation par défaut (validation par le response_model puis
+encodeur JSON de FastAPI) au chemin rapide FAST_JSON_RESPONSES (orjson, sans
+re-validation) sur les grandes réponses : pages de chansons et de playlists, top-K.
+Le graphe synthétique est servi par le backend en mémoire : seul le coût Python de la
+réponse varie entre les deux modes.
+
+    python -m benchmarks.serialization --users 20000 --page 1000 --topk 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from app import main as app_main, serialization
+from app.main import app
+from app.repositories import memory_repositories
+from benchmarks.generator import SyntheticGraph, to_memory
+
+
+async def run_mode(fast, paths, requests):
+    serialization.FAST_JSON_RESPONSES = fast
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, path in paths.items():
+            latencies, body = [], None
+            for _ in range(requests):
+                started = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - started)
+                body = response.json()
+            results[name] = (statistics.median(latencies) * 1000, body)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=1000, help="taille des pages de liste")
+    parser.add_argument("--topk", type=int, default=500, help="longueur du top-K")
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    graph = SyntheticGraph(args.users)
+    app_main.repositories = memory_repositories(to_memory(graph))
+    paths = {
+        "list_songs": f"/songs/?limit={args.page}",
+        "list_playlists": f"/playlists/?limit={args.page}",
+        "top_compatible": f"/users/{graph.key('User', 0)}/compatibility/top?limit={args.topk}",
+    }
+
+    asyncio.run(run_mode(False, paths, 5))
+    default = asyncio.run(run_mode(False, paths, args.requests))
+    fast = asyncio.run(run_mode(True, paths, args.requests))
+    print(f"encoder: {'orjson' if serialization.orjson is not None else 'json (orjson absent)'}")
+    for name in paths:
+        before, after = default[name][0], fast[name][0]
+        same = "identical" if default[name][1] == fast[name][1] else "DIFFERENT BODIES"
+        print(f"{name:>16}  default {before:8.2f} ms  fast {after:8.2f} ms  x{before / after:5.2f}  {same}")
+
+
+if __name__ == "__main__":
+    main()
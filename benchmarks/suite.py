@@ -0,0 +1,208 @@
+"""
+Suite de benchmarks des endpoints sur un graphe synthétique (benchmarks.generator) :
+latences p50/p95/p99, débit et erreurs par scénario, écrits en JSON pour comparer les
+commits entre eux.
+
+    python -m benchmarks.generator --users 10000 --load        # Neo4j local (NEO4J_URI)
+    python -m benchmarks.suite --users 10000 --output before.json
+    python -m benchmarks.suite --users 10000 --baseline before.json --output after.json
+
+Par défaut l'application tourne dans le processus (ASGI, sans réseau) ; `--base-url`
+vise un serveur déjà démarré. `--backend engine` mesure le top-K sur le moteur creux en
+mémoire, `--backend memory` tous les scénarios HTTP sur le backend de dépôts en mémoire
+(STORAGE_BACKEND=memory), sans base de données. Les scénarios d'écriture créent puis suppriment leurs
+propres chansons : le graphe chargé est inchangé à la fin.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+
+from app.compatibility_engine import CompatibilityEngine
+from app.database import async_db
+from app import main as app_main
+from app.main import app
+from app.repositories import memory_repositories
+from benchmarks.generator import PREFIX, SyntheticGraph, to_memory
+
+# Variables d'environnement qui changent le chemin de calcul, recopiées dans le rapport
+RECORDED_ENV_PREFIXES = ("TOPK_", "LSH_", "COMPATIBILITY_", "ORIENTATION_", "NEO4J_MAX_POOL")
+
+
+def summarize(latencies, elapsed, errors):
+    values = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": float(np.percentile(values, 50)) if len(values) else None,
+        "p95_ms": float(np.percentile(values, 95)) if len(values) else None,
+        "p99_ms": float(np.percentile(values, 99)) if len(values) else None,
+        "max_ms": float(values.max()) if len(values) else None,
+    }
+
+
+async def measure(call, requests, concurrency):
+    """`call(i)` renvoie un statut HTTP (>= 400 compté en erreur)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status = await call(i)
+            except Exception:
+                status = 599
+            latencies.append(time.perf_counter() - started)
+            errors += status >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def http_scenarios(client, graph, rng, limit):
+    users, songs = graph.counts["User"], graph.counts["Song"]
+
+    def user():
+        return graph.key("User", rng.randrange(users))
+
+    def write_song(i):
+        return f"{PREFIX}w{i}"
+
+    async def request(method, path, **kwargs):
+        return (await client.request(method, path, **kwargs)).status_code
+
+    async def update_user(_):
+        i = rng.randrange(users)
+        payload = {**graph.props("User", i), "orientation": {"name": graph.orientation(i)}}
+        return await request("PUT", f"/users/{payload['id']}", json=payload)
+
+    # Ordre significatif : les écritures suppriment à la fin ce qu'elles ont créé
+    return [
+        ("top_compatible", lambda _: request("GET", f"/users/{user()}/compatibility/top", params={"limit": limit})),
+        ("user_compatibility", lambda _: request("POST", "/compatibility/", json={"user1_id": user(), "user2_id": user()})),
+        ("orientation_compatibility", lambda _: request("GET", "/compatibility/orientation", params={"user1_id": user(), "user2_id": user()})),
+        ("get_user", lambda _: request("GET", f"/users/{user()}")),
+        ("list_songs", lambda _: request("GET", "/songs/", params={"limit": 100, "after": graph.key("Song", rng.randrange(songs))})),
+        ("list_playlists", lambda _: request("GET", "/playlists/", params={"limit": 100})),
+        ("list_genres", lambda _: request("GET", "/genres/")),
+        ("create_song", lambda i: request("POST", "/songs/", json={"id": write_song(i), "title": "Bench", "duration": 200, "explicit": False})),
+        ("like_song", lambda i: request("POST", f"/users/{user()}/liked_songs/{write_song(i)}")),
+        ("update_user", update_user),
+        ("delete_song", lambda i: request("DELETE", f"/songs/{write_song(i)}")),
+    ]
+
+
+def engine_scenarios(graph, rng, limit):
+    started = time.perf_counter()
+    engine = CompatibilityEngine().build(*graph.engine_input())
+    print(f"engine built in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    async def top_compatible(_):
+        engine.top_compatible_users(graph.key("User", rng.randrange(graph.counts["User"])), limit)
+        return 200
+
+    return [("top_compatible", top_compatible)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, tolerance):
+    """Affiche l'écart de p95 par scénario ; renvoie les scénarios en régression."""
+    regressions = []
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        if not before or not before["p95_ms"] or result["p95_ms"] is None:
+            continue
+        delta = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"]
+        flag = "REGRESSION" if delta > tolerance else ""
+        print(f"{name:>26}  p95 {before['p95_ms']:8.2f} -> {result['p95_ms']:8.2f} ms  {delta:+7.1%}  {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+async def run_suite(args, graph):
+    rng = random.Random(args.seed)
+    if args.backend == "engine":
+        scenarios = engine_scenarios(graph, rng, args.limit)
+        return {name: await measure(call, args.requests, args.concurrency) for name, call in scenarios}
+    if args.backend == "memory":
+        started = time.perf_counter()
+        app_main.repositories = memory_repositories(to_memory(graph))
+        print(f"memory graph built in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    transport = None if args.base_url else httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url=args.base_url or "http://bench", timeout=60) as client:
+        results = {}
+        for name, call in http_scenarios(client, graph, rng, args.limit):
+            if args.only and name not in args.only:
+                continue
+            # Échauffement (plans en cache, pool ouvert) sur des écritures sans effet durable
+            if not name.endswith("_song"):
+                await measure(call, args.warmup, args.concurrency)
+            results[name] = await measure(call, args.requests, args.concurrency)
+            print(f"{name:>26}  p50 {results[name]['p50_ms']:8.2f} ms  p95 {results[name]['p95_ms']:8.2f} ms  {results[name]['throughput']:8.1f} req/s", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000, help="taille du graphe généré (doit correspondre au graphe chargé)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend", choices=["neo4j", "memory", "engine"], default="neo4j")
+    parser.add_argument("--base-url", help="serveur à mesurer (sinon application dans le processus)")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=10, help="taille du top-K")
+    parser.add_argument("--only", nargs="+", help="scénarios à exécuter")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="rapport JSON d'un commit précédent à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="hausse de p95 tolérée avant de signaler une régression")
+    args = parser.parse_args()
+
+    graph = SyntheticGraph(args.users, args.seed)
+
+    async def run():
+        try:
+            return await run_suite(args, graph)
+        finally:
+            await async_db.close()
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "graph": graph.size(),
+        "env": {k: v for k, v in os.environ.items() if k.startswith(RECORDED_ENV_PREFIXES)},
+        "results": asyncio.run(run()),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
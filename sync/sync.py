@@ -1,15 +1,42 @@
 import json
-from confluent_kafka import Consumer
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from confluent_kafka import Consumer, Producer
 import requests
+from requests.adapters import HTTPAdapter
 
-BASE_URL = (
-    "http://statistiques-service.stats.svc.cluster.local:8005"
+BASE_URL = os.getenv(
+    "STATS_BASE_URL", "http://statistiques-service.stats.svc.cluster.local:8005"
 )  # Base URL for FastAPI microservice
-KAFKA_BROKER = "kafka-service:9092"
+KAFKA_BROKER = os.getenv("KAFKA_BROKER", "kafka-service:9092")
 
+# "batch" : micro-lots coalescés par utilisateur ; "single" : un message à la fois
+SYNC_MODE = os.getenv("SYNC_MODE", "batch")
+BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "200"))
+BATCH_TIMEOUT_MS = int(os.getenv("SYNC_BATCH_TIMEOUT_MS", "500"))
+HTTP_WORKERS = int(os.getenv("SYNC_HTTP_WORKERS", "8"))
+MAX_RETRIES = int(os.getenv("SYNC_MAX_RETRIES", "5"))
+# Topic des événements invalides (vide : journalisés puis ignorés)
+DEAD_LETTER_TOPIC = os.getenv("SYNC_DEAD_LETTER_TOPIC", "")
 
-def process_user_create(data):
-    user_payload = {
+# Champ absent, mauvais type : l'événement ne sera jamais traitable, le rejouer ne sert à rien
+MALFORMED_EVENT_ERRORS = (KeyError, TypeError, AttributeError, ValueError)
+
+# Session HTTP partagée : connexions keep-alive réutilisées entre les événements
+http = requests.Session()
+http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_WORKERS))
+http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_WORKERS))
+
+
+class RetriableError(Exception):
+    pass
+
+
+def build_user_payload(data):
+    return {
         "id": str(data["userId"]),
         "name": f"{data['firstName']} {data['lastName']}",
         "gender": data["profil"]["information"]["gender"].capitalize(),
@@ -18,7 +45,11 @@ def process_user_create(data):
             "name": data["profil"]["information"]["orientation"].capitalize()
         },
     }
-    response = requests.post(f"{BASE_URL}/users/", json=user_payload)
+
+
+def process_user_create(data):
+    user_payload = build_user_payload(data)
+    response = http.post(f"{BASE_URL}/users/", json=user_payload)
     if response.status_code != 200:
         print(f"Failed to create user: {response.json()}")
     else:
@@ -26,16 +57,8 @@ def process_user_create(data):
 
 
 def process_user_update(data):
-    user_payload = {
-        "id": str(data["userId"]),
-        "name": f"{data['firstName']} {data['lastName']}",
-        "gender": data["profil"]["information"]["gender"].capitalize(),
-        "age": data["profil"]["information"]["age"],
-        "orientation": {
-            "name": data["profil"]["information"]["orientation"].capitalize()
-        },
-    }
-    response = requests.put(
+    user_payload = build_user_payload(data)
+    response = http.put(
         f"{BASE_URL}/users/{data['userId']}", json=user_payload
     )
     if response.status_code != 200:
@@ -46,21 +69,95 @@ def process_user_update(data):
 
 def process_user_delete(data):
     user_id = str(data["userId"])
-    response = requests.delete(f"{BASE_URL}/users/{user_id}")
+    response = http.delete(f"{BASE_URL}/users/{user_id}")
     if response.status_code != 200:
         print(f"Failed to delete user: {response.json()}")
     else:
         print(f"User deleted successfully: {response.json()}")
 
 
-def consume_kafka_events(KAFKA_BROKER):
-    consumer = Consumer(
+def coalesce(events, rejected=None):
+    """
+    Réduit une suite d'événements USER à une action par utilisateur, dans l'ordre
+    d'apparition : création et mises à jour fusionnent en un upsert (dernier état),
+    une suppression annule tout ce qui la précède. Un événement invalide est écarté
+    et ajouté à `rejected` sous la forme (contenu, raison).
+    """
+    actions = OrderedDict()
+    for event in events:
+        try:
+            event_type = event.get("eventType")
+            user_id = str(event["userId"])
+            payload = build_user_payload(event) if event_type in ("USER_CREATE", "USER_UPDATED") else None
+        except MALFORMED_EVENT_ERRORS as e:
+            reject(rejected, json.dumps(event).encode("utf-8"), f"invalid event: {e!r}")
+            continue
+        action = actions.setdefault(user_id, {"delete": False, "upsert": None})
+        if payload is not None:
+            action["upsert"] = payload
+        elif event_type == "USER_DELETED":
+            action["delete"] = True
+            action["upsert"] = None
+        else:
+            print(f"Unknown event type: {event_type}")
+    return actions
+
+
+def reject(rejected, value, reason):
+    print(f"Skipping malformed event ({reason}): {value[:200]!r}")
+    if rejected is not None:
+        rejected.append((value, reason))
+
+
+def dead_letter(producer, rejected):
+    """Publie les événements écartés avant le commit des offsets ; lève si l'envoi échoue."""
+    if producer is None or not rejected:
+        return
+    for value, reason in rejected:
+        producer.produce(DEAD_LETTER_TOPIC, value=value, headers={"error": reason})
+    if producer.flush(30) > 0:
+        raise RuntimeError("Dead-letter messages could not be delivered")
+
+
+def _check(response, action, user_id):
+    if response.status_code >= 500:
+        raise RetriableError(f"{action} {user_id}: HTTP {response.status_code}")
+    if response.status_code >= 400:
+        # Erreur client (ex. suppression d'un utilisateur absent) : rien à rejouer
+        print(f"Failed to {action} user {user_id}: {response.text}")
+
+
+def apply_action(user_id, action):
+    try:
+        if action["delete"]:
+            _check(http.delete(f"{BASE_URL}/users/{user_id}"), "delete", user_id)
+        if action["upsert"] is not None:
+            _check(http.put(f"{BASE_URL}/users/{user_id}", json=action["upsert"]), "upsert", user_id)
+    except requests.RequestException as e:
+        raise RetriableError(f"{user_id}: {e}") from e
+
+
+def send_batch(actions):
+    # Les actions d'un même utilisateur restent séquentielles ; les utilisateurs en parallèle
+    with ThreadPoolExecutor(max_workers=HTTP_WORKERS) as executor:
+        futures = [executor.submit(apply_action, user_id, action) for user_id, action in actions.items()]
+        for future in futures:
+            future.result()
+
+
+def create_consumer(broker, auto_commit=True):
+    return Consumer(
         {
-            "bootstrap.servers": KAFKA_BROKER,
+            "bootstrap.servers": broker,
             "group.id": "produits_service",
             "auto.offset.reset": "earliest",
+            "enable.auto.commit": auto_commit,
         }
     )
+
+
+def consume_kafka_events(KAFKA_BROKER):
+    consumer = create_consumer(KAFKA_BROKER)
     consumer.subscribe(["USER"])
     print("Starting Kafka consumer...")
     try:
@@ -72,20 +169,23 @@ def consume_kafka_events(KAFKA_BROKER):
                 print(f"Consumer error: {message.error()}")
                 continue
 
-            # Parse the message value
-            event = json.loads(message.value().decode("utf-8"))
-            event_type = event.get("eventType")
-            print(f"Processing event: {event_type}")
-
-            # Handle the event based on its type
-            if event_type == "USER_CREATE":
-                process_user_create(event)
-            elif event_type == "USER_UPDATED":
-                process_user_update(event)
-            elif event_type == "USER_DELETED":
-                process_user_delete(event)
-            else:
-                print(f"Unknown event type: {event_type}")
+            try:
+                # Parse the message value
+                event = json.loads(message.value().decode("utf-8"))
+                event_type = event.get("eventType")
+                print(f"Processing event: {event_type}")
+
+                # Handle the event based on its type
+                if event_type == "USER_CREATE":
+                    process_user_create(event)
+                elif event_type == "USER_UPDATED":
+                    process_user_update(event)
+                elif event_type == "USER_DELETED":
+                    process_user_delete(event)
+                else:
+                    print(f"Unknown event type: {event_type}")
+            except MALFORMED_EVENT_ERRORS as e:
+                reject(None, message.value(), f"invalid event: {e!r}")
 
     except KeyboardInterrupt:
         print("Consumer interrupted")
@@ -93,5 +193,54 @@ def consume_kafka_events(KAFKA_BROKER):
         consumer.close()  # Ensure the consumer is properly closed
 
 
-# Start consuming Kafka events
-consume_kafka_events(KAFKA_BROKER=KAFKA_BROKER)
+def consume_kafka_events_batched(KAFKA_BROKER):
+    # Offsets validés manuellement, seulement après l'envoi réussi du lot
+    consumer = create_consumer(KAFKA_BROKER, auto_commit=False)
+    consumer.subscribe(["USER"])
+    producer = Producer({"bootstrap.servers": KAFKA_BROKER}) if DEAD_LETTER_TOPIC else None
+    print("Starting batched Kafka consumer...")
+    try:
+        while True:
+            messages = consumer.consume(num_messages=BATCH_SIZE, timeout=BATCH_TIMEOUT_MS / 1000)
+            if not messages:
+                continue
+
+            events, rejected = [], []
+            for message in messages:
+                if message.error():
+                    print(f"Consumer error: {message.error()}")
+                    continue
+                try:
+                    events.append(json.loads(message.value().decode("utf-8")))
+                except (ValueError, UnicodeDecodeError) as e:
+                    reject(rejected, message.value(), f"malformed message: {e}")
+
+            # Un événement invalide est écarté seul : le lot n'est pas bloqué à chaque relecture
+            actions = coalesce(events, rejected)
+            for attempt in range(MAX_RETRIES):
+                try:
+                    send_batch(actions)
+                    break
+                except RetriableError as e:
+                    print(f"Batch failed (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
+                    time.sleep(min(2 ** attempt, 30))
+            else:
+                # Sans commit, le lot sera relu depuis le dernier offset validé au redémarrage
+                raise RuntimeError("Batch could not be delivered, stopping consumer")
+
+            dead_letter(producer, rejected)
+            consumer.commit(asynchronous=False)
+            print(f"Processed {len(events)} events as {len(actions)} user actions, {len(rejected)} rejected")
+
+    except KeyboardInterrupt:
+        print("Consumer interrupted")
+    finally:
+        consumer.close()
+
+
+if __name__ == "__main__":
+    # Start consuming Kafka events
+    if SYNC_MODE == "single":
+        consume_kafka_events(KAFKA_BROKER=KAFKA_BROKER)
+    else:
+        consume_kafka_events_batched(KAFKA_BROKER=KAFKA_BROKER)
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import admission, main
+from app.admission import AdmissionController, Limiter, Rejected, route_class
+from app.main import app
+from app.repositories import memory_repositories
+
+
+def test_route_classes():
+    assert route_class("GET", "/users/u1/compatibility/top") == "heavy"
+    assert route_class("POST", "/compatibility/batch") == "heavy"
+    assert route_class("GET", "/compatibility/orientation") == "heavy"
+    assert route_class("POST", "/users/u1/liked_songs/s1") == "write"
+    assert route_class("GET", "/songs/") == "read"
+    assert route_class("GET", "/health/ready") is None
+    assert route_class("GET", "/metrics") is None
+
+
+def test_queue_full_and_deadline():
+    async def scenario():
+        limiter = Limiter("heavy", concurrency=1, queue_size=1, queue_timeout=0.05)
+        await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as full:
+            await limiter.acquire()
+        assert full.value.reason == "queue_full"
+        with pytest.raises(Rejected) as late:
+            await waiting
+        assert late.value.reason == "deadline" and late.value.retry_after == 1
+        assert (limiter.active, limiter.queued) == (1, 0)
+
+    asyncio.run(scenario())
+
+
+def test_slot_handed_to_first_waiter():
+    async def scenario():
+        limiter = Limiter("write", concurrency=1, queue_size=5, queue_timeout=1)
+        await limiter.acquire()
+        order = []
+
+        async def wait(name):
+            await limiter.acquire()
+            order.append(name)
+
+        tasks = [asyncio.create_task(wait(name)) for name in ("a", "b")]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.sleep(0.01)
+        assert order == ["a"] and limiter.active == 1
+        tasks[1].cancel()
+        await asyncio.sleep(0.01)
+        limiter.release()
+        assert (limiter.active, limiter.queued) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_rejected_request_gets_retry_after(monkeypatch):
+    controller = AdmissionController({"heavy": (1, 0, 1.0), "write": (0, 0, 0), "read": (0, 0, 0)})
+    controller.limiters["heavy"].active = 1
+    monkeypatch.setattr(admission, "controller", controller)
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL", True)
+    monkeypatch.setattr(main, "repositories", memory_repositories())
+    client = TestClient(app)
+
+    response = client.get("/users/u1/compatibility/top")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json()["reason"] == "queue_full"
+    # Les autres classes ne sont pas touchées
+    assert client.get("/songs/").status_code == 200
+    body = client.get("/metrics").text
+    assert 'admission_rejections_total{route_class="heavy",reason="queue_full"}' in body
+    # Refusée avant le routage, la requête garde le modèle de sa route
+    assert 'http_request_errors_total{method="GET",route="/users/{user_id}/compatibility/top",status="503"}' in body
+
+
+def test_slot_held_until_streamed_body_is_sent(monkeypatch):
+    controller = AdmissionController({"heavy": (1, 0, 1.0), "write": (1, 0, 1.0), "read": (1, 0, 1.0)})
+    monkeypatch.setattr(admission, "controller", controller)
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL", True)
+    repositories = memory_repositories()
+    monkeypatch.setattr(main, "repositories", repositories)
+    client = TestClient(app)
+    client.post("/songs/", json={"id": "s1", "title": "Song", "duration": 200, "explicit": False})
+    client.post("/songs/", json={"id": "s2", "title": "Song", "duration": 200, "explicit": False})
+
+    stream, active = repositories.songs.stream, []
+
+    async def observed(after, limit):
+        async for item in stream(after, limit):
+            await asyncio.sleep(0.01)
+            active.append(controller.limiters["read"].active)
+            yield item
+
+    monkeypatch.setattr(repositories.songs, "stream", observed)
+    assert len(client.get("/songs/", params={"format": "ndjson"}).text.splitlines()) == 2
+    assert active == [1, 1]
+    assert controller.limiters["read"].active == 0
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+from app import cache as cache_module
+from app.cache import TopKCache
+
+
+def rows(*ids, score=10.0):
+    return [{"user": {"id": user_id}, "compatibility_score": score} for user_id in ids]
+
+
+def value(result, calls=None):
+    async def compute():
+        if calls is not None:
+            calls.append(1)
+        return result
+    return compute
+
+
+def get(cache, user_id, limit, result):
+    return asyncio.run(cache.get_or_compute(user_id, limit, value(result)))
+
+
+def test_disabled_cache_always_computes():
+    cache = TopKCache(maxsize=0)
+    calls = []
+    asyncio.run(cache.get_or_compute("a", 5, value(rows("b"), calls)))
+    asyncio.run(cache.get_or_compute("a", 5, value(rows("b"), calls)))
+    assert len(calls) == 2
+
+
+def test_hit_lru_eviction_and_ttl():
+    cache = TopKCache(maxsize=2, ttl=0.05)
+    get(cache, "a", 5, rows("b"))
+    get(cache, "b", 5, rows("a"))
+    assert get(cache, "a", 5, rows("x")) == rows("b")
+
+    get(cache, "c", 5, rows("a"))  # évince ("b", 5)
+    assert get(cache, "b", 5, rows("new")) == rows("new")
+
+    time.sleep(0.06)
+    assert get(cache, "a", 5, rows("fresh")) == rows("fresh")
+
+
+def test_invalidate_users_drops_owner_and_containing_entries():
+    cache = TopKCache(maxsize=10)
+    get(cache, "a", 5, rows("b"))
+    get(cache, "c", 5, rows("d"))
+    get(cache, "e", 5, rows("a"))
+
+    cache.invalidate_users({"a"})
+
+    assert get(cache, "a", 5, rows("z")) == rows("z")
+    assert get(cache, "e", 5, rows("z")) == rows("z")
+    assert get(cache, "c", 5, rows("z")) == rows("d")
+
+
+def test_invalidate_incomplete():
+    cache = TopKCache(maxsize=10)
+    get(cache, "a", 2, rows("b", "c"))
+    get(cache, "b", 5, rows("a"))
+    get(cache, "c", 1, rows("a", score=0))
+
+    cache.invalidate_incomplete()
+
+    assert len(cache) == 1
+    assert get(cache, "a", 2, []) == rows("b", "c")
+
+
+def test_stale_while_revalidate_runs_single_refresh():
+    cache = TopKCache(maxsize=10, ttl=0.01, stale_while_revalidate=True)
+    get(cache, "a", 5, rows("old"))
+    time.sleep(0.02)
+
+    async def scenario():
+        release = asyncio.Event()
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await release.wait()
+            return rows("new")
+
+        assert await cache.get_or_compute("a", 5, slow) == rows("old")
+        assert await cache.get_or_compute("a", 5, slow) == rows("old")
+        release.set()
+        await asyncio.gather(*cache._tasks)
+        assert await cache.get_or_compute("a", 5, slow) == rows("new")
+        return calls
+
+    assert len(asyncio.run(scenario())) == 1
+
+
+def test_invalidation_during_compute_is_not_cached():
+    cache = TopKCache(maxsize=10)
+
+    async def compute():
+        cache.invalidate_users({"a"})
+        return rows("stale")
+
+    asyncio.run(cache.get_or_compute("a", 5, compute))
+    assert len(cache) == 0
+
+
+def test_write_on_empty_cache_blocks_in_flight_result(monkeypatch):
+    cache = TopKCache(maxsize=10)
+    monkeypatch.setattr(cache_module, "topk_cache", cache)
+
+    async def compute():
+        # Écriture validée pendant le calcul, alors que le cache est encore vide
+        assert await cache_module.invalidate_related(users=["a"]) is None
+        return rows("stale")
+
+    asyncio.run(cache.get_or_compute("a", 5, compute))
+    assert len(cache) == 0
+
+    get(cache, "a", 5, rows("b"))
+    cache_module.invalidate_after_delete({"b"})
+    assert len(cache) == 0
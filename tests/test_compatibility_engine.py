@@ -0,0 +1,155 @@
+import random
+
+import pytest
+
+from app.compatibility_engine import CompatibilityEngine, cypher_round, is_available
+
+pytestmark = pytest.mark.skipif(not is_available(), reason="numpy/scipy non installés")
+
+
+def reference_score(target, other, graph):
+    """Réimplémentation naïve du motif Cypher d'origine (OWNS/CONTAINS), paire par paire."""
+    users, liked, genres, follows, owns, contains = graph
+
+    def rels(pairs, user):
+        return [key for u, key in pairs if u == user]
+
+    shared_genres = len(set(rels(genres, target)) & set(rels(genres, other)))
+    shared_songs = sum(rels(liked, other).count(s) for s in rels(liked, target))
+    shared_playlists = sum(rels(follows, other).count(p) for p in rels(follows, target))
+
+    def curated(user):
+        return {s for p in rels(owns, user) for q, s in contains if q == p}
+
+    def paths(user):
+        return sum(1 for p in rels(owns, user) for q, _ in contains if q == p)
+
+    def contains_rels(user, song):
+        return [i for p in rels(owns, user) for i, (q, s) in enumerate(contains) if q == p and s == song]
+
+    # Le motif OWNS/CONTAINS n'emprunte pas deux fois la même relation CONTAINS
+    personal = sum(
+        1 for song in curated(target) & curated(other)
+        if any(a != b for a in contains_rels(target, song) for b in contains_rels(other, song))
+    )
+    other_playlists = set(rels(owns, other))
+    common = sum(1 for p in rels(owns, target) if p in other_playlists for q, _ in contains if q == p)
+    total = paths(target) + paths(other)
+    similarity = common * 1.0 / (total - common) if total > 0 else 0
+    raw = (
+        (1 if shared_genres > 0 else 0) * 25
+        + min(shared_songs, 20) * 1.75
+        + min(shared_playlists, 10) * 1.5
+        + min(personal, 50) * 0.4
+        + similarity * 5
+    )
+    return cypher_round(min(raw, 100))
+
+
+def small_graph():
+    users = [{"id": "a", "name": "A"}, {"id": "b", "name": "B"}, {"id": "c", "name": "C"}]
+    liked = [("a", "s1"), ("a", "s2"), ("b", "s1"), ("b", "s2"), ("c", "s2")]
+    genres = [("a", "g1"), ("b", "g1"), ("c", "g2")]
+    follows = [("a", "p1"), ("b", "p1")]
+    owns = [("a", "pl1"), ("b", "pl1"), ("c", "pl2")]
+    contains = [("pl1", "s1"), ("pl1", "s3"), ("pl2", "s3")]
+    return users, liked, genres, follows, owns, contains
+
+
+def test_cypher_round_is_half_up():
+    assert cypher_round(2.145) == 2.15
+    assert cypher_round(0.125) == 0.13
+    assert cypher_round(35.8) == 35.8
+
+
+def test_top_compatible_users_small_graph():
+    engine = CompatibilityEngine().build(*small_graph())
+    result = engine.top_compatible_users("a", 5)
+
+    assert [r["user"]["id"] for r in result] == ["b", "c"]
+    assert result[0] == {
+        "user": {"id": "b", "name": "B"},
+        "shared_genres": 1,
+        "shared_songs": 2,
+        "shared_playlists": 1,
+        # s1 et s3 ne sont atteintes que par la playlist co-possédée pl1
+        "personal_playlist_matches": 0,
+        "compatibility_score": 35.0,
+    }
+    assert result[1]["compatibility_score"] == 2.15
+
+
+def test_unknown_user_and_limit():
+    engine = CompatibilityEngine().build(*small_graph())
+    assert engine.top_compatible_users("missing") == []
+    assert len(engine.top_compatible_users("a", 1)) == 1
+
+
+def test_matches_reference_on_random_graph():
+    rng = random.Random(42)
+    users = [{"id": f"u{i}"} for i in range(40)]
+    songs = [f"s{i}" for i in range(60)]
+    playlists = [f"p{i}" for i in range(15)]
+    liked = [(u["id"], rng.choice(songs)) for u in users for _ in range(rng.randint(0, 30))]
+    liked = list(dict.fromkeys(liked))
+    genres = list(dict.fromkeys((u["id"], f"g{rng.randint(0, 5)}") for u in users for _ in range(2)))
+    follows = list(dict.fromkeys((u["id"], rng.choice(playlists)) for u in users for _ in range(rng.randint(0, 4))))
+    owns = list(dict.fromkeys((u["id"], rng.choice(playlists)) for u in users for _ in range(rng.randint(0, 2))))
+    contains = list(dict.fromkeys((p, rng.choice(songs)) for p in playlists for _ in range(rng.randint(0, 10))))
+    graph = (users, liked, genres, follows, owns, contains)
+
+    engine = CompatibilityEngine().build(*graph)
+    for target in ("u0", "u7", "u21"):
+        result = engine.top_compatible_users(target, 10)
+        expected = sorted(
+            (reference_score(target, u["id"], graph) for u in users if u["id"] != target),
+            reverse=True,
+        )[:10]
+        assert [r["compatibility_score"] for r in result] == expected
+
+
+def test_candidates_restrict_scored_users():
+    engine = CompatibilityEngine().build(*small_graph())
+    result = engine.top_compatible_users("a", 5, candidates={"a", "c", "unknown"})
+    assert [r["user"]["id"] for r in result] == ["c"]
+    assert engine.top_compatible_users("a", 5, candidates=set()) == []
+
+
+def test_orientation_mask_restricts_scored_users():
+    users, *relations = small_graph()
+    users = [dict(u, orientation=o) for u, o in zip(users, ["hetero", "bi", "gay"])]
+    engine = CompatibilityEngine().build(users, *relations)
+    result = engine.top_compatible_users("a", 5, orientations=["bi", "gay"])
+    assert [r["user"]["id"] for r in result] == ["b", "c"]
+    assert "orientation" not in result[0]["user"]
+    assert [r["user"]["id"] for r in engine.top_compatible_users("a", 5, orientations=["gay"], exclude={"c"})] == []
+    assert [r["user"]["id"] for r in engine.top_compatible_users("a", 5, {"b"}, ["bi", "gay"])] == ["b"]
+
+
+def test_coowned_playlist_is_not_a_personal_match():
+    users = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    owns = [("a", "shared"), ("b", "shared"), ("a", "mine"), ("c", "theirs")]
+    contains = [("shared", "s1"), ("shared", "s2"), ("mine", "s2"), ("theirs", "s1")]
+    graph = (users, [], [], [], owns, contains)
+    engine = CompatibilityEngine().build(*graph)
+    rows = {r["user"]["id"]: r for r in engine.top_compatible_users("a", 5)}
+
+    # s1 : seule la playlist co-possédée, ignorée ; s2 : a l'atteint aussi par "mine"
+    assert rows["b"]["personal_playlist_matches"] == 1
+    assert rows["c"]["personal_playlist_matches"] == 1
+    for other in ("b", "c"):
+        assert rows[other]["compatibility_score"] == reference_score("a", other, graph)
+    _, _, _, personal, _ = engine.pair_scores([0], [1, 2])
+    assert personal.tolist() == [[1, 1]]
+
+
+def test_local_write_marks_engine_dirty(monkeypatch):
+    monkeypatch.setenv("COMPATIBILITY_ENGINE_MIN_RELOAD", "3600")
+    engine = CompatibilityEngine().build(*small_graph())
+    assert not engine.dirty and not engine.is_stale()
+    engine.mark_changed()
+    assert engine.dirty and not engine.is_stale()
+    engine.min_reload = 0
+    assert engine.is_stale()
+    engine.build(*small_graph())
+    assert not engine.dirty
@@ -0,0 +1,145 @@
+import asyncio
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import compatible_edges, main
+from app.compatibility_engine import CompatibilityEngine, is_available
+from app.main import app
+from app.repositories import memory_repositories
+from tests.test_compatibility_engine import reference_score
+
+pytestmark = pytest.mark.skipif(not is_available(), reason="numpy/scipy non installés")
+
+
+def random_graph(size=30, seed=7):
+    rng = random.Random(seed)
+    users = [{"id": f"u{i:02d}"} for i in range(size)]
+    songs = [f"s{i}" for i in range(40)]
+    playlists = [f"p{i}" for i in range(10)]
+    liked = list(dict.fromkeys((u["id"], rng.choice(songs)) for u in users for _ in range(rng.randint(0, 20))))
+    genres = list(dict.fromkeys((u["id"], f"g{rng.randint(0, 4)}") for u in users for _ in range(2)))
+    follows = list(dict.fromkeys((u["id"], rng.choice(playlists)) for u in users for _ in range(rng.randint(0, 4))))
+    owns = list(dict.fromkeys((u["id"], rng.choice(playlists)) for u in users for _ in range(rng.randint(0, 2))))
+    contains = list(dict.fromkeys((p, rng.choice(songs)) for p in playlists for _ in range(rng.randint(0, 8))))
+    return users, liked, genres, follows, owns, contains
+
+
+def all_edges(engine, block_size, threshold):
+    user_ids = engine.user_ids
+    order = sorted(range(len(user_ids)), key=user_ids.__getitem__)
+    blocks = (len(order) + block_size - 1) // block_size
+    edges = []
+    for block in range(blocks):
+        _, block_edges = compatible_edges.score_block(block, engine, order, block_size, threshold)
+        edges.extend(block_edges)
+    return edges
+
+
+def test_blocks_cover_each_pair_once():
+    graph = random_graph()
+    engine = CompatibilityEngine().build(*graph)
+    ids = [u["id"] for u in graph[0]]
+    expected = {
+        (a, b): reference_score(a, b, graph)
+        for i, a in enumerate(ids) for b in ids[i + 1:]
+        if reference_score(a, b, graph) >= 25
+    }
+
+    for block_size in (7, 30, 100):
+        edges = all_edges(engine, block_size, 25)
+        assert {(e["source"], e["target"]): e["score"] for e in edges} == expected
+        assert len(edges) == len(expected)
+
+
+def test_edges_match_top_compatible_users():
+    engine = CompatibilityEngine().build(*random_graph())
+    edges = all_edges(engine, 8, 0.01)
+    for target in ("u00", "u13"):
+        expected = {r["user"]["id"]: r for r in engine.top_compatible_users(target, 100) if r["compatibility_score"] >= 0.01}
+        for edge in edges:
+            if target not in (edge["source"], edge["target"]):
+                continue
+            other = edge["target"] if edge["source"] == target else edge["source"]
+            row = expected.pop(other)
+            assert edge["score"] == row["compatibility_score"]
+            assert edge["shared_songs"] == row["shared_songs"]
+            assert edge["personal_playlist_matches"] == row["personal_playlist_matches"]
+        assert expected == {}
+
+
+def test_fingerprint_ignores_order():
+    assert compatible_edges.fingerprint(["b", "a"]) == compatible_edges.fingerprint(["a", "b"])
+    assert compatible_edges.fingerprint(["a", "b"]) != compatible_edges.fingerprint(["a", "bc"])
+
+
+class FakeDB:
+    def __init__(self, checkpoint=None, versions=None):
+        self.checkpoint = checkpoint
+        self.versions = versions or {"User": 3, "Song": 5}
+        self.writes = []
+
+    async def read(self, query, **params):
+        if query == compatible_edges.SYNC_QUERY:
+            return [{"label": label, "version": version} for label, version in self.versions.items()]
+        return [{"checkpoint": self.checkpoint}] if self.checkpoint else []
+
+    async def write(self, query, **params):
+        self.writes.append((query, params))
+        if query == compatible_edges.DELETE_STALE_QUERY:
+            return [{"count": 0}]
+        return []
+
+    def edges(self):
+        return [e for query, params in self.writes if query == compatible_edges.WRITE_EDGES_QUERY for e in params["edges"]]
+
+
+def test_run_resumes_from_checkpoint(monkeypatch):
+    engine = CompatibilityEngine().build(*random_graph())
+    monkeypatch.setattr(compatible_edges, "load_engine", lambda: engine)
+    fake = FakeDB()
+    monkeypatch.setattr(compatible_edges, "async_db", fake)
+
+    summary = asyncio.run(compatible_edges.run(threshold=25, block_size=10, workers=1))
+    assert summary["blocks"] == 3 and summary["resumed_blocks"] == 0
+    assert summary["edges_written"] == len(fake.edges()) == len(all_edges(engine, 10, 25))
+    start = next(params for query, params in fake.writes if query == compatible_edges.START_CHECKPOINT_QUERY)
+    # Le nouveau calcul est publié avant la suppression de l'ancien
+    queries = [query for query, _ in fake.writes]
+    assert queries.index(compatible_edges.FINISH_CHECKPOINT_QUERY) < queries.index(compatible_edges.DELETE_STALE_QUERY)
+
+    # Reprise : mêmes paramètres, blocs 0 et 1 déjà écrits
+    checkpoint = {**start["props"], "status": "running", "completed": [0, 1]}
+    resumed = FakeDB(checkpoint)
+    monkeypatch.setattr(compatible_edges, "async_db", resumed)
+    summary = asyncio.run(compatible_edges.run(threshold=25, block_size=10, workers=1))
+    assert summary["run_id"] == checkpoint["run_id"] and summary["resumed_blocks"] == 2
+    assert resumed.edges() == compatible_edges.score_block(2, engine, sorted(range(30), key=engine.user_ids.__getitem__), 10, 25)[1]
+
+    # Paramètres différents : nouveau calcul complet
+    restarted = FakeDB(checkpoint)
+    monkeypatch.setattr(compatible_edges, "async_db", restarted)
+    summary = asyncio.run(compatible_edges.run(threshold=30, block_size=10, workers=1))
+    assert summary["run_id"] != checkpoint["run_id"] and summary["resumed_blocks"] == 0
+
+    # Mêmes utilisateurs, mais une chanson likée depuis : les blocs écrits sont périmés
+    changed = FakeDB(checkpoint, {"User": 3, "Song": 6})
+    monkeypatch.setattr(compatible_edges, "async_db", changed)
+    summary = asyncio.run(compatible_edges.run(threshold=25, block_size=10, workers=1))
+    assert summary["run_id"] != checkpoint["run_id"] and summary["resumed_blocks"] == 0
+
+
+def test_materialized_source_endpoint(monkeypatch):
+    monkeypatch.setattr(main, "repositories", memory_repositories())
+    client = TestClient(app)
+    client.post("/songs/", json={"id": "s0", "title": "Song", "duration": 200, "explicit": False})
+    for i in range(2):
+        client.post("/users/", json={"id": f"u{i}", "name": "n", "gender": "F", "age": 30, "orientation": {"name": "bi"}})
+        client.post(f"/users/u{i}/liked_songs/s0")
+
+    live = client.get("/users/u0/compatibility/top")
+    materialized = client.get("/users/u0/compatibility/top?source=materialized")
+    assert materialized.status_code == 200
+    assert materialized.json() == live.json()
+    assert client.get("/users/u0/compatibility/top?source=other").status_code == 422
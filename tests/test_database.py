@@ -0,0 +1,30 @@
+from neo4j import Bookmarks
+
+from app.database import _BookmarkTracker, async_db, db, driver_config, request_bookmarks
+
+
+def test_driver_config_reads_environment(monkeypatch):
+    monkeypatch.setenv("NEO4J_MAX_POOL_SIZE", "7")
+    monkeypatch.setenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", "2.5")
+    monkeypatch.setenv("NEO4J_DATABASE", "stats")
+    config = driver_config()
+    assert config["max_connection_pool_size"] == 7
+    assert config["connection_acquisition_timeout"] == 2.5
+    assert config["database"] == "stats"
+
+
+def test_bookmarks_follow_writes_and_request_context():
+    tracker = _BookmarkTracker()
+    context = {"incoming": ["FB:replica-b"], "outgoing": None}
+    token = request_bookmarks.set(context)
+    try:
+        tracker.record_write(Bookmarks.from_raw_values(["FB:write"]))
+        assert context["outgoing"] == ["FB:write"]
+        assert tracker.for_read().raw_values == {"FB:write", "FB:replica-b"}
+    finally:
+        request_bookmarks.reset(token)
+    assert tracker.for_read().raw_values == {"FB:write"}
+
+
+def test_sync_reads_follow_async_writes():
+    assert db.bookmarks is async_db.bookmarks
@@ -0,0 +1,132 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from neo4j import WRITE_ACCESS
+
+from app import health, main
+from app.counters import counter_status
+from app.health import Readiness
+from app.main import app
+from app.repositories import memory_repositories, neo4j_repositories
+
+
+class FakeResult:
+    async def consume(self):
+        return None
+
+
+class FakeSession:
+    def __init__(self, connection, mode):
+        self.connection = connection
+        self.mode = mode
+
+    async def __aenter__(self):
+        self.connection.open += 1
+        self.connection.peak = max(self.connection.peak, self.connection.open)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.connection.open -= 1
+
+    async def run(self, query, **params):
+        if self.connection.fail:
+            raise OSError("connection refused")
+        self.connection.queries.append((self.mode, query))
+        return FakeResult()
+
+
+class FakeConnection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.open = self.peak = 0
+        self.queries = []
+
+    def get_session(self, access_mode):
+        return FakeSession(self, access_mode)
+
+
+def test_warm_up_opens_pool_and_plans_hot_queries(monkeypatch):
+    monkeypatch.setattr(counter_status, "ready", True)
+    connection, readiness = FakeConnection(), Readiness()
+    asyncio.run(readiness.warm_up(connection, neo4j_repositories(), min_connections=3))
+    assert connection.peak == 3
+    planned = [q for _, q in connection.queries if q.startswith("EXPLAIN ")]
+    assert len(planned) == len(health.hot_queries(neo4j_repositories()))
+    assert (WRITE_ACCESS, "EXPLAIN " + health.UPSERT_USER_QUERY) in connection.queries
+    assert asyncio.run(readiness.check(connection, neo4j_repositories())) is None
+
+
+def test_failed_warm_up_still_finishes_but_database_check_fails(monkeypatch):
+    monkeypatch.setattr(counter_status, "ready", True)
+    connection, readiness = FakeConnection(fail=True), Readiness()
+    assert asyncio.run(readiness.check(connection, neo4j_repositories())) == "warming up"
+    asyncio.run(readiness.warm_up(connection, neo4j_repositories(), min_connections=2))
+    assert readiness.warmed_up
+    assert asyncio.run(readiness.check(connection, neo4j_repositories())).startswith("database unavailable")
+    readiness.draining = True
+    assert asyncio.run(readiness.check(connection, neo4j_repositories())) == "shutting down"
+
+
+def test_probe_endpoints(monkeypatch):
+    monkeypatch.setattr(main, "repositories", memory_repositories())
+    monkeypatch.setattr(main, "readiness", Readiness())
+    client = TestClient(app)
+    assert client.get("/health/live").status_code == 200
+    response = client.get("/health/ready")
+    assert response.status_code == 503 and response.json()["reason"] == "warming up"
+    asyncio.run(main.readiness.warm_up(None, main.repositories))
+    assert client.get("/health/ready").json()["status"] == "ready"
+
+
+def test_migrations_are_retried_before_readiness(monkeypatch):
+    calls, delays = [], []
+
+    async def migrate():
+        calls.append(True)
+        if len(calls) < 3:
+            raise OSError("connection refused")
+
+    async def no_sleep(delay):
+        delays.append(delay)
+
+    readiness = Readiness()
+    monkeypatch.setattr(health.asyncio, "sleep", no_sleep)
+    asyncio.run(readiness.apply_migrations(migrate, retry_delay=1, max_delay=1.5))
+    assert len(calls) == 3 and delays == [1, 1.5]
+    assert readiness.migrations_ready
+
+    readiness.migrations_ready = False
+    readiness.warmed_up = True
+    assert asyncio.run(readiness.check(None, memory_repositories())) == "applying migrations"
+
+
+class CounterMigrations:
+    """Migrations de compteurs enregistrées au deuxième passage (autre processus)."""
+
+    def __init__(self):
+        self.reads = 0
+
+    async def read(self, query, ids, query_name=None):
+        self.reads += 1
+        return [{"count": 0 if self.reads == 1 else len(ids)}]
+
+
+def test_not_ready_until_counter_migrations_are_recorded(monkeypatch):
+    monkeypatch.setattr(counter_status, "ready", False)
+    readiness = Readiness()
+    readiness.warmed_up = True
+    assert asyncio.run(readiness.check(FakeConnection(), neo4j_repositories())) == "counter migrations pending"
+
+    async def no_sleep(delay):
+        pass
+    monkeypatch.setattr(health.asyncio, "sleep", no_sleep)
+    connection = CounterMigrations()
+    asyncio.run(readiness.wait_for_counters(connection))
+    assert connection.reads == 2 and counter_status.ready
+    assert asyncio.run(readiness.check(FakeConnection(), neo4j_repositories())) is None
+
+
+def test_restricted_top_k_queries_are_planned():
+    queries = [query for _, query, _ in health.hot_queries(neo4j_repositories())]
+    assert health.TOP_COMPATIBLE_CANDIDATES_QUERY in queries
+    assert health.TOP_COMPATIBLE_ORIENTATION_QUERY in queries
@@ -0,0 +1,123 @@
+import asyncio
+import random
+
+import pytest
+
+from app.lsh import MinHashLSH, is_available
+
+pytestmark = pytest.mark.skipif(not is_available(), reason="numpy non installé")
+
+
+def tokens(prefix, n):
+    return {f"L:{prefix}{i}" for i in range(n)}
+
+
+def test_similar_users_are_candidates():
+    index = MinHashLSH(bands=16, rows=4).build([
+        ("a", tokens("s", 50)),
+        ("b", tokens("s", 48) | {"L:x"}),
+        ("c", tokens("t", 50)),
+    ])
+    assert index.candidates("a") == {"b"}
+    assert index.candidates("c") == set()
+
+
+def test_update_and_remove():
+    index = MinHashLSH(bands=16, rows=4).build([("a", tokens("s", 20)), ("b", tokens("t", 20))])
+    assert "b" not in index.candidates("a")
+
+    index.update("b", tokens("s", 20))
+    assert index.candidates("a") == {"b"}
+
+    index.remove("b")
+    assert index.candidates("a") == set()
+
+
+def test_add_and_remove_token():
+    index = MinHashLSH(bands=8, rows=2).build([("a", {"L:s1"}), ("b", set())])
+    assert index.candidates("a") == set()
+    index.add_token("b", "L:s1")
+    assert index.candidates("a") == {"b"}
+    index.remove_token("b", "L:s1")
+    assert index.candidates("a") == set()
+
+
+def test_fallback_sample_excludes_target():
+    index = MinHashLSH().build([(f"u{i}", {f"L:s{i}"}) for i in range(10)])
+    found = index.candidates("u0", fallback_sample=10, rng=random.Random(1))
+    assert "u0" not in found
+    assert len(found) == 9
+
+
+def test_invalidate_marks_stale():
+    index = MinHashLSH(max_age=3600).build([])
+    assert not index.is_stale()
+    index.invalidate()
+    assert index.is_stale()
+
+
+class FakeDB:
+    def __init__(self):
+        self.reads = 0
+
+    async def read(self, query, **params):
+        self.reads += 1
+        return [{"id": "a", "tokens": ["L:s1", "F:p1"]}, {"id": "b", "tokens": ["L:s1", "F:p1"]}]
+
+
+def test_stale_index_reloads_in_background(monkeypatch):
+    from app import crud, lsh
+
+    index = MinHashLSH(bands=8, rows=1)
+    fake = FakeDB()
+    monkeypatch.setattr(lsh, "lsh_index", index)
+    monkeypatch.setattr(crud, "lsh_index", index)
+    monkeypatch.setattr(crud, "async_db", fake)
+
+    async def scenario():
+        # Jamais construit : top-K exact pendant le chargement
+        assert crud.CRUD._lsh_candidates("a") is None
+        await index._reload_task
+        assert index.candidates("a") == {"b"}
+
+        # Index périmé : l'ancien reste servi, la reconstruction part en tâche de fond
+        index.invalidate()
+        assert crud.CRUD._lsh_candidates("a") == {"b"}
+        await index._reload_task
+        assert not index.is_stale()
+
+    asyncio.run(scenario())
+    assert fake.reads == 2
+
+
+class SlowDB(FakeDB):
+    """Instantané lu avant que `c` n'existe ; la reconstruction attend `release`."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def read(self, query, **params):
+        if params.get("user_ids") is None:
+            records = await super().read(query, **params)
+            await self.release.wait()
+            return records
+        return [{"id": u, "tokens": ["L:s1"]} for u in params["user_ids"] if u != "b"]
+
+
+def test_refreshes_during_rebuild_are_replayed():
+    index = MinHashLSH(bands=8, rows=1).build([("a", {"L:s1"}), ("b", {"L:s1"})])
+    fake = SlowDB()
+
+    async def scenario():
+        index.schedule_reload(fake)
+        await asyncio.sleep(0)
+        assert index.building
+        # Pendant la reconstruction : c est créé, b supprimé
+        await index.refresh_users(fake, ["b", "c"])
+        fake.release.set()
+        await index._reload_task
+
+    asyncio.run(scenario())
+    assert not index.building
+    assert index.candidates("a") == {"c"}
@@ -1,11 +1,27 @@
+import asyncio
+import json
+
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
-from app.database import db
+from app.database import db, async_db
+from app.crud import CRUD
+from app.compatibility_engine import CompatibilityEngine, cypher_round, is_available
+from app.migrations import check, migrate
+from app.counters import check as check_counters, counter_status, repair_playlists
+from app.stats import stats_store
+from app.versions import versions
 
 client = TestClient(app)
 
 
+@pytest.fixture(scope="module", autouse=True)
+def counters_initialized():
+    # Sans lifespan : migrations et compteurs initialisés une fois pour le module
+    asyncio.run(migrate())
+    asyncio.run(counter_status.refresh(async_db))
+
+
 # Fixtures pour les données de test
 @pytest.fixture
 def test_user():
@@ -59,6 +75,30 @@ def test_create_and_get_user(test_user):
     assert response.json()["id"] == test_user["id"]
 
 
+def test_upsert_user_is_idempotent(test_user):
+    response = client.put(f"/users/{test_user['id']}", json=test_user)
+    assert response.status_code == 200
+
+    updated = {**test_user, "name": "Renamed", "orientation": {"name": "bi"}}
+    for _ in range(2):
+        response = client.put(f"/users/{test_user['id']}", json=updated)
+        assert response.status_code == 200
+        assert response.json()["orientation"] == {"name": "bi"}
+
+    with db.get_session() as session:
+        record = session.run(
+            """MATCH (u:User {id: $id})
+            OPTIONAL MATCH (u)-[r:HAS_ORIENTATION]->()
+            RETURN count(DISTINCT u) AS users, count(r) AS orientations""",
+            id=test_user["id"]
+        ).single()
+    assert record["users"] == 1
+    assert record["orientations"] == 1
+
+    response = client.put("/users/other_id", json=test_user)
+    assert response.status_code == 400
+
+
 def test_delete_user(test_user):
     client.post("/users/", json=test_user)
     response = client.delete(f"/users/{test_user['id']}")
@@ -134,6 +174,24 @@ def test_update_song(test_song):
     assert response.json()["title"] == "Updated Song"
 
 
+def test_songs_keyset_pagination_and_stream(test_song):
+    for suffix in ("a", "b", "c"):
+        client.post("/songs/", json={**test_song, "id": f"test_song_{suffix}"})
+
+    response = client.get("/songs/", params={"after": "test_song_", "limit": 2})
+    assert response.status_code == 200
+    assert [song["id"] for song in response.json()] == ["test_song_a", "test_song_b"]
+    assert response.headers["X-Next-Cursor"] == "test_song_b"
+
+    response = client.get("/songs/", params={"after": "test_song_b", "limit": 2})
+    assert response.json()[0]["id"] == "test_song_c"
+
+    response = client.get("/songs/", params={"after": "test_song_", "limit": 3, "format": "ndjson"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [song["id"] for song in lines] == ["test_song_a", "test_song_b", "test_song_c"]
+
+
 def test_delete_song(test_song):
     client.post("/songs/", json=test_song)
     response = client.delete(f"/songs/{test_song['id']}")
@@ -169,6 +227,220 @@ def test_delete_playlist(test_playlist, test_user):
     assert response.json()["message"] == "Playlist deleted successfully"
 
 
+# Tests pour la compatibilité
+@pytest.mark.skipif(not is_available(), reason="numpy/scipy non installés")
+def test_compatibility_engine_matches_cypher(test_user, test_song, test_playlist, test_genre):
+    other = {**test_user, "id": "test_user_2", "name": "Other User"}
+    client.post("/users/", json=test_user)
+    client.post("/users/", json=other)
+    client.post("/songs/", json=test_song)
+    client.post("/genres/", json=test_genre)
+    client.post("/playlists/", json=test_playlist)
+    client.post(f"/playlists/{test_playlist['id']}/songs/{test_song['id']}")
+    for user in (test_user, other):
+        client.post(f"/users/{user['id']}/liked_songs/{test_song['id']}")
+        client.post(f"/users/{user['id']}/likes_genre/{test_genre['name']}")
+        client.post(f"/users/{user['id']}/owned_playlists/{test_playlist['id']}")
+
+    expected = asyncio.run(CRUD._get_top_compatible_users_cypher(test_user["id"], 100000))
+    with db.get_session() as session:
+        engine = CompatibilityEngine().load(session)
+    result = engine.top_compatible_users(test_user["id"], 100000)
+
+    def by_user(rows):
+        return {row["user"]["id"]: row for row in rows}
+
+    assert by_user(result) == by_user(expected)
+    assert by_user(result)["test_user_2"]["compatibility_score"] > 0
+
+
+@pytest.mark.skipif(not is_available(), reason="numpy/scipy non installés")
+def test_pair_scores_match_pair_cypher(test_user, test_song, test_playlist, test_genre):
+    # Playlist co-possédée (hors score personnel) et une playlist personnelle de chaque côté
+    other = {**test_user, "id": "test_user_2", "name": "Other User"}
+    other_song = {**test_song, "id": "test_song_2"}
+    for user in (test_user, other):
+        client.post("/users/", json=user)
+    for song in (test_song, other_song):
+        client.post("/songs/", json=song)
+    client.post("/genres/", json=test_genre)
+    client.post("/playlists/", json=test_playlist)
+    client.post(f"/playlists/{test_playlist['id']}/songs/{test_song['id']}")
+    for user in (test_user, other):
+        own = {**test_playlist, "id": f"{test_playlist['id']}_{user['id']}", "public": False}
+        client.post("/playlists/", json=own)
+        client.post(f"/playlists/{own['id']}/songs/{other_song['id']}")
+        client.post(f"/users/{user['id']}/owned_playlists/{own['id']}")
+        client.post(f"/users/{user['id']}/owned_playlists/{test_playlist['id']}")
+        client.post(f"/users/{user['id']}/liked_songs/{test_song['id']}")
+        client.post(f"/users/{user['id']}/likes_genre/{test_genre['name']}")
+
+    expected = client.post("/compatibility/", json={"user1_id": test_user["id"], "user2_id": other["id"]}).json()
+    with db.get_session() as session:
+        engine = CompatibilityEngine().load(session)
+    user_ids = engine.user_ids
+    songs, genres, playlists, personal, scores = engine.pair_scores(
+        [user_ids.index(test_user["id"])], [user_ids.index(other["id"])]
+    )
+
+    assert expected["personal_playlist_common_songs"] == int(personal[0, 0]) == 1
+    assert expected["shared_songs"] == int(songs[0, 0])
+    assert len(expected["shared_genres"]) == int(genres[0, 0])
+    assert expected["shared_playlists"] == int(playlists[0, 0])
+    assert expected["compatibility_score"] == cypher_round(scores[0, 0])
+
+
+def test_compatibility_batch(test_user):
+    other = {**test_user, "id": "test_user_2", "name": "Other User"}
+    client.post("/users/", json=test_user)
+    client.post("/users/", json=other)
+    pairs = [
+        {"user1_id": test_user["id"], "user2_id": other["id"]},
+        {"user1_id": test_user["id"], "user2_id": "test_unknown"},
+    ]
+    response = client.post("/compatibility/batch", json=pairs)
+    assert response.status_code == 200
+    items = response.json()
+    assert len(items) == 2
+
+    single = client.post("/compatibility/", json=pairs[0]).json()
+    assert items[0]["error"] is None
+    assert items[0]["result"] == single
+    assert items[1]["result"] is None
+    assert items[1]["error"] == "Users not found"
+
+
+def test_bulk_ingestion(test_user, test_song):
+    client.post("/songs/", json=test_song)
+    songs = [test_song, {**test_song, "id": "test_song_bulk"}]
+    response = client.post("/bulk/songs", json=songs)
+    assert response.status_code == 200
+    assert [item["status"] for item in response.json()["items"]] == ["existing", "created"]
+
+    response = client.post("/bulk/users", json=[test_user])
+    assert response.json()["created"] == 1
+
+    relations = [
+        {"source": test_user["id"], "target": "test_song_bulk"},
+        {"source": test_user["id"], "target": "test_song_bulk"},
+        {"source": test_user["id"], "target": "test_missing"},
+    ]
+    response = client.post("/bulk/relationships/LIKED", json=relations)
+    assert response.status_code == 200
+    assert [item["status"] for item in response.json()["items"]] == ["created", "existing", "missing"]
+
+
+def test_playlist_counters_match_repair(test_user, test_song, test_playlist):
+    other_song = {**test_song, "id": "test_song_2"}
+    client.post("/users/", json=test_user)
+    client.post("/songs/", json=test_song)
+    client.post("/songs/", json=other_song)
+    client.post("/playlists/", json=test_playlist)
+    client.post(f"/users/{test_user['id']}/owned_playlists/{test_playlist['id']}")
+    for song in (test_song, other_song):
+        client.post(f"/playlists/{test_playlist['id']}/songs/{song['id']}")
+    client.post(f"/playlists/{test_playlist['id']}/songs/{test_song['id']}")
+    client.delete(f"/playlists/{test_playlist['id']}/songs/{other_song['id']}")
+
+    def counters():
+        with db.get_session() as session:
+            return session.run(
+                """
+                MATCH (u:User {id: $user_id}), (p:Playlist {id: $playlist_id})
+                RETURN u.owned_song_count AS owned, p.song_count AS songs,
+                       [(u)-[c:CURATES]->(s) | [s.id, c.count]] AS curated
+                """,
+                user_id=test_user["id"], playlist_id=test_playlist["id"]
+            ).single().data()
+
+    incremental = counters()
+    assert incremental == {"owned": 1, "songs": 1, "curated": [[test_song["id"], 1]]}
+    asyncio.run(repair_playlists([test_playlist["id"]]))
+    assert counters() == incremental
+
+
+def test_compatibility_without_counters_matches(test_user, test_song, test_playlist, monkeypatch):
+    # Avant la migration 0004 : mêmes scores par les chemins OWNS/CONTAINS
+    other = {**test_user, "id": "test_user_2", "name": "Other User"}
+    for user in (test_user, other):
+        client.post("/users/", json=user)
+        own = {**test_playlist, "id": f"{test_playlist['id']}_{user['id']}"}
+        client.post("/playlists/", json=own)
+        client.post(f"/users/{user['id']}/owned_playlists/{own['id']}")
+        client.post(f"/users/{user['id']}/owned_playlists/{test_playlist['id']}")
+    client.post("/songs/", json=test_song)
+    for playlist_id in (test_playlist["id"], f"{test_playlist['id']}_{test_user['id']}", f"{test_playlist['id']}_{other['id']}"):
+        client.post(f"/playlists/{playlist_id}/songs/{test_song['id']}")
+
+    pair = {"user1_id": test_user["id"], "user2_id": other["id"]}
+    with_counters = client.post("/compatibility/", json=pair).json()
+    top = asyncio.run(CRUD._get_top_compatible_users_cypher(test_user["id"], 100000))
+    monkeypatch.setattr(counter_status, "ready", False)
+    assert client.post("/compatibility/", json=pair).json() == with_counters
+    assert asyncio.run(CRUD._get_top_compatible_users_cypher(test_user["id"], 100000)) == top
+    assert with_counters["personal_playlist_common_songs"] == 1 and with_counters["playlist_similarity"] > 0
+
+
+def test_popularity_counters(test_user, test_song, test_artist, test_genre):
+    other = {**test_user, "id": "test_user_2", "name": "Other User"}
+    for user in (test_user, other):
+        client.post("/users/", json=user)
+    client.post("/songs/", json=test_song)
+    client.post("/artists/", json=test_artist)
+    client.post("/genres/", json=test_genre)
+    for user in (test_user, other):
+        client.post(f"/users/{user['id']}/liked_songs/{test_song['id']}")
+        client.post(f"/users/{user['id']}/follows/{test_artist['id']}")
+        client.post(f"/users/{user['id']}/likes_genre/{test_genre['name']}")
+    client.post(f"/users/{test_user['id']}/liked_songs/{test_song['id']}")
+    client.post(f"/songs/{test_song['id']}/genres/{test_genre['name']}")
+    client.delete(f"/users/{test_user['id']}/follows/{test_artist['id']}")
+    client.delete(f"/users/{other['id']}")
+
+    songs = client.get("/songs/", params={"after": "test_", "limit": 1}).json()
+    assert songs[0]["id"] == test_song["id"]
+    assert songs[0]["like_count"] == 1
+    assert client.get(f"/artists/{test_artist['id']}").json()["follower_count"] == 0
+    genre = client.get(f"/genres/{test_genre['name']}").json()
+    assert (genre["song_count"], genre["listener_count"]) == (1, 1)
+    assert all(count == 0 for count in asyncio.run(check_counters()).values())
+
+
+def test_stats_snapshot(test_user, test_song):
+    client.post("/users/", json=test_user)
+    client.post("/songs/", json=test_song)
+    client.post(f"/users/{test_user['id']}/liked_songs/{test_song['id']}")
+    snapshot = asyncio.run(stats_store.refresh(async_db, force=True))
+
+    response = client.get("/stats/songs/top")
+    assert response.status_code == 200
+    assert response.json()["version"] == snapshot["version"]
+    assert {"id": test_song["id"], "title": test_song["title"], "like_count": 1} in response.json()["top_songs"]
+    assert client.get("/stats/users").json()["users"]["total"] >= 1
+
+
+def test_conditional_get(test_genre, test_user):
+    client.post("/genres/", json=test_genre)
+    client.post("/users/", json=test_user)
+    asyncio.run(versions.sync(async_db))
+
+    response = client.get(f"/genres/{test_genre['name']}")
+    etag = response.headers["etag"]
+    assert client.get(f"/genres/{test_genre['name']}", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post(f"/users/{test_user['id']}/likes_genre/{test_genre['name']}")
+    response = client.get(f"/genres/{test_genre['name']}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["listener_count"] == 1
+    versions.synced = False
+
+
+def test_schema_migrations_are_idempotent():
+    asyncio.run(migrate())
+    assert asyncio.run(migrate()) == []
+    assert asyncio.run(check()) == {"constraints": [], "indexes": [], "migrations": []}
+
+
 # Nettoyage après les tests
 @pytest.fixture(autouse=True)
 def cleanup():
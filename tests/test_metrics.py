@@ -0,0 +1,56 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app import metrics
+from app.database import _timed
+from app.main import app
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, "/a")
+    lines = histogram.samples()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{route="/a"} 4' in lines
+    assert 'test_seconds_sum{route="/a"} 6.05' in lines
+
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter("test_total", "Test.", ("query",))
+    counter.inc('a"b\\c')
+    assert counter.samples() == ['test_total{query="a\\"b\\\\c"} 1']
+
+
+def test_route_template_is_used_as_label():
+    client = TestClient(app)
+    client.get("/")
+    client.get("/does-not-exist")
+    body = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="GET",route="/"}' in body
+    assert 'http_request_errors_total{method="GET",route="unmatched",status="404"}' in body
+    assert 'http_requests_in_flight{method="GET"}' in body
+
+
+def test_query_label_is_explicit_or_from_context():
+    async def failing():
+        raise RuntimeError("boom")
+
+    async def caller(name=None, query_name=None):
+        token = metrics.query_name.set(name)
+        try:
+            await _timed("read", failing, query_name)
+        except RuntimeError:
+            pass
+        finally:
+            metrics.query_name.reset(token)
+
+    asyncio.run(caller())
+    asyncio.run(caller("song.delete"))
+    asyncio.run(caller("song.delete", "crud.explicit"))
+    assert ("unknown", "read") in metrics.NEO4J_QUERY_ERRORS._values
+    assert ("song.delete", "read") in metrics.NEO4J_QUERY_DURATION._values
+    assert ("crud.explicit", "read") in metrics.NEO4J_QUERY_DURATION._values
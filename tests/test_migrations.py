@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from app import migrations
+
+
+class FakeDB:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.recorded = []
+        self.statements = []
+
+    async def read(self, query, **params):
+        return [{"id": migration_id} for migration_id in self.recorded]
+
+    async def write(self, query, **params):
+        if self.fail_on and self.fail_on in query:
+            raise RuntimeError("constraint violation")
+        if "SchemaMigration {id: $id}" in query:
+            self.recorded.append(params["id"])
+        else:
+            self.statements.append(query)
+        return []
+
+
+def test_counter_migrations_each_run_their_own_repair(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(migrations, "async_db", fake)
+    calls = []
+
+    async def repair_similarity():
+        calls.append("similarity")
+
+    async def repair_popularity():
+        calls.append("popularity")
+    statements = dict(migrations.MIGRATIONS)
+    assert statements["0004_playlist_counters"] == [migrations.repair_similarity]
+    assert statements["0005_popularity_counters"] == [migrations.repair_popularity]
+    monkeypatch.setattr(migrations, "MIGRATIONS", [
+        ("0004_playlist_counters", [repair_similarity]),
+        ("0005_popularity_counters", [repair_popularity]),
+    ])
+    assert asyncio.run(migrations.migrate()) == ["0004_playlist_counters", "0005_popularity_counters"]
+    assert calls == ["similarity", "popularity"]
+    assert asyncio.run(migrations.migrate()) == [] and len(calls) == 2
+
+
+def test_failed_migration_raises(monkeypatch):
+    fake = FakeDB(fail_on="user_id_unique")
+    monkeypatch.setattr(migrations, "async_db", fake)
+    with pytest.raises(RuntimeError):
+        asyncio.run(migrations.migrate())
+    assert "0002_uniqueness_constraints" not in fake.recorded
+    assert "0003_playlist_public_index" not in fake.recorded
+
+
+def test_entity_dedupe_runs_before_constraints():
+    ids = [migration_id for migration_id, _ in migrations.MIGRATIONS]
+    assert ids.index("0001b_dedupe_entities") < ids.index("0002_uniqueness_constraints")
+    query = migrations.dedupe_query("Song", migrations.DUPLICATE_RELATIONSHIPS["Song"])
+    assert "MATCH (duplicate)<-[:LIKED]-(x) MERGE (keep)<-[:LIKED]-(x)" in query
+    assert "MATCH (duplicate)-[:HAS_GENRE]->(x) MERGE (keep)-[:HAS_GENRE]->(x)" in query
@@ -0,0 +1,110 @@
+import asyncio
+
+from app import crud, orientation
+from app.orientation import OrientationIndex
+from app.versions import VersionRegistry
+
+
+class FakeConnection:
+    def __init__(self, matrix, users):
+        self.matrix = matrix
+        self.users = sorted(users.items())
+
+    async def read(self, query, after=None, batch_size=None, query_name=None):
+        if batch_size is None:
+            return [{"source": s, "target": t, "score": score} for (s, t), score in self.matrix.items()]
+        rows = [{"key": k, "orientation": o} for k, o in self.users if after is None or k > after]
+        return rows[:batch_size]
+
+
+def load_index():
+    connection = FakeConnection(
+        {("hetero", "hetero"): 1.0, ("hetero", "bi"): 0.5, ("bi", "bi"): 1.0, ("hetero", "gay"): 0.0},
+        {"u1": "hetero", "u2": "bi", "u3": "gay", "u4": None},
+    )
+    return asyncio.run(OrientationIndex(max_age=60).load(connection))
+
+
+def test_score_known_and_unknown():
+    index = load_index()
+    assert index.score("u1", "u2") == (True, 0.5)
+    # Paire sans relation COMPATIBLE_WITH : connue mais incompatible
+    assert index.score("u2", "u3") == (True, None)
+    # Utilisateur sans orientation ou absent : retour à la base
+    assert index.score("u1", "u4") == (False, None)
+    assert index.score("u1", "unknown") == (False, None)
+
+
+def test_compatible_orientations_respects_min_score():
+    index = load_index()
+    assert index.compatible_orientations("u1") == ["bi", "hetero"]
+    assert index.compatible_orientations("u1", min_score=0.5) == ["hetero"]
+    assert index.compatible_orientations("unknown") is None
+
+
+def test_filter_candidates_keeps_unknown_users():
+    index = load_index()
+    assert index.filter_candidates("u1", ["hetero", "bi"], {"u1", "u2", "u3", "u4"}) == {"u2", "u4"}
+    assert index.filter_candidates("u1", ["bi"], {"u2", "u3", "new"}) == {"u2", "new"}
+    index.set_user("new", "gay")
+    assert index.filter_candidates("u1", ["bi"], {"u2", "u3", "new"}) == {"u2"}
+    index.remove_user("u2")
+    assert index.filter_candidates("u1", ["bi"], {"u2"}) == {"u2"}
+
+
+def test_unloaded_index_is_stale_and_unknown():
+    index = OrientationIndex(max_age=60)
+    assert index.is_stale()
+    assert index.score("u1", "u2") == (False, None)
+    assert index.compatible_orientations("u1") is None
+
+
+class OrientationDB:
+    """Orientations en base, différentes de celles de l'index (autre réplica)."""
+
+    def __init__(self, orientations):
+        self.orientations = orientations
+        self.reads = []
+
+    async def read(self, query, user_ids, query_name=None):
+        self.reads.append(sorted(user_ids))
+        return [{"key": u, "orientation": self.orientations[u]} for u in user_ids if u in self.orientations]
+
+
+def test_top_k_orientations_are_checked_in_database(monkeypatch):
+    index = load_index()
+    monkeypatch.setattr(crud, "orientation_index", index)
+    # u2 est passé à gay ailleurs, new (inconnu de l'index) est bi, u5 a été supprimé
+    fake = OrientationDB({"u2": "gay", "u3": "gay", "new": "bi"})
+    monkeypatch.setattr(crud, "async_db", fake)
+    scores = {"u2": 30, "u5": 20, "new": 10, "u3": 40}
+
+    async def rank(pool, rejected):
+        ranked = sorted(pool, key=scores.get, reverse=True)[:2]
+        return [{"user": {"id": u}, "compatibility_score": scores[u]} for u in ranked]
+
+    results = asyncio.run(crud.CRUD._top_with_orientations("u1", ["hetero", "bi"], set(scores), rank))
+    assert [r["user"]["id"] for r in results] == ["new"]
+    # u3 (gay connu) élagué sans lecture ; u2 corrigé dans l'index
+    assert fake.reads == [["u2", "u5"], ["new"]]
+    assert index.orientation("u2") == "gay"
+
+
+def test_remote_user_change_makes_orientation_stale(monkeypatch):
+    registry = VersionRegistry()
+    registry.apply_sync({"User": 4})
+    monkeypatch.setattr(orientation, "versions", registry)
+    index = load_index()
+    assert index.current("u1") and index.current("u2")
+    assert not index.current("unknown")
+
+    # Suppression de u2 sur un autre réplica, vue par la synchronisation ResourceVersion
+    registry.apply_sync({"User": 5})
+    assert not index.current("u1") and not index.current("u2")
+
+    fake = OrientationDB({"u1": "hetero"})
+    monkeypatch.setattr(crud, "orientation_index", index)
+    monkeypatch.setattr(crud, "async_db", fake)
+    assert asyncio.run(crud.CRUD.get_orientation_compatibility("u1", "u2")) is None
+    assert fake.reads[0] == ["u1", "u2"]
+    assert index.orientation("u2") is None and index.current("u1")
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+from fastapi.testclient import TestClient
+
+from app import metrics, profiling
+from app.main import app
+from neo4j import SummaryCounters
+
+
+class FakeSummary:
+    def __init__(self, profile=None):
+        self.result_available_after = 3
+        self.result_consumed_after = 4
+        self.counters = SummaryCounters({"nodes-created": 2})
+        self.profile = profile
+
+
+class FakeResult:
+    def __init__(self, rows, summary):
+        self.rows = rows
+        self.summary = summary
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for row in self.rows:
+            yield row
+
+    async def consume(self):
+        return self.summary
+
+
+class FakeTx:
+    def __init__(self, profile=None):
+        self.profile = profile
+        self.queries = []
+
+    async def run(self, query, **params):
+        self.queries.append(query)
+        return FakeResult([{"n": 1}], FakeSummary(self.profile if query.startswith("PROFILE") else None))
+
+
+PROFILE = {
+    "operatorType": "ProduceResults", "dbHits": 0, "rows": 1, "args": {},
+    "children": [{"operatorType": "NodeIndexSeek", "dbHits": 12, "rows": 1, "args": {"Details": "u:User(id)"}}],
+}
+
+
+def test_slow_queries_are_logged_with_redacted_parameters(monkeypatch, caplog):
+    monkeypatch.setattr(profiling, "SLOW_QUERY_THRESHOLD_MS", 0)
+    token = metrics.query_name.set("crud.test")
+    try:
+        with caplog.at_level(logging.WARNING, logger="app.profiling"):
+            records = asyncio.run(profiling.run(FakeTx(), "MATCH (u:User {id: $user_id})\n RETURN u", user_id="secret-id"))
+    finally:
+        metrics.query_name.reset(token)
+    assert records == [{"n": 1}]
+    message = caplog.records[0].getMessage()
+    assert "crud.test" in message and "available after 3 ms" in message
+    assert "'nodes_created': 2" in message
+    assert "<str[9]>" in message and "secret-id" not in message
+    assert ("crud.test",) in profiling.SLOW_QUERIES._values
+
+
+def test_sampled_queries_keep_hottest_plans(monkeypatch):
+    monkeypatch.setattr(profiling, "SLOW_QUERY_THRESHOLD_MS", -1)
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_PERCENT", 100)
+    monkeypatch.setattr(profiling, "plan_store", profiling.PlanStore(size=1))
+    tx = FakeTx(PROFILE)
+    asyncio.run(profiling.run(tx, "MATCH (u:User) RETURN u"))
+    asyncio.run(profiling.run(tx, "CREATE CONSTRAINT c IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE"))
+    assert tx.queries[0].startswith("PROFILE ")
+    assert not tx.queries[1].startswith("PROFILE")
+
+    plans = TestClient(app).get("/debug/queries").json()["plans"]
+    assert len(plans) == 1
+    assert plans[0]["total_db_hits"] == 12
+    assert plans[0]["plan"]["children"][0]["details"] == "u:User(id)"
@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.compatibility_engine import CompatibilityEngine
+from app.main import app
+from app.repositories import MemoryGraph, create_repositories, memory_repositories
+
+
+@pytest.fixture
+def client(monkeypatch):
+    graph = MemoryGraph()
+    graph.orientation_scores = {("hetero", "hetero"): 1.0, ("hetero", "bi"): 0.6}
+    monkeypatch.setattr(main, "repositories", memory_repositories(graph))
+    return TestClient(app)
+
+
+def user(user_id, orientation="hetero"):
+    return {"id": user_id, "name": user_id, "gender": "F", "age": 30, "orientation": {"name": orientation}}
+
+
+def test_entities_and_counters(client):
+    assert client.post("/genres/", json={"name": "rock"}).status_code == 200
+    for i in range(3):
+        client.post("/songs/", json={"id": f"s{i}", "title": f"Song {i}", "duration": 200, "explicit": False})
+    client.post("/users/", json=user("u1"))
+    assert client.post("/songs/s1/genres/rock").status_code == 201
+    assert client.post("/users/u1/liked_songs/s1").status_code == 201
+    assert client.post("/users/u1/liked_songs/missing").status_code == 404
+    assert client.post("/songs/", json={"id": "s1", "title": "Again", "duration": 1, "explicit": False}).status_code == 409
+
+    assert client.get("/genres/rock").json()["song_count"] == 1
+    page = client.get("/songs/", params={"limit": 2})
+    assert [s["id"] for s in page.json()] == ["s0", "s1"]
+    assert page.json()[1]["like_count"] == 1
+    assert page.headers["X-Next-Cursor"] == "s1"
+    assert [s["id"] for s in client.get("/songs/", params={"after": "s1"}).json()] == ["s2"]
+    lines = client.get("/songs/", params={"format": "ndjson"}).text.splitlines()
+    assert len(lines) == 3
+
+    # Suppression de l'utilisateur : relations détachées, compteurs à jour
+    assert client.delete("/users/u1").status_code == 200
+    assert client.get("/songs/", params={"limit": 2}).json()[1]["like_count"] == 0
+    assert client.delete("/users/u1").status_code == 404
+    assert client.put("/genres/rock", json={"name": "pop"}).status_code == 200
+    assert client.get("/genres/pop").json()["song_count"] == 1
+    assert client.get("/genres/rock").status_code == 404
+
+
+def test_genre_rename_to_existing_name_conflicts(client, monkeypatch):
+    client.post("/genres/", json={"name": "rock"})
+    client.post("/genres/", json={"name": "pop"})
+    response = client.put("/genres/rock", json={"name": "pop"})
+    assert response.status_code == 409
+    assert client.get("/genres/rock").status_code == 200
+
+    # Même correspondance côté Neo4j, où la contrainte d'unicité lève ConstraintError
+    from neo4j.exceptions import ConstraintError
+    from app.repositories import cypher, neo4j_repositories
+
+    class Conflict:
+        async def write(self, query, **params):
+            raise ConstraintError("Node already exists with label `Genre` and property `name` = 'pop'")
+
+    monkeypatch.setattr(cypher, "async_db", Conflict())
+    monkeypatch.setattr(main, "repositories", neo4j_repositories())
+    assert client.put("/genres/rock", json={"name": "pop"}).status_code == 409
+
+
+def test_compatibility(client):
+    for user_id, orientation in (("u1", "hetero"), ("u2", "bi"), ("u3", "hetero")):
+        client.post("/users/", json=user(user_id, orientation))
+    client.post("/genres/", json={"name": "rock"})
+    client.post("/songs/", json={"id": "s1", "title": "Song", "duration": 200, "explicit": False})
+    for user_id in ("u1", "u2"):
+        client.post(f"/users/{user_id}/likes_genre/rock")
+        client.post(f"/users/{user_id}/liked_songs/s1")
+
+    pair = client.post("/compatibility/", json={"user1_id": "u1", "user2_id": "u2"}).json()
+    assert pair["shared_genres"] == ["rock"] and pair["shared_songs"] == 1
+    top = client.get("/users/u1/compatibility/top", params={"limit": 2}).json()
+    assert [row["user"]["id"] for row in top] == ["u2", "u3"]
+    assert top[1]["compatibility_score"] == 0.0
+    batch = client.post("/compatibility/batch", json=[{"user1_id": "u1", "user2_id": "nobody"}]).json()
+    assert batch[0]["error"] == "Users not found"
+    assert client.get("/compatibility/orientation", params={"user1_id": "u1", "user2_id": "u2"}).json()["compatibility_score"] == 0.6
+    assert client.get("/compatibility/orientation", params={"user1_id": "u2", "user2_id": "u1"}).status_code == 404
+
+
+def test_bulk_statuses(client):
+    response = client.post("/bulk/songs", json=[
+        {"id": "s1", "title": "A", "duration": 1, "explicit": False},
+        {"id": "s1", "title": "A", "duration": 1, "explicit": False},
+    ])
+    assert response.json()["created"] == 1
+    client.post("/bulk/users", json=[user("u1")])
+    response = client.post("/bulk/relationships/LIKED", json=[
+        {"source": "u1", "target": "s1"}, {"source": "u1", "target": "s1"}, {"source": "u1", "target": "s9"},
+    ]).json()
+    assert (response["created"], response["existing"], response["missing"]) == (1, 1, 1)
+
+
+def test_memory_scores_match_engine():
+    users = [{"id": f"u{i}", "name": f"u{i}", "gender": "F", "age": 20 + i} for i in range(6)]
+    liked = [("u0", "s0"), ("u1", "s0"), ("u1", "s1"), ("u2", "s1"), ("u3", "s0"), ("u3", "s1")]
+    likes_genre = [("u0", "g0"), ("u1", "g0"), ("u4", "g0")]
+    owns = [("u0", "p0"), ("u1", "p1"), ("u2", "p2"), ("u3", "p0")]
+    contains = [("p0", "s0"), ("p0", "s1"), ("p1", "s1"), ("p2", "s2"), ("p2", "s0")]
+    engine = CompatibilityEngine().build(users, liked, likes_genre, [], owns, contains)
+
+    graph = MemoryGraph()
+    for props in users:
+        graph.add_node("User", props["id"], props)
+    for i in range(3):
+        graph.add_node("Song", f"s{i}", {"id": f"s{i}"})
+        graph.add_node("Playlist", f"p{i}", {"id": f"p{i}"})
+    graph.add_node("Genre", "g0", {"name": "g0"})
+    for rel_type, pairs in (("LIKED", liked), ("LIKES_GENRE", likes_genre), ("OWNS", owns), ("CONTAINS", contains)):
+        for source, target in pairs:
+            graph.add_edge(rel_type, source, target)
+
+    for user_id in ("u0", "u1", "u5"):
+        expected = {row["user"]["id"]: row["compatibility_score"] for row in engine.top_compatible_users(user_id, 5)}
+        actual = {row["user"]["id"]: row["compatibility_score"] for row in graph.top(user_id, 5)}
+        assert {u: s for u, s in actual.items() if s} == {u: s for u, s in expected.items() if s}
+        for other, score in expected.items():
+            assert graph.pair(user_id, other)["compatibility_score"] == score
+
+
+def test_stats_sections():
+    repositories = memory_repositories()
+    asyncio.run(repositories.genres.create({"name": "rock"}))
+    stats = repositories.compute_stats()
+    assert stats["genres"] == [{"name": "rock", "song_count": 0, "listener_count": 0}]
+    assert stats["users"]["total"] == 0
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_repositories("sqlite")
+
+
+def test_counter_writes_refused_before_counter_migrations(monkeypatch):
+    # Aucun Neo4j ici : le refus intervient avant toute requête
+    from app.counters import counter_status
+    from app.repositories import neo4j_repositories
+
+    monkeypatch.setattr(counter_status, "ready", False)
+    monkeypatch.setattr(main, "repositories", neo4j_repositories())
+    client = TestClient(app)
+    response = client.post("/users/u1/liked_songs/s1")
+    assert response.status_code == 503 and "Retry-After" in response.headers
+    assert client.delete("/playlists/p1/songs/s1").status_code == 503
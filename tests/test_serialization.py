@@ -0,0 +1,38 @@
+import json
+from datetime import date
+
+from fastapi.testclient import TestClient
+
+from app import main, serialization
+from app.main import app
+from app.repositories import memory_repositories
+
+
+class DriverDate:
+    def iso_format(self):
+        return "2024-01-01"
+
+
+def test_dumps_driver_types(monkeypatch):
+    assert json.loads(serialization.dumps({"created": DriverDate(), "day": date(2024, 1, 2)})) == {"created": "2024-01-01", "day": "2024-01-02"}
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert serialization.dumps([{"name": "é", "score": 1.5}]) == '[{"name":"é","score":1.5}]'.encode()
+
+
+def test_fast_path_keeps_bodies_and_headers(monkeypatch):
+    monkeypatch.setattr(main, "repositories", memory_repositories())
+    client = TestClient(app)
+    for i in range(3):
+        client.post("/songs/", json={"id": f"s{i}", "title": f"Song {i}", "duration": 200, "explicit": False})
+        client.post("/users/", json={"id": f"u{i}", "name": "n", "gender": "F", "age": 30, "orientation": {"name": "bi"}})
+        client.post(f"/users/u{i}/liked_songs/s0")
+
+    paths = ["/songs/?limit=2", "/songs/?after=s0", "/users/u0/compatibility/top?limit=5"]
+    default = [client.get(path) for path in paths]
+    monkeypatch.setattr(serialization, "FAST_JSON_RESPONSES", True)
+    fast = [client.get(path) for path in paths]
+    for before, after in zip(default, fast):
+        assert after.status_code == 200
+        assert after.headers["content-type"] == "application/json"
+        assert after.json() == before.json()
+    assert fast[0].headers["X-Next-Cursor"] == "s1"
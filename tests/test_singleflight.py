@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from neo4j import Bookmarks
+
+from app.database import async_db
+from app.singleflight import SingleFlight, flights, single_flight
+
+calls = []
+
+
+@single_flight
+async def compatibility(user1_id, user2_id, limit=5):
+    calls.append((user1_id, user2_id, limit))
+    await asyncio.sleep(0.01)
+    if user1_id == "boom":
+        raise RuntimeError("query failed")
+    return {"pair": (user1_id, user2_id, limit)}
+
+
+@pytest.fixture(autouse=True)
+def reset_calls():
+    calls.clear()
+
+
+def test_identical_concurrent_calls_share_one_execution():
+    async def scenario():
+        return await asyncio.gather(
+            compatibility("u1", "u2"), compatibility("u1", "u2", limit=5), compatibility(user1_id="u1", user2_id="u2"),
+            compatibility("u2", "u1"), compatibility("u1", "u2", 10),
+        )
+
+    results = asyncio.run(scenario())
+    # Arguments normalisés, mais l'ordre de la paire compte
+    assert calls == [("u1", "u2", 5), ("u2", "u1", 5), ("u1", "u2", 10)]
+    assert results[0] is results[1] is results[2]
+    assert len(flights) == 0
+
+
+def test_no_caching_after_completion_and_shared_errors():
+    async def scenario():
+        await compatibility("u1", "u2")
+        await compatibility("u1", "u2")
+        return await asyncio.gather(compatibility("boom", "u2"), compatibility("boom", "u2"), return_exceptions=True)
+
+    errors = asyncio.run(scenario())
+    assert len(calls) == 3
+    assert all(isinstance(e, RuntimeError) for e in errors)
+
+
+def test_write_bookmark_starts_new_flight(monkeypatch):
+    async def scenario():
+        first = asyncio.ensure_future(compatibility("u1", "u2"))
+        await asyncio.sleep(0)
+        monkeypatch.setattr(async_db.bookmarks, "last", Bookmarks.from_raw_values(["FB:after-write"]))
+        await asyncio.gather(first, compatibility("u1", "u2"))
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_shared_execution():
+    async def scenario():
+        group = SingleFlight()
+        started = []
+
+        async def compute():
+            started.append(1)
+            await asyncio.sleep(0.01)
+            return "done"
+
+        leaving = asyncio.ensure_future(group.do("key", compute))
+        staying = asyncio.ensure_future(group.do("key", compute))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        return await staying, started
+
+    assert asyncio.run(scenario()) == ("done", [1])
@@ -0,0 +1,92 @@
+import asyncio
+
+from app.counters import COUNTER_MIGRATIONS_QUERY, counter_status
+from app.stats import (
+    GENRES_BATCH_QUERY, PLAYLISTS_BATCH_QUERY, USERS_BATCH_QUERY, LATEST_SNAPSHOT_QUERY,
+    StatsStore, age_bucket, compute, size_bucket,
+)
+
+
+class FakeConnection:
+    """Graphe minimal : renvoie des lots selon la requête, sans Neo4j."""
+
+    def __init__(self, users, playlists, genres):
+        self.rows = {USERS_BATCH_QUERY: users, PLAYLISTS_BATCH_QUERY: playlists, GENRES_BATCH_QUERY: genres}
+        self.saved = []
+        self.batches = 0
+        self.counter_migrations = 2
+
+    async def read(self, query, **params):
+        if query in self.rows:
+            self.batches += 1
+            rows = sorted(self.rows[query], key=lambda r: r["key"])
+            rows = [r for r in rows if params["after"] is None or r["key"] > params["after"]]
+            return rows[:params["batch_size"]]
+        if query == LATEST_SNAPSHOT_QUERY:
+            return self.saved[-1:]
+        if query == COUNTER_MIGRATIONS_QUERY:
+            return [{"count": self.counter_migrations}]
+        return []
+
+    async def write(self, query, **params):
+        self.saved.append(params)
+
+
+def make_connection():
+    users = [
+        {"key": f"u{i}", "gender": "F" if i % 2 else "M", "age": 20 + i * 10, "orientation": "hetero"}
+        for i in range(5)
+    ]
+    playlists = [{"key": "p1", "size": 0}, {"key": "p2", "size": 12}, {"key": "p3", "size": 500}]
+    genres = [{"key": "rock", "song_count": 0, "listener_count": 1}, {"key": "pop", "song_count": 0, "listener_count": 3}]
+    return FakeConnection(users, playlists, genres)
+
+
+def test_buckets():
+    assert age_bucket(None) == "unknown"
+    assert age_bucket(17) == "<18"
+    assert age_bucket(30) == "25-34"
+    assert age_bucket(70) == "55+"
+    assert size_bucket(0) == "0"
+    assert size_bucket(100) == "51-100"
+    assert size_bucket(101) == "100+"
+
+
+def test_compute_scans_in_bounded_batches(monkeypatch):
+    monkeypatch.setattr("app.stats.STATS_BATCH_SIZE", 2)
+    connection = make_connection()
+    data = asyncio.run(compute(connection))
+    assert data["users"]["total"] == 5
+    assert data["users"]["by_gender"] == {"M": 3, "F": 2}
+    assert data["users"]["by_age"]["25-34"] == 1
+    assert data["playlist_sizes"]["0"] == 1
+    assert data["playlist_sizes"]["11-25"] == 1
+    assert data["playlist_sizes"]["100+"] == 1
+    assert [g["name"] for g in data["genres"]] == ["pop", "rock"]
+    # 5 utilisateurs, 3 playlists, 2 genres par lots de 2 (un lot plein appelle un lot suivant)
+    assert connection.batches == 3 + 2 + 2
+
+
+def test_refresh_reuses_fresh_snapshot(monkeypatch):
+    monkeypatch.setattr(counter_status, "ready", False)
+    connection = make_connection()
+    store = StatsStore(max_age=3600)
+    first = asyncio.run(store.refresh(connection))
+    assert first["version"] == 1
+    assert len(connection.saved) == 1
+
+    again = asyncio.run(store.refresh(connection))
+    assert again["version"] == 1
+    assert len(connection.saved) == 1
+
+    forced = asyncio.run(store.refresh(connection, force=True))
+    assert forced["version"] == 2
+
+
+def test_no_snapshot_before_counter_migrations(monkeypatch):
+    monkeypatch.setattr(counter_status, "ready", False)
+    connection = make_connection()
+    connection.counter_migrations = 1
+    store = StatsStore(max_age=3600)
+    assert asyncio.run(store.refresh(connection, force=True)) is None
+    assert connection.saved == [] and connection.batches == 0
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("confluent_kafka")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "sync"))
+
+from sync import coalesce  # noqa: E402
+
+
+def event(event_type, user_id, first_name="Ada"):
+    return {
+        "eventType": event_type,
+        "userId": user_id,
+        "firstName": first_name,
+        "lastName": "Lovelace",
+        "profil": {"information": {"gender": "female", "age": 36, "orientation": "hetero"}},
+    }
+
+
+def test_create_and_updates_collapse_into_one_upsert():
+    actions = coalesce([
+        event("USER_CREATE", 1),
+        event("USER_UPDATED", 1, "Augusta"),
+        event("USER_UPDATED", 2),
+    ])
+    assert list(actions) == ["1", "2"]
+    assert actions["1"]["delete"] is False
+    assert actions["1"]["upsert"]["name"] == "Augusta Lovelace"
+    assert actions["1"]["upsert"]["gender"] == "Female"
+
+
+def test_delete_cancels_previous_events():
+    actions = coalesce([event("USER_CREATE", 1), event("USER_UPDATED", 1), event("USER_DELETED", 1)])
+    assert actions["1"] == {"delete": True, "upsert": None}
+
+
+def test_recreate_after_delete_keeps_both_steps():
+    actions = coalesce([event("USER_DELETED", 1), event("USER_CREATE", 1, "New")])
+    assert actions["1"]["delete"] is True
+    assert actions["1"]["upsert"]["name"] == "New Lovelace"
+
+
+def test_malformed_events_are_rejected_alone():
+    rejected = []
+    broken = event("USER_UPDATED", 2)
+    del broken["profil"]["information"]["age"]
+    actions = coalesce([event("USER_CREATE", 1), {"eventType": "USER_CREATE"}, broken, ["not", "an", "event"]], rejected)
+    assert list(actions) == ["1"]
+    assert len(rejected) == 3
+    assert all(reason.startswith("invalid event") for _, reason in rejected)
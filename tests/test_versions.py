@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.versions import VersionRegistry, versions
+
+
+class FakeConnection:
+    """Versions persistées en mémoire ; un write direct simule un autre réplica."""
+
+    def __init__(self):
+        self.stored = {}
+
+    async def write(self, query, labels, query_name=None):
+        for label in labels:
+            self.stored[label] = self.stored.get(label, 0) + 1
+        return [{"label": label, "version": self.stored[label]} for label in labels]
+
+    async def read(self, query, query_name=None):
+        return [{"label": label, "version": version} for label, version in self.stored.items()]
+
+
+def test_no_etag_before_first_sync():
+    registry = VersionRegistry()
+    assert registry.label_etag("Song") is None
+    assert registry.entity_etag("Song", "s1") is None
+
+
+def test_local_touch_changes_only_that_entity():
+    connection = FakeConnection()
+    registry = VersionRegistry()
+    asyncio.run(registry.sync(connection))
+    before = (registry.label_etag("Song"), registry.entity_etag("Song", "s1"), registry.entity_etag("Song", "s2"))
+
+    asyncio.run(registry.touch(connection, ("Song", "s1")))
+    assert registry.label_etag("Song") != before[0]
+    assert registry.entity_etag("Song", "s1") != before[1]
+    assert registry.entity_etag("Song", "s2") == before[2]
+
+
+def test_remote_or_label_change_invalidates_all_entities():
+    connection = FakeConnection()
+    registry = VersionRegistry()
+    asyncio.run(registry.sync(connection))
+    s2 = registry.entity_etag("Song", "s2")
+
+    # Autre réplica
+    asyncio.run(connection.write(None, ["Song"]))
+    asyncio.run(registry.sync(connection))
+    assert registry.entity_etag("Song", "s2") != s2
+
+    s2 = registry.entity_etag("Song", "s2")
+    asyncio.run(registry.touch(connection, "Song"))
+    assert registry.entity_etag("Song", "s2") != s2
+
+
+@pytest.fixture
+def synced_versions():
+    versions.apply_sync({"Genre": 3})
+    yield versions
+    versions.synced = False
+
+
+def test_if_none_match_returns_304_without_database(synced_versions):
+    # Aucun Neo4j n'est joignable ici : un 304 prouve que la requête n'a pas été exécutée
+    client = TestClient(app)
+    etag = synced_versions.label_etag("Genre")
+    response = client.get("/genres/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+    etag = synced_versions.entity_etag("Genre", "Rock")
+    assert client.get("/genres/Rock", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_list_etags_vary_with_query(synced_versions):
+    client = TestClient(app)
+    etag = synced_versions.label_etag("Genre", "format=ndjson&limit=2")
+    assert etag != synced_versions.label_etag("Genre")
+    assert etag != synced_versions.label_etag("Genre", "format=ndjson&limit=3")
+    response = client.get("/genres/?limit=2&format=ndjson", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+
+def test_if_none_match_star_requires_existing_entity(synced_versions, monkeypatch):
+    from app import main
+    from app.repositories import memory_repositories
+
+    monkeypatch.setattr(main, "repositories", memory_repositories())
+    client = TestClient(app)
+    assert client.get("/playlists/missing", headers={"If-None-Match": "*"}).status_code == 404
+
+    client.post("/playlists/", json={"id": "p1", "name": "Mix", "public": True, "created": "2024-01-01"})
+    assert client.get("/playlists/p1", headers={"If-None-Match": "*"}).status_code == 304
+    assert client.get("/genres/", headers={"If-None-Match": "*"}).status_code == 304